@@ -0,0 +1,171 @@
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Sequence, Set, Tuple
+
+from sqlalchemy import case, func, insert, tuple_, update
+from sqlalchemy.orm import Session
+
+from app.core.cache import invalidate_on_commit
+from app.core.config import settings
+from app.db.bulk import chunked, upsert
+from app.db.models import Analytics, BiometricMonthlyStats, DirtySeries
+
+# (patient_id, type, bucket) → [count, sum, min, max]
+Partials = Dict[Tuple[int, str, datetime], List[float]]
+
+STATS_KEY = ("patient_id", "type", "bucket")
+
+PERCENTILES = (10, 50, 90, 95)   # written as <type>_p<N> by the numpy engine
+
+
+def type_name(btype) -> str:
+    """``BiometricType.glucose`` and ``"glucose"`` both become ``"glucose"``."""
+    return getattr(btype, "value", btype)
+
+
+def hour_bucket(ts: datetime) -> datetime:
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+
+def day_bucket(ts: datetime) -> datetime:
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def month_bucket(ts: datetime) -> datetime:
+    return ts.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def fold_readings(
+    rows: Iterable[Tuple[int, str, datetime, float]],
+    partials: Partials = None,
+    bucket: Callable[[datetime], datetime] = hour_bucket,
+) -> Partials:
+    """Fold (patient_id, type, timestamp, value) rows into per-bucket partial aggregates."""
+    partials = {} if partials is None else partials
+    for patient_id, btype, ts, value in rows:
+        key = (patient_id, type_name(btype), bucket(ts))
+        acc = partials.get(key)
+        if acc is None:
+            partials[key] = [1, value, value, value]
+        else:
+            acc[0] += 1
+            acc[1] += value
+            if value < acc[2]: acc[2] = value
+            if value > acc[3]: acc[3] = value
+    return partials
+
+
+def merge_stats(session: Session, model, partials: Dict[tuple, List[float]], key: Sequence[str] = STATS_KEY) -> None:
+    """Add partial aggregates into a stats table (count/sum add, min/max combine)."""
+    table = model.__table__
+    rows = [
+        {**dict(zip(key, k)), "count": c, "sum": s, "min": mn, "max": mx}
+        for k, (c, s, mn, mx) in partials.items()
+    ]
+
+    def merge(excluded):
+        return {
+            "count": table.c.count + excluded.count,
+            "sum": table.c.sum + excluded.sum,
+            "min": case((excluded.min < table.c.min, excluded.min), else_=table.c.min),
+            "max": case((excluded.max > table.c.max, excluded.max), else_=table.c.max),
+        }
+
+    for chunk in chunked(rows, 1000):
+        upsert(session, table, chunk, key, merge)
+
+
+def refresh_analytics(session: Session, series: Set[Tuple[int, str]], computed_at: datetime) -> int:
+    """Recompute min/max/avg for the given (patient_id, type) series from the monthly rollup.
+
+    Cost is proportional to the number of months of data of the touched
+    patients, not to the number of raw readings. With ``ANALYTICS_ENGINE="numpy"``
+    the series are recomputed from raw readings by the columnar engine instead,
+    which adds dispersion, percentile, time-in-range and trend metrics.
+    """
+    if settings.ANALYTICS_ENGINE == "numpy":
+        from app.analytics.vectorized import refresh_series
+        return refresh_series(session, series, computed_at)
+
+    metrics: Dict[Tuple[int, str], float] = {}
+    for chunk in chunked(sorted({pid for pid, _ in series}), 500):
+        rows = (
+            session.query(
+                BiometricMonthlyStats.patient_id,
+                BiometricMonthlyStats.type,
+                func.sum(BiometricMonthlyStats.count),
+                func.sum(BiometricMonthlyStats.sum),
+                func.min(BiometricMonthlyStats.min),
+                func.max(BiometricMonthlyStats.max),
+            )
+            .filter(BiometricMonthlyStats.patient_id.in_(chunk))
+            .group_by(BiometricMonthlyStats.patient_id, BiometricMonthlyStats.type)
+            .all()
+        )
+        for pid, typ, count, total, mn, mx in rows:
+            if (pid, typ) not in series:
+                continue
+            metrics[(pid, f"{typ}_min")] = mn
+            metrics[(pid, f"{typ}_max")] = mx
+            metrics[(pid, f"{typ}_avg")] = total / count
+
+    write_metrics(session, metrics, computed_at)
+    return len(metrics)
+
+
+def write_metrics(session: Session, metrics: Dict[Tuple[int, str], float], computed_at: datetime) -> None:
+    """Insert ``Analytics`` rows for ``computed_at``, overwriting values already written for it."""
+    invalidate_on_commit(session, "analytics", {pid for pid, _ in metrics})
+    to_insert, to_update = [], []
+    for chunk in chunked(list(metrics.items()), 500):
+        keys = [(pid, name, computed_at) for (pid, name), _ in chunk]
+        existing = {
+            (pid, name): row_id
+            for pid, name, row_id in session.query(Analytics.patient_id, Analytics.metric_name, Analytics.id).filter(
+                tuple_(Analytics.patient_id, Analytics.metric_name, Analytics.computed_at).in_(keys)
+            )
+        }
+        for (pid, name), value in chunk:
+            row_id = existing.get((pid, name))
+            if row_id is not None:
+                to_update.append({"id": row_id, "value": value})
+            else:
+                to_insert.append({"patient_id": pid, "metric_name": name, "value": value, "computed_at": computed_at})
+    # one executemany statement each
+    if to_update:
+        session.execute(update(Analytics), to_update)
+    if to_insert:
+        session.execute(insert(Analytics), to_insert)
+
+
+def mark_dirty(session: Session, series: Iterable[Tuple[int, str]]) -> None:
+    """Queue (patient_id, type) series for the next v1 analytics run, in the caller's transaction."""
+    now = datetime.utcnow()
+    rows = [
+        {"patient_id": pid, "type": typ, "version": 1, "marked_at": now}
+        for pid, typ in sorted({(pid, type_name(typ)) for pid, typ in series})
+    ]
+    table = DirtySeries.__table__
+    for chunk in chunked(rows, 1000):
+        upsert(
+            session, table, chunk, ("patient_id", "type"),
+            lambda excluded: {"version": table.c.version + 1, "marked_at": excluded.marked_at},
+        )
+
+
+def dirty_series(session: Session, after_id: int, up_to_id: int, limit: int) -> List[Tuple[int, int, str, int]]:
+    """Next ``limit`` queued series as (id, patient_id, type, version), by id."""
+    return (
+        session.query(DirtySeries.id, DirtySeries.patient_id, DirtySeries.type, DirtySeries.version)
+        .filter(DirtySeries.id > after_id, DirtySeries.id <= up_to_id)
+        .order_by(DirtySeries.id)
+        .limit(limit)
+        .all()
+    )
+
+
+def clear_dirty(session: Session, drained: Sequence[Tuple[int, str, int]]) -> None:
+    """Dequeue (patient_id, type, version) series, unless they were marked again meanwhile."""
+    for chunk in chunked(list(drained), 500):
+        session.query(DirtySeries).filter(
+            tuple_(DirtySeries.patient_id, DirtySeries.type, DirtySeries.version).in_(chunk)
+        ).delete(synchronize_session=False)
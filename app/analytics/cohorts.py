@@ -0,0 +1,242 @@
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import bindparam, select, tuple_, update
+from sqlalchemy.orm import Session
+
+from app.analytics.aggregates import Partials, merge_stats, type_name
+from app.db.bulk import chunked
+from app.db.models import BiometricDailyStats, CohortDailyStats, Gender, Patient
+
+COHORT_KEY = ("age_band", "gender", "type", "bucket")
+AGE_BAND_YEARS = 10
+UNKNOWN_BAND, UNKNOWN_GENDER = -1, "unknown"   # readings of patients not (yet) in ``patients``
+
+Cohort = Tuple[int, str, str, datetime]   # (age_band, gender, type, day)
+Day = Tuple[int, str, datetime]           # (patient_id, type, day)
+Stats = Optional[Tuple[int, float, float, float]]
+
+
+def age_band(dob: date, on: datetime) -> int:
+    """Lower bound of the ``AGE_BAND_YEARS`` band the patient's age falls in on day ``on``."""
+    age = on.year - dob.year - ((on.month, on.day) < (dob.month, dob.day))
+    return max(age, 0) // AGE_BAND_YEARS * AGE_BAND_YEARS
+
+
+def band_label(band: int) -> str:
+    return "unknown" if band == UNKNOWN_BAND else f"{band}-{band + AGE_BAND_YEARS - 1}"
+
+
+def demographics(session: Session, patient_ids: Iterable[int]) -> Dict[int, Tuple[date, str]]:
+    """patient_id → (dob, gender) for the patients that exist."""
+    found = {}
+    for chunk in chunked(sorted(set(patient_ids)), 500):
+        for pid, dob, gender in session.query(Patient.id, Patient.dob, Patient.gender).filter(Patient.id.in_(chunk)):
+            found[pid] = (dob, type_name(gender))
+    return found
+
+
+def _cohort(demo: Dict[int, Tuple[date, str]], pid: int, typ: str, day: datetime) -> Cohort:
+    if pid not in demo:
+        return UNKNOWN_BAND, UNKNOWN_GENDER, typ, day
+    dob, gender = demo[pid]
+    return age_band(dob, day), gender, typ, day
+
+
+def _fold(partials: Dict[Tuple[int, str, datetime], Iterable[float]], demo, cohorts: Partials = None) -> Partials:
+    cohorts = {} if cohorts is None else cohorts
+    for (pid, typ, day), (c, s, mn, mx) in partials.items():
+        key = _cohort(demo, pid, typ, day)
+        acc = cohorts.get(key)
+        if acc is None:
+            cohorts[key] = [c, s, mn, mx]
+        else:
+            acc[0] += c
+            acc[1] += s
+            acc[2] = min(acc[2], mn)
+            acc[3] = max(acc[3], mx)
+    return cohorts
+
+
+def add_to_cohorts(session: Session, daily: Partials) -> None:
+    """Merge per-patient daily partial aggregates into their cohorts' daily aggregates."""
+    if daily:
+        demo = demographics(session, {pid for pid, _, _ in daily})
+        merge_stats(session, CohortDailyStats, _fold(daily, demo), COHORT_KEY)
+
+
+def update_cohort_days(session: Session, old: Dict[Day, Stats], new: Dict[Day, Stats]) -> None:
+    """Move cohort cells from the ``old`` to the ``new`` per-patient daily stats of the same days.
+
+    ``count`` and ``sum`` change by the difference and ``min``/``max`` absorb
+    the new values, in one upsert per chunk. A cell is re-derived only when a
+    replaced day may have held its stored extreme, and then from the daily rows
+    of that cell's own patients. Cells left empty are removed.
+    """
+    keys = {key for key in set(old) | set(new) if old.get(key) != new.get(key)}
+    if not keys:
+        return
+    demo = demographics(session, {pid for pid, _, _ in keys})
+    added: Partials = {}
+    removed: Dict[Cohort, List[float]] = {}
+    for pid, typ, day in keys:
+        cell = _cohort(demo, pid, typ, day)
+        before, after = old.get((pid, typ, day)), new.get((pid, typ, day))
+        if before and before[0]:
+            acc = removed.setdefault(cell, [0, 0.0, before[2], before[3]])
+            acc[0] += before[0]
+            acc[1] += before[1]
+            acc[2] = min(acc[2], before[2])
+            acc[3] = max(acc[3], before[3])
+        if after and after[0]:
+            _fold({(pid, typ, day): after}, demo, added)
+
+    # signed deltas: removed counts and sums are subtracted in the same statement
+    deltas = {cell: list(acc) for cell, acc in added.items()}
+    table = CohortDailyStats.__table__
+    shrinking = []
+    for cell, (c, s, _, _) in removed.items():
+        if cell in deltas:
+            deltas[cell][0] -= c
+            deltas[cell][1] -= s
+        else:
+            shrinking.append({"k_band": cell[0], "k_gender": cell[1], "k_type": cell[2], "k_bucket": cell[3], "c": c, "s": s})
+    merge_stats(session, CohortDailyStats, deltas, COHORT_KEY)
+    if shrinking:
+        session.execute(
+            update(table)
+            .where(*_cell_match(table))
+            .values(count=table.c.count - bindparam("c"), sum=table.c.sum - bindparam("s")),
+            shrinking,
+        )
+
+    cells = list(removed)
+    for chunk in chunked(cells, 500):
+        stored = {
+            tuple(row[:4]): row[4:]
+            for row in session.execute(
+                select(table.c.age_band, table.c.gender, table.c.type, table.c.bucket, table.c.count, table.c.min, table.c.max)
+                .where(tuple_(table.c.age_band, table.c.gender, table.c.type, table.c.bucket).in_(chunk))
+            )
+        }
+        empty, rederived = [], []
+        for cell in chunk:
+            count, mn, mx = stored.get(cell, (0, None, None))
+            if count <= 0:
+                empty.append(cell)
+            elif removed[cell][2] <= mn or removed[cell][3] >= mx:
+                mn, mx = _cell_extremes(session, cell)
+                rederived.append({"k_band": cell[0], "k_gender": cell[1], "k_type": cell[2], "k_bucket": cell[3], "mn": mn, "mx": mx})
+        if empty:
+            session.execute(table.delete().where(
+                tuple_(table.c.age_band, table.c.gender, table.c.type, table.c.bucket).in_(empty)
+            ))
+        if rederived:
+            session.execute(
+                update(table).where(*_cell_match(table)).values(min=bindparam("mn"), max=bindparam("mx")),
+                rederived,
+            )
+
+
+def _cell_match(table) -> list:
+    return [
+        table.c.age_band == bindparam("k_band"), table.c.gender == bindparam("k_gender"),
+        table.c.type == bindparam("k_type"), table.c.bucket == bindparam("k_bucket"),
+    ]
+
+
+def _cell_extremes(session: Session, cell: Cohort) -> Tuple[float, float]:
+    """(min, max) of one cohort cell, from the daily rows of the patients in it."""
+    band, gender, typ, day = cell
+    daily = BiometricDailyStats
+    query = session.query(daily.min, daily.max, Patient.dob).outerjoin(Patient, Patient.id == daily.patient_id).filter(
+        daily.type == typ, daily.bucket == day
+    )
+    if band == UNKNOWN_BAND:
+        query = query.filter(Patient.id.is_(None))
+    else:
+        query = query.filter(Patient.gender == Gender(gender))
+    extremes = [(mn, mx) for mn, mx, dob in query if band == UNKNOWN_BAND or age_band(dob, day) == band]
+    return min(mn for mn, _ in extremes), max(mx for _, mx in extremes)
+
+
+def recompute_cohort_days(session: Session, days: Set[Tuple[int, str, datetime]]) -> None:
+    """Rebuild every cohort cell of the (type, day)s of ``days`` from the per-patient daily rollup.
+
+    Cost is one read of the day's per-patient rows, not of its readings. Used
+    when demographics change; reading updates go through ``update_cohort_days``.
+    """
+    for typ, day in {(type_name(typ), day) for _, typ, day in days}:
+        rows = session.query(
+            BiometricDailyStats.patient_id, BiometricDailyStats.count, BiometricDailyStats.sum,
+            BiometricDailyStats.min, BiometricDailyStats.max,
+        ).filter(BiometricDailyStats.type == typ, BiometricDailyStats.bucket == day).all()
+        session.query(CohortDailyStats).filter(
+            CohortDailyStats.type == typ, CohortDailyStats.bucket == day
+        ).delete(synchronize_session=False)
+        demo = demographics(session, {pid for pid, *_ in rows})
+        merge_stats(
+            session, CohortDailyStats, _fold({(pid, typ, day): stats for pid, *stats in rows}, demo), COHORT_KEY
+        )
+
+
+def rebuild_patient_cohorts(session: Session, patient_ids: Iterable[int]) -> None:
+    """Move a patient's days to their new cohorts after their dob or gender changed."""
+    session.flush()         # the new demographics must be visible to the rebuild
+    days = set()
+    for chunk in chunked(sorted(set(patient_ids)), 500):
+        days.update(
+            session.query(BiometricDailyStats.patient_id, BiometricDailyStats.type, BiometricDailyStats.bucket)
+            .filter(BiometricDailyStats.patient_id.in_(chunk))
+        )
+    recompute_cohort_days(session, days)
+
+
+def read_cohort_stats(
+    session: Session,
+    btype: str,
+    genders: Optional[List[str]] = None,
+    age_min: Optional[int] = None,
+    age_max: Optional[int] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    group_by: Tuple[str, ...] = (),
+) -> List[Dict]:
+    """Aggregate cohort cells matching the filters, grouped by any of age_band, gender, day, month.
+
+    Ages match whole bands: a band is included only when it lies entirely within
+    [age_min, age_max], so 50–60 selects the 50–59 band and not 60–69.
+    """
+    model = CohortDailyStats
+    query = session.query(model.age_band, model.gender, model.bucket, model.count, model.sum, model.min, model.max)
+    query = query.filter(model.type == btype)
+    if genders:
+        query = query.filter(model.gender.in_(genders))
+    if age_min is not None:
+        query = query.filter(model.age_band >= age_min)
+    if age_max is not None:
+        query = query.filter(model.age_band + AGE_BAND_YEARS - 1 <= age_max)
+    if age_min is not None or age_max is not None:
+        query = query.filter(model.age_band != UNKNOWN_BAND)
+    if start is not None:
+        query = query.filter(model.bucket >= start.replace(hour=0, minute=0, second=0, microsecond=0))
+    if end is not None:
+        query = query.filter(model.bucket < end)
+
+    groups: Dict[tuple, List[float]] = {}
+    for band, gender, day, c, s, mn, mx in query:
+        parts = {"age_band": band_label(band), "gender": gender, "day": day, "month": day.replace(day=1)}
+        key = tuple(parts[g] for g in group_by)
+        acc = groups.get(key)
+        if acc is None:
+            groups[key] = [c, s, mn, mx]
+        else:
+            acc[0] += c
+            acc[1] += s
+            acc[2] = min(acc[2], mn)
+            acc[3] = max(acc[3], mx)
+
+    return [
+        {**dict(zip(group_by, key)), "count": c, "min": mn, "max": mx, "avg": s / c}
+        for key, (c, s, mn, mx) in sorted(groups.items(), key=lambda item: tuple(str(k) for k in item[0]))
+    ]
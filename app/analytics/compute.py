@@ -1,48 +1,112 @@
-from sqlalchemy.exc import IntegrityError
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, Optional
+
+from app.analytics.aggregates import type_name
+from app.analytics.cohorts import rebuild_patient_cohorts
+from app.core.config import settings
+from app.core.metrics import span
+from app.db.bulk import chunked
+from app.db.lease import ETL_JOB, acquire_lease, process_owner, release_lease
 from app.db.session import SessionLocal
-from app.db.models import Patient, Biometric
-from app.etl.extract import load_patients, load_readings
-from app.etl.transform import validate_patient, normalize_reading
+from app.db.models import Patient
+from app.etl.extract import DATA_DIR, load_patients
+from app.etl.transform import ParsedReading, RejectReport, read_reading_file, validate_patients
+from app.etl.load import load_biometrics
+
+
+def resolve_readings(readings: Iterable[ParsedReading], patient_ids: Dict[str, int]) -> Iterator[Dict]:
+    """Swap the e-mail of reading tuples for a patient id, lazily."""
+    for email, ts, typ, value in readings:
+        patient_id = patient_ids.get(email)
+        if patient_id is None:
+            continue  # Skip if patient not found
+        yield {"patient_id": patient_id, "timestamp": ts, "type": typ, "value": value}
 
-def run_etl():
+
+def run_etl(
+    chunk_size: Optional[int] = None,
+    data_dir: Optional[Path] = None,
+    on_commit: Optional[Callable[[], None]] = None,
+) -> RejectReport:
+    """Load ``patients.json`` and ``readings.csv`` from ``data_dir`` (default ``data/``);
+    returns the report of rejected records. ``on_commit`` is called after each
+    committed chunk, e.g. to renew a lease."""
+    data_dir = Path(data_dir or DATA_DIR)
+    chunk_size = chunk_size or settings.ETL_CHUNK_SIZE
+    rejects = RejectReport()
     session = SessionLocal()
+    try:
+        # Step 1: Add or update patients; invalid records are reported, not fatal
+        with span("etl", "patients"):
+            moved = []      # patients whose dob/gender changed, and with them their cohort
+            for n, batch in enumerate(chunked(load_patients(data_dir / "patients.json"), chunk_size)):
+                records = validate_patients(batch, rejects, first=n * chunk_size)
+                existing = {
+                    p.email: p
+                    for p in session.query(Patient).filter(Patient.email.in_([r["email"] for r in records]))
+                }
+                for data in records:
+                    patient = existing.get(data["email"])
+                    if patient:
+                        if (patient.dob, type_name(patient.gender)) != (data["dob"], type_name(data["gender"])):
+                            moved.append(patient.id)
+                        for key, value in data.items():
+                            setattr(patient, key, value)
+                    else:
+                        session.add(Patient(**data))
+            rebuild_patient_cohorts(session, moved)
+            session.commit()
+            if on_commit:
+                on_commit()
+
+        # Step 2: e-mail → id map, built once instead of one query per reading
+        patient_ids = dict(session.query(Patient.email, Patient.id).all())
+
+        # Step 3: Stream readings through in fixed-size chunks; duplicates are
+        # dropped by the database (ON CONFLICT DO NOTHING), not an in-memory key set
+        with span("etl", "readings"):
+            readings = resolve_readings(read_reading_file(data_dir / "readings.csv", rejects), patient_ids)
+            for chunk in chunked(readings, chunk_size):
+                with span("etl", "load_chunk"):
+                    load_biometrics(session, chunk)
+                    session.commit()
+                if on_commit:
+                    on_commit()
+    finally:
+        session.close()
+    if rejects.count:
+        print(f"ETL rejected {rejects.count} records: {rejects.reasons}")
+        if settings.ETL_REJECTS_FILE:
+            rejects.write_csv(settings.ETL_REJECTS_FILE)
+    return rejects
+
+
+def run_etl_exclusive(owner: Optional[str] = None) -> Optional[RejectReport]:
+    """``run_etl`` under the ``etl`` lease: whichever worker or CLI gets it runs the ETL,
+    the others return None straight away. A successful run is recorded as the
+    job's last finish, which is what ``/readyz`` waits for."""
+    owner = owner or process_owner()
+    session = SessionLocal()
+    try:
+        if not acquire_lease(session, ETL_JOB, owner, settings.ETL_LEASE_SECONDS):
+            print("ETL already running elsewhere; skipping.")
+            return None
+        finished = False
+        try:
+            rejects = run_etl(
+                on_commit=lambda: acquire_lease(session, ETL_JOB, owner, settings.ETL_LEASE_SECONDS),   # renew
+            )
+            finished = True
+            return rejects
+        finally:
+            release_lease(session, ETL_JOB, owner, finished=finished)
+    finally:
+        session.close()
+
+
+if __name__ == "__main__":
+    from app.db.schema import create_schema
+    from app.db.session import engine
 
-    # Step 1: Add or update patients
-    for p in load_patients():
-        data = validate_patient(p)
-        patient = session.query(Patient).filter_by(email=data["email"]).first()
-        if patient:
-            for key, value in data.items():
-                setattr(patient, key, value)
-        else:
-            session.add(Patient(**data))
-    session.commit()
-
-    # Step 2: Prepare biometric data (glucose, weight, etc.)
-    existing = set(
-        session.query(Biometric.patient_id, Biometric.timestamp, Biometric.type).all()
-    )
-
-    new_biometrics = []
-    for raw in load_readings():
-        for r in normalize_reading(raw):
-            patient = session.query(Patient).filter_by(email=r["email"]).first()
-            if not patient:
-                continue  # Skip if patient not found
-
-            key = (patient.id, r["timestamp"], r["type"])
-            if key not in existing:
-                new_biometrics.append(Biometric(
-                    patient_id=patient.id,
-                    timestamp=r["timestamp"],
-                    type=r["type"],
-                    value=r["value"]
-                ))
-                existing.add(key)
-
-    # Step 3: Save new biometrics
-    if new_biometrics:
-        session.bulk_save_objects(new_biometrics)
-        session.commit()
-
-    session.close()
+    create_schema(engine)
+    run_etl_exclusive()
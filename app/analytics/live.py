@@ -0,0 +1,145 @@
+import math
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import select, tuple_, update
+from sqlalchemy.orm import Session
+
+from app.analytics.aggregates import type_name
+from app.core.config import settings
+from app.db.bulk import chunked, insert_ignore
+from app.db.models import Biometric, BiometricLiveStats
+
+# (biometrics.id, patient_id, type, timestamp, value)
+Reading = Tuple[int, int, str, datetime, float]
+
+LIVE_KEY = ("patient_id", "type")
+
+
+class RunningStats:
+    """Welford mean/variance plus an exponentially weighted mean/variance, O(1) per reading.
+
+    Welford state can also take a reading back out (``remove``), which is how
+    updated and deleted readings are handled; the EWMA only ever moves forward.
+    """
+
+    __slots__ = ("count", "mean", "m2", "ewma_mean", "ewma_var")
+
+    def __init__(self, count=0, mean=0.0, m2=0.0, ewma_mean=None, ewma_var=0.0):
+        self.count, self.mean, self.m2 = count, mean, m2
+        self.ewma_mean, self.ewma_var = ewma_mean, ewma_var
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+    def zscore(self, value: float) -> Optional[float]:
+        """z-score of ``value`` against the readings seen so far; None until there are enough."""
+        std = self.std
+        if self.count < settings.LIVE_STATS_MIN_COUNT or std <= 0:
+            return None
+        return (value - self.mean) / std
+
+    def add(self, value: float, alpha: float) -> None:
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        if self.ewma_mean is None:
+            self.ewma_mean, self.ewma_var = value, 0.0
+        else:
+            diff = value - self.ewma_mean
+            self.ewma_mean += alpha * diff
+            self.ewma_var = (1 - alpha) * (self.ewma_var + alpha * diff * diff)
+
+    def remove(self, value: float) -> None:
+        if self.count <= 1:
+            self.count, self.mean, self.m2 = 0, 0.0, 0.0
+            return
+        mean = self.mean
+        self.count -= 1
+        self.mean = (mean * (self.count + 1) - value) / self.count
+        self.m2 = max(self.m2 - (value - mean) * (value - self.mean), 0.0)
+
+
+def update_live_stats(
+    session: Session,
+    added: Iterable[Reading],
+    removed: Iterable[Tuple[int, str, float]] = (),
+) -> Dict[int, Tuple[Optional[float], bool]]:
+    """Fold stored readings into the live stats and annotate them with their z-score.
+
+    ``removed`` are (patient_id, type, value) readings that were deleted or
+    overwritten. One read and one write per touched series, whatever the
+    number of readings; returns ``{biometrics.id: (zscore, outlier)}``. The
+    caller owns the transaction.
+    """
+    added = sorted(added, key=lambda r: r[3])          # EWMA follows reading time within a batch
+    removed = list(removed)
+    keys = {(pid, type_name(typ)) for _, pid, typ, _, _ in added} | {(pid, type_name(typ)) for pid, typ, _ in removed}
+    if not keys:
+        return {}
+
+    # make sure every series has a row, then lock them for this read-modify-write
+    table = BiometricLiveStats.__table__
+    insert_ignore(session, table, [{"patient_id": pid, "type": typ} for pid, typ in sorted(keys)], LIVE_KEY)
+    rows, states = {}, {}
+    for chunk in chunked(sorted(keys), 500):
+        for row in session.execute(
+            select(table).where(tuple_(table.c.patient_id, table.c.type).in_(chunk)).with_for_update()
+        ):
+            key = (row.patient_id, row.type)
+            rows[key] = dict(row._mapping)
+            states[key] = RunningStats(row.count, row.mean, row.m2, row.ewma_mean, row.ewma_var)
+
+    for pid, typ, value in removed:
+        states[(pid, type_name(typ))].remove(value)
+
+    alpha, threshold = settings.LIVE_STATS_EWMA_ALPHA, settings.LIVE_STATS_OUTLIER_Z
+    annotations = {}
+    for biometric_id, pid, typ, ts, value in added:
+        key = (pid, type_name(typ))
+        stats, row = states[key], rows[key]
+        z = stats.zscore(value)
+        outlier = z is not None and abs(z) >= threshold
+        stats.add(value, alpha)
+        annotations[biometric_id] = (z, outlier)
+        row["outliers"] += outlier
+        ts = ts.replace(tzinfo=None)
+        if row["last_timestamp"] is None or ts >= row["last_timestamp"]:
+            row.update(last_value=value, last_timestamp=ts, last_zscore=z)
+
+    now = datetime.utcnow()
+    session.execute(update(BiometricLiveStats), [
+        {
+            "id": rows[key]["id"], "count": s.count, "mean": s.mean, "m2": s.m2,
+            "ewma_mean": s.ewma_mean, "ewma_var": s.ewma_var, "outliers": rows[key]["outliers"],
+            "last_value": rows[key]["last_value"], "last_timestamp": rows[key]["last_timestamp"],
+            "last_zscore": rows[key]["last_zscore"], "updated_at": now,
+        }
+        for key, s in states.items()
+    ])
+    if annotations:
+        session.execute(update(Biometric), [
+            {"id": biometric_id, "zscore": z, "outlier": outlier} for biometric_id, (z, outlier) in annotations.items()
+        ])
+    return annotations
+
+
+def describe(row: BiometricLiveStats) -> Dict:
+    """API view of one live stats row."""
+    stats = RunningStats(row.count, row.mean, row.m2, row.ewma_mean, row.ewma_var)
+    return {
+        "type": row.type,
+        "count": row.count,
+        "mean": row.mean,
+        "std": stats.std,
+        "ewma_mean": row.ewma_mean,
+        "ewma_std": math.sqrt(row.ewma_var),
+        "outliers": row.outliers,
+        "last_value": row.last_value,
+        "last_timestamp": row.last_timestamp,
+        "last_zscore": row.last_zscore,
+        "last_outlier": row.last_zscore is not None and abs(row.last_zscore) >= settings.LIVE_STATS_OUTLIER_Z,
+        "updated_at": row.updated_at,
+    }
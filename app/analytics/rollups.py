@@ -0,0 +1,359 @@
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, Optional, Set, Tuple
+
+from sqlalchemy import and_, func, or_, select, tuple_, update
+from sqlalchemy.orm import Session
+
+from app.analytics.aggregates import (
+    STATS_KEY, day_bucket, fold_readings, hour_bucket, mark_dirty, merge_stats, month_bucket, type_name,
+)
+from app.analytics.cohorts import add_to_cohorts, update_cohort_days
+from app.analytics.sketch import QuantileSketch
+from app.core.cache import invalidate_on_commit
+from app.db import archive
+from app.db.bulk import chunked, upsert
+from app.db.models import Biometric, BiometricDailyStats, BiometricHourlyStats, BiometricMonthlyStats, DeferredHour
+
+# resolution name → (rollup model, bucket truncation), finest first
+RESOLUTIONS = {
+    "hour": (BiometricHourlyStats, hour_bucket),
+    "day": (BiometricDailyStats, day_bucket),
+    "month": (BiometricMonthlyStats, month_bucket),
+}
+
+Bucket = Tuple[int, str, datetime]   # (patient_id, type, bucket start)
+Stats = Optional[Tuple[int, float, float, float]]
+
+RANGE_CHUNK = 200   # buckets matched per range query; keeps SQLite's expression depth and bound parameters low
+
+
+def bucket_end(resolution: str, start: datetime) -> datetime:
+    if resolution == "hour":
+        return start + timedelta(hours=1)
+    if resolution == "day":
+        return start + timedelta(days=1)
+    return month_bucket(start + timedelta(days=32))
+
+
+def add_readings(session: Session, rows: Iterable[Tuple[int, str, datetime, float]]) -> None:
+    """Fold newly stored (patient_id, type, timestamp, value) readings into every rollup."""
+    rows = [(pid, typ, ts.replace(tzinfo=None), value) for pid, typ, ts, value in rows]
+    if not rows:
+        return
+    for resolution, (model, truncate) in RESOLUTIONS.items():
+        partials = fold_readings(rows, bucket=truncate)
+        merge_stats(session, model, partials)
+        if resolution == "day":
+            add_to_cohorts(session, partials)
+    merge_sketches(session, fold_sketches(rows))
+    mark_dirty(session, {(pid, typ) for pid, typ, _, _ in rows})
+    invalidate_on_commit(session, "series", {pid for pid, _, _, _ in rows})
+
+
+def fold_sketches(
+    rows: Iterable[Tuple[int, str, datetime, float]], sketches: Dict[Bucket, QuantileSketch] = None,
+) -> Dict[Bucket, QuantileSketch]:
+    """Fold (patient_id, type, timestamp, value) rows into per-hour quantile sketches."""
+    sketches = {} if sketches is None else sketches
+    for pid, typ, ts, value in rows:
+        key = (pid, type_name(typ), hour_bucket(ts))
+        sketch = sketches.get(key)
+        if sketch is None:
+            sketch = sketches[key] = QuantileSketch()
+        sketch.add(value)
+    return sketches
+
+
+def merge_sketches(session: Session, sketches: Dict[Bucket, QuantileSketch]) -> None:
+    """Merge per-hour sketches into the stored hourly ones.
+
+    Must run after ``merge_stats`` has upserted the same hourly rows in this
+    transaction: the upsert holds their row locks, so concurrent writers cannot
+    lose each other's bins in this read-modify-write. Rows written before
+    sketches existed stay without one until ``backfill_rollups`` rebuilds them.
+    """
+    table = BiometricHourlyStats.__table__
+    for chunk in chunked(list(sketches.items()), 500):
+        stored = {
+            (pid, typ, bucket): (row_id, count, data)
+            for row_id, pid, typ, bucket, count, data in session.execute(
+                select(table.c.id, table.c.patient_id, table.c.type, table.c.bucket, table.c.count, table.c.sketch)
+                .where(tuple_(table.c.patient_id, table.c.type, table.c.bucket).in_([key for key, _ in chunk]))
+            )
+        }
+        updates = []
+        for key, sketch in chunk:
+            row_id, count, data = stored[key]
+            if data is not None:
+                sketch = QuantileSketch.from_bytes(data).merge(sketch)
+            elif count != sketch.count:
+                continue
+            updates.append({"id": row_id, "sketch": sketch.to_bytes()})
+        if updates:
+            session.execute(update(BiometricHourlyStats), updates)
+
+
+def recompute_hours(session: Session, hours: Iterable[Bucket]) -> None:
+    """Rebuild hourly buckets exactly from raw biometrics, then the days and months containing them.
+
+    Used where a reading was updated or deleted, which additive merging can't express.
+    Hours in archived months also count their archived readings, unless a hot
+    row with the same timestamp replaces them.
+    """
+    hours = {(pid, type_name(typ), hour_bucket(ts.replace(tzinfo=None))) for pid, typ, ts in hours}
+    if not hours:
+        return
+    readings: Dict[Bucket, Dict[datetime, float]] = {key: {} for key in hours}
+    raw = (Biometric.patient_id, Biometric.type, Biometric.timestamp)
+    for chunk in chunked(sorted(hours), RANGE_CHUNK):
+        for pid, typ, ts, value in session.query(*raw, Biometric.value).filter(_in_buckets(raw, chunk, "hour")):
+            readings[(pid, type_name(typ), hour_bucket(ts))][ts] = value
+
+    cold_until = archive.horizon()
+    cold: Dict[datetime, Set[Bucket]] = {}
+    for key in hours:
+        if cold_until is not None and key[2] < cold_until:
+            cold.setdefault(month_bucket(key[2]), set()).add(key)
+    for month, keys in cold.items():
+        # one pruned read per archived month, then keep only the requested hours
+        pids, types = {pid for pid, _, _ in keys}, {typ for _, typ, _ in keys}
+        for r in archive.read_rows(pids, month, bucket_end("month", month), types):
+            hour = readings.get((r.patient_id, type_name(r.type), hour_bucket(r.timestamp)))
+            if hour is not None:
+                hour.setdefault(r.timestamp, r.value)
+
+    stats, sketches = {}, {}
+    for key, by_ts in readings.items():
+        values = list(by_ts.values())
+        stats[key] = (len(values), sum(values), min(values), max(values)) if values else (0, None, None, None)
+        sketches[key] = QuantileSketch.of(values)
+    _replace(session, BiometricHourlyStats, stats, sketches)
+    rebuild_coarser(session, hours)
+    mark_dirty(session, {(pid, typ) for pid, typ, _ in hours})
+
+
+def defer_hours(session: Session, readings: Iterable[Tuple[int, str, datetime]]) -> None:
+    """Queue the hours of (patient_id, type, timestamp) readings for ``apply_deferred``, in the caller's transaction.
+
+    Lets a single-reading write skip the rollup, sketch and cohort maintenance;
+    the analytics jobs recompute the queued hours exactly before they run.
+    """
+    now = datetime.utcnow()
+    hours = {(pid, type_name(typ), hour_bucket(ts.replace(tzinfo=None))) for pid, typ, ts in readings}
+    rows = [
+        {"patient_id": pid, "type": typ, "bucket": bucket, "version": 1, "marked_at": now}
+        for pid, typ, bucket in sorted(hours)
+    ]
+    table = DeferredHour.__table__
+    for chunk in chunked(rows, 1000):
+        upsert(
+            session, table, chunk, ("patient_id", "type", "bucket"),
+            lambda excluded: {"version": table.c.version + 1, "marked_at": excluded.marked_at},
+        )
+
+
+def apply_deferred(session: Session, chunk_size: int, on_commit: Optional[Callable[[], None]] = None) -> int:
+    """Recompute the hours queued by ``defer_hours``, up to the last entry present at start.
+
+    Each chunk commits its rollups and dequeues its hours together, so an
+    interrupted run resumes where it stopped; an hour queued again meanwhile
+    stays queued. ``on_commit`` is called after each chunk. Returns how many
+    hours were recomputed.
+    """
+    high = session.query(func.max(DeferredHour.id)).scalar()
+    applied, after = 0, 0
+    while high is not None:
+        queued = (
+            session.query(DeferredHour.id, DeferredHour.patient_id, DeferredHour.type, DeferredHour.bucket, DeferredHour.version)
+            .filter(DeferredHour.id > after, DeferredHour.id <= high)
+            .order_by(DeferredHour.id)
+            .limit(chunk_size)
+            .all()
+        )
+        if not queued:
+            break
+        recompute_hours(session, [(pid, typ, bucket) for _, pid, typ, bucket, _ in queued])
+        key = tuple_(DeferredHour.patient_id, DeferredHour.type, DeferredHour.bucket, DeferredHour.version)
+        for chunk in chunked([tuple(row[1:]) for row in queued], 500):
+            session.query(DeferredHour).filter(key.in_(chunk)).delete(synchronize_session=False)
+        session.commit()
+        if on_commit:
+            on_commit()
+        applied += len(queued)
+        after = queued[-1][0]
+    return applied
+
+
+def rebuild_coarser(session: Session, hours: Set[Bucket]) -> None:
+    """Recompute the daily buckets of ``hours`` from the hourly rollup, then months from days,
+    and move the cohort aggregates of those days by the change."""
+    invalidate_on_commit(session, "series", {pid for pid, _, _ in hours})
+    keys = hours
+    for finer, coarser in (("hour", "day"), ("day", "month")):
+        src, _ = RESOLUTIONS[finer]
+        dst, truncate = RESOLUTIONS[coarser]
+        keys = {(pid, typ, truncate(ts)) for pid, typ, ts in keys}
+        partials = {key: [0, None, None, None] for key in keys}
+        columns = (src.patient_id, src.type, src.bucket)
+        for chunk in chunked(sorted(keys), RANGE_CHUNK):
+            for pid, typ, ts, c, total, mn, mx in session.query(
+                *columns, src.count, src.sum, src.min, src.max,
+            ).filter(_in_buckets(columns, chunk, coarser)):
+                acc = partials[(pid, type_name(typ), truncate(ts))]
+                if acc[0]:
+                    acc[0] += c
+                    acc[1] += total
+                    acc[2] = min(acc[2], mn)
+                    acc[3] = max(acc[3], mx)
+                else:
+                    acc[:] = [c, total, mn, mx]
+        stats = {key: tuple(acc) for key, acc in partials.items()}
+        if coarser == "day":
+            previous = _stored(session, dst, keys)
+        _replace(session, dst, stats)
+        if coarser == "day":
+            update_cohort_days(session, previous, stats)
+
+
+def _stored(session: Session, model, keys: Set[Bucket]) -> Dict[Bucket, Stats]:
+    """Current (count, sum, min, max) of the rollup rows ``keys`` that exist."""
+    table = model.__table__
+    stored = {}
+    for chunk in chunked(sorted(keys), 500):
+        for pid, typ, start, *stats in session.execute(
+            select(table.c.patient_id, table.c.type, table.c.bucket, table.c.count, table.c.sum, table.c.min, table.c.max)
+            .where(tuple_(table.c.patient_id, table.c.type, table.c.bucket).in_(chunk))
+        ):
+            stored[(pid, typ, start)] = tuple(stats)
+    return stored
+
+
+def _in_buckets(columns, keys: Iterable[Bucket], resolution: str):
+    """Match rows of ``columns`` = (patient_id, type, timestamp) falling in any of the ``resolution`` buckets ``keys``."""
+    pid_col, type_col, ts_col = columns
+    return or_(*(
+        and_(pid_col == pid, type_col == typ, ts_col >= start, ts_col < bucket_end(resolution, start))
+        for pid, typ, start in keys
+    ))
+
+
+def _replace(
+    session: Session, model, stats: Dict[Bucket, Stats], sketches: Optional[Dict[Bucket, QuantileSketch]] = None,
+) -> None:
+    """Overwrite rollup rows with recomputed stats (and sketches); empty buckets are removed."""
+    table = model.__table__
+    columns = ("count", "sum", "min", "max") + (("sketch",) if sketches is not None else ())
+    rows, empty = [], []
+    for (pid, typ, start), (count, total, mn, mx) in stats.items():
+        if not count:
+            empty.append((pid, typ, start))
+            continue
+        row = {"patient_id": pid, "type": typ, "bucket": start, "count": count, "sum": total, "min": mn, "max": mx}
+        if sketches is not None:
+            row["sketch"] = sketches[(pid, typ, start)].to_bytes()
+        rows.append(row)
+    upsert(
+        session, table, rows, STATS_KEY,
+        lambda excluded: {c: getattr(excluded, c) for c in columns},
+    )
+    key = tuple_(table.c.patient_id, table.c.type, table.c.bucket)
+    for chunk in chunked(empty, 500):
+        session.execute(table.delete().where(key.in_(chunk)))
+
+
+# ---------- series reads ------------------------------------------------------
+EPOCH = datetime(1970, 1, 5)        # a Monday, so weekly buckets start on Mondays
+BUCKET_NAMES = {"hour": "1h", "day": "1d", "week": "1w", "month": "1M"}
+BUCKET_UNITS = {"h": ("hour", timedelta(hours=1)), "d": ("day", timedelta(days=1)), "w": ("day", timedelta(weeks=1))}
+
+
+def parse_bucket(spec: str) -> Tuple[str, int, str]:
+    """``"6h"`` → ``("hour", 6, "h")``: the coarsest rollup that tiles the bucket, its multiple and unit."""
+    spec = BUCKET_NAMES.get(spec, spec)
+    count, unit = spec[:-1] or "1", spec[-1]
+    if not count.isdigit() or int(count) < 1 or unit not in ("h", "d", "w", "M"):
+        raise ValueError(f"Invalid bucket {spec!r}; use e.g. 1h, 6h, 1d, 1w, 1M or hour/day/week/month")
+    resolution = "month" if unit == "M" else BUCKET_UNITS[unit][0]
+    return resolution, int(count), unit
+
+
+def _group_start(ts: datetime, count: int, unit: str) -> datetime:
+    if unit == "M":
+        index = (ts.year * 12 + ts.month - 1) // count * count
+        return datetime(index // 12, index % 12 + 1, 1)
+    step = BUCKET_UNITS[unit][1] * count
+    return EPOCH + (ts - EPOCH) // step * step
+
+
+def read_series(
+    session: Session,
+    patient_id: int,
+    btype: str,
+    bucket: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+) -> Tuple[str, list]:
+    """Return ``(resolution, points)`` for one series, read from the coarsest rollup that fits ``bucket``.
+
+    Each point is ``{"start", "count", "min", "max", "avg"}``; a year of daily
+    points is one indexed range read of ~365 rollup rows.
+
+    Points are bucket-aligned and never clipped: the first point covers the
+    whole bucket containing ``start`` and the last one the whole bucket
+    starting before ``end``, so edge points may include readings outside
+    ``[start, end)``.
+    """
+    resolution, count, unit = parse_bucket(bucket)
+    model, truncate = RESOLUTIONS[resolution]
+    query = session.query(model.bucket, model.count, model.sum, model.min, model.max).filter(
+        model.patient_id == patient_id, model.type == btype
+    )
+    if start is not None:
+        query = query.filter(model.bucket >= truncate(start))
+    if end is not None:
+        query = query.filter(model.bucket < end)
+
+    groups: Dict[datetime, list] = {}
+    for ts, c, total, mn, mx in query.order_by(model.bucket):
+        key = _group_start(ts, count, unit)
+        acc = groups.get(key)
+        if acc is None:
+            groups[key] = [c, total, mn, mx]
+        else:
+            acc[0] += c
+            acc[1] += total
+            acc[2] = min(acc[2], mn)
+            acc[3] = max(acc[3], mx)
+
+    return resolution, [
+        {"start": key, "count": c, "min": mn, "max": mx, "avg": total / c}
+        for key, (c, total, mn, mx) in groups.items()
+    ]
+
+
+def read_quantiles(
+    session: Session,
+    patient_id: int,
+    btype: str,
+    qs: Iterable[float],
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+) -> Tuple[int, list]:
+    """Return ``(count, values)``: quantiles ``qs`` of one series, merged from its hourly sketches.
+
+    Bounds are applied at hour resolution, like ``read_series`` does; only the
+    sketches are read, so the cost follows the number of hours, not of readings.
+    """
+    model = BiometricHourlyStats
+    query = session.query(model.sketch).filter(
+        model.patient_id == patient_id, model.type == btype, model.sketch.isnot(None)
+    )
+    if start is not None:
+        query = query.filter(model.bucket >= hour_bucket(start))
+    if end is not None:
+        query = query.filter(model.bucket < end)
+
+    merged = QuantileSketch()
+    for (data,) in query:
+        merged.merge(QuantileSketch.from_bytes(data))
+    return merged.count, [merged.quantile(q) for q in qs]
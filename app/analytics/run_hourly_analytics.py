@@ -1,60 +1,127 @@
-from sqlalchemy import func, tuple_
-from app.db.models import Biometric, Analytics
-from datetime import datetime, timedelta
+import argparse
+import itertools
+from datetime import datetime
+from typing import Callable, Optional
+
+from sqlalchemy import func
+from app.analytics.aggregates import (
+    clear_dirty, dirty_series, fold_readings, hour_bucket, merge_stats, refresh_analytics,
+)
+from app.analytics.rollups import apply_deferred, fold_sketches, merge_sketches, rebuild_coarser
+from app.core.config import settings
+from app.core.metrics import span
+from app.db import archive
+from app.db.models import Biometric, BiometricHourlyStats, DirtySeries
 from app.db.session import SessionLocal
 
-def run_hourly_analytics():
+JOB_NAME = "hourly_analytics_v1"
+
+
+def run_hourly_analytics(
+    chunk_size: Optional[int] = None,
+    computed_at: Optional[datetime] = None,
+    on_commit: Optional[Callable[[], None]] = None,
+):
+    """Refresh analytics for every series whose readings changed since the last run.
+
+    The rollups are kept current by the batch, update, delete and ETL write
+    paths, which also queue the series they touch in ``analytics_dirty_series``;
+    hours left behind by single-reading POSTs are recomputed first. The job
+    then drains the series queue in id order, up to the last entry present at
+    start, recomputing min/max/avg of each series from the monthly rollup. Each
+    chunk commits its analytics and dequeues its series together, so an
+    interrupted run resumes where it stopped; a series marked again while its
+    chunk ran stays queued. ``computed_at`` defaults to the current hour;
+    ``on_commit`` is called after each committed chunk, e.g. to renew a lease.
+    """
     print("🔄 Running hourly analytics...")
+    chunk_size = chunk_size or settings.ANALYTICS_CHUNK_SIZE
     session = SessionLocal()
-    now = datetime.utcnow()
-    one_hour_ago = now - timedelta(hours=1)
-
-    # Query: group by patient_id and type, compute min, max, avg
-    results = session.query(
-        Biometric.patient_id,
-        Biometric.type,
-        func.min(Biometric.value),
-        func.max(Biometric.value),
-        func.avg(Biometric.value),
-    ).group_by(
-        Biometric.patient_id,
-        Biometric.type
-    ).all()
-
-    metrics = []
-    computed_at = now.replace(minute=0, second=0, microsecond=0)
-    for patient_id, btype, min_val, max_val, avg_val in results:
-        metrics.extend([
-            Analytics(patient_id=patient_id, metric_name=f"{btype}_min", value=min_val, computed_at=computed_at),
-            Analytics(patient_id=patient_id, metric_name=f"{btype}_max", value=max_val, computed_at=computed_at),
-            Analytics(patient_id=patient_id, metric_name=f"{btype}_avg", value=avg_val, computed_at=computed_at),
-        ])
-
-    if metrics:
-        # Build set of unique keys for new metrics
-        new_keys = set((m.patient_id, m.metric_name, m.computed_at) for m in metrics)
-        # Query for existing analytics with these keys
-        existing = set(
-            session.query(Analytics.patient_id, Analytics.metric_name, Analytics.computed_at)
-            .filter(
-                tuple_(
-                    Analytics.patient_id,
-                    Analytics.metric_name,
-                    Analytics.computed_at
-                ).in_(list(new_keys))
-            )
-            .all()
-        )
-        # Filter out metrics that already exist
-        to_insert = [m for m in metrics if (m.patient_id, m.metric_name, m.computed_at) not in existing]
-
-        if to_insert:
-            session.bulk_save_objects(to_insert)
-            session.commit()
-            print(f"Inserted {len(to_insert)} analytics rows.")
-        else:
+    try:
+        computed_at = hour_bucket(computed_at or datetime.utcnow())
+        with span(JOB_NAME, "apply_deferred"):
+            apply_deferred(session, chunk_size, on_commit)
+        high = session.query(func.max(DirtySeries.id)).scalar()
+
+        if high is None:
             print("No new data to process.")
-    else:
-        print("No new data to process.")
+            return
+
+        written, after = 0, 0
+        while True:
+            with span(JOB_NAME, "refresh_chunk"):
+                queued = dirty_series(session, after, high, chunk_size)
+                if not queued:
+                    break
+                written += refresh_analytics(session, {(pid, typ) for _, pid, typ, _ in queued}, computed_at)
+                clear_dirty(session, [(pid, typ, version) for _, pid, typ, version in queued])
+                session.commit()
+                if on_commit:
+                    on_commit()
+                after = queued[-1][0]
+
+        print(f"Inserted {written} analytics rows.")
+    finally:
+        session.close()
+
 
-    session.close()
\ No newline at end of file
+def backfill_rollups(start: datetime, end: datetime, chunk_size: Optional[int] = None) -> int:
+    """Rebuild the hourly rollup (and its quantile sketches) for ``[start, end)``
+    from raw biometrics, archived ones included, and the daily/monthly buckets
+    overlapping it from the hourly rollup.
+
+    Meant for repairs; readings ingested into the range while it runs may be
+    counted twice or not at all, so run it when the range is quiet.
+    """
+    chunk_size = chunk_size or settings.ANALYTICS_CHUNK_SIZE
+    start, end = hour_bucket(start), hour_bucket(end)
+    session = SessionLocal()
+    try:
+        in_range = (BiometricHourlyStats.bucket >= start, BiometricHourlyStats.bucket < end)
+        hours = set(
+            session.query(BiometricHourlyStats.patient_id, BiometricHourlyStats.type, BiometricHourlyStats.bucket)
+            .filter(*in_range)
+        )
+        session.query(BiometricHourlyStats).filter(*in_range).delete(synchronize_session=False)
+
+        rows = itertools.chain(
+            session.query(Biometric.patient_id, Biometric.type, Biometric.timestamp, Biometric.value)
+            .filter(Biometric.timestamp >= start, Biometric.timestamp < end)
+            .yield_per(chunk_size),
+            ((r.patient_id, r.type, r.timestamp, r.value) for r in archive.visible_rows(session, start=start, end=end)),
+        )
+        partials, sketches, folded = {}, {}, 0
+        for row in rows:
+            fold_readings([row], partials)
+            fold_sketches([row], sketches)
+            folded += 1
+            if len(partials) >= chunk_size:
+                merge_stats(session, BiometricHourlyStats, partials)
+                merge_sketches(session, sketches)
+                hours.update(partials)
+                partials, sketches = {}, {}
+        merge_stats(session, BiometricHourlyStats, partials)
+        merge_sketches(session, sketches)
+        hours.update(partials)
+
+        rebuild_coarser(session, hours)
+        refresh_analytics(session, {(pid, typ) for pid, typ, _ in hours}, hour_bucket(datetime.utcnow()))
+        session.commit()
+        print(f"Backfilled {folded} readings into rollups [{start} – {end}).")
+        return folded
+    finally:
+        session.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Incremental hourly analytics (v1)")
+    sub = parser.add_subparsers(dest="command")
+    backfill = sub.add_parser("backfill", help="rebuild rollups for a time range")
+    backfill.add_argument("--start", type=datetime.fromisoformat, required=True)
+    backfill.add_argument("--end", type=datetime.fromisoformat, required=True)
+    args = parser.parse_args()
+
+    if args.command == "backfill":
+        backfill_rollups(args.start, args.end)
+    else:
+        run_hourly_analytics()
@@ -1,53 +1,126 @@
 # analytics/compute.py
 
-from sqlalchemy import func
+from typing import Callable, Optional
+
+from sqlalchemy import delete, func, insert, select
 from sqlalchemy.orm import Session
 from datetime import datetime
-from app.db.models import BiometricHourly, Analytics   # import the new table
+from app.analytics.rollups import apply_deferred
+from app.core.cache import invalidate_on_commit
+from app.core.config import settings
+from app.core.metrics import span
+from app.db.models import BiometricHourly, BiometricHourlyClaimed, Analytics
 from app.db.session import SessionLocal
 
+JOB_NAME = "hourly_analytics_v2"
+
+
+def _claim_chunk(session: Session, upper_id: int, chunk_size: int) -> int:
+    """Move up to ``chunk_size`` buffer rows with id <= ``upper_id`` into the staging table.
+
+    DELETE … RETURNING makes the claim atomic: a row is either still in the
+    buffer or in staging, never both and never neither.
+    """
+    buffer = BiometricHourly.__table__
+    ids = select(buffer.c.id).where(buffer.c.id <= upper_id).order_by(buffer.c.id).limit(chunk_size)
+    claimed = session.execute(
+        delete(buffer)
+        .where(buffer.c.id.in_(ids.scalar_subquery()))
+        .returning(buffer.c.id, buffer.c.patient_id, buffer.c.timestamp, buffer.c.type, buffer.c.value)
+    ).all()
+    if claimed:
+        session.execute(
+            insert(BiometricHourlyClaimed.__table__),
+            [
+                {"buffer_id": bid, "patient_id": pid, "timestamp": ts, "type": typ, "value": val}
+                for bid, pid, ts, typ, val in claimed
+            ],
+        )
+    session.commit()
+    return len(claimed)
+
+
+def run_hourly_analytics_v2(
+    chunk_size: Optional[int] = None,
+    computed_at: Optional[datetime] = None,
+    on_commit: Optional[Callable[[], None]] = None,
+) -> None:
+    """Consume rows from biometrics_hourly → write analytics → purge exactly what was consumed.
+
+    1. Snapshot the highest buffer id; rows written after that wait for the next run.
+    2. Claim the slice into ``biometrics_hourly_claimed`` in short, chunked
+       transactions so ingestion into the buffer is never blocked for long.
+    3. Aggregate the staging table, write analytics and empty staging in one
+       transaction. Leftovers of an interrupted run are picked up here too.
 
-def run_hourly_analytics_v2() -> None:
-    """Consume rows from biometrics_hourly → write analytics → purge the hourly buffer."""
+    Hours whose rollups single-reading POSTs deferred are recomputed first.
+    ``computed_at`` defaults to the current minute; ``on_commit`` is called
+    after each committed transaction, e.g. to renew a lease.
+    """
+    chunk_size = chunk_size or settings.ANALYTICS_CHUNK_SIZE
     session: Session = SessionLocal()
     try:
-        # ── 1. Aggregate current buffer ──────────────────────────────────────────
-        rows = (
-            session.query(
-                BiometricHourly.patient_id,
-                BiometricHourly.type,
-                func.min(BiometricHourly.value),
-                func.max(BiometricHourly.value),
-                func.avg(BiometricHourly.value)
-            )
-            .group_by(BiometricHourly.patient_id, BiometricHourly.type)
-            .all()
-        )
+        with span(JOB_NAME, "apply_deferred"):
+            apply_deferred(session, chunk_size, on_commit)
+
+        # ── 1. Claim a bounded slice of the buffer ───────────────────────────────
+        with span(JOB_NAME, "claim"):
+            upper_id = session.query(func.max(BiometricHourly.id)).scalar() or 0
+            session.rollback()
+            while True:
+                claimed = _claim_chunk(session, upper_id, chunk_size)
+                if on_commit:
+                    on_commit()
+                if claimed < chunk_size:
+                    break
 
-        if not rows:          # nothing in the buffer
+        # ── 2. Aggregate the claimed slice ───────────────────────────────────────
+        with span(JOB_NAME, "aggregate"):
+            if settings.ANALYTICS_ENGINE == "numpy":
+                from app.analytics.vectorized import compute_metrics, to_columns
+                staged = session.query(
+                    BiometricHourlyClaimed.patient_id,
+                    BiometricHourlyClaimed.type,
+                    BiometricHourlyClaimed.timestamp,
+                    BiometricHourlyClaimed.value,
+                )
+                metrics = compute_metrics(to_columns(staged))
+            else:
+                metrics = {}
+                for pid, typ, mn, mx, av in session.query(
+                    BiometricHourlyClaimed.patient_id,
+                    BiometricHourlyClaimed.type,
+                    func.min(BiometricHourlyClaimed.value),
+                    func.max(BiometricHourlyClaimed.value),
+                    func.avg(BiometricHourlyClaimed.value)
+                ).group_by(BiometricHourlyClaimed.patient_id, BiometricHourlyClaimed.type):
+                    metrics[(pid, f"{typ}_min")] = mn
+                    metrics[(pid, f"{typ}_max")] = mx
+                    metrics[(pid, f"{typ}_avg")] = av
+
+        if not metrics:       # nothing in the buffer
             session.rollback()
             return
 
-        # ── 2. Build Analytics objects ───────────────────────────────────────────
-        computed_at = datetime.utcnow().replace(second=0, microsecond=0)
-        metrics = [
-            Analytics(patient_id=pid, metric_name=f"{typ}_min", value=mn,  computed_at=computed_at)
-            for pid, typ, mn, _, _ in rows
-        ] + [
-            Analytics(patient_id=pid, metric_name=f"{typ}_max", value=mx,  computed_at=computed_at)
-            for pid, typ, _, mx, _ in rows
-        ] + [
-            Analytics(patient_id=pid, metric_name=f"{typ}_avg", value=av,  computed_at=computed_at)
-            for pid, typ, _, _, av in rows
-        ]
-
-        session.bulk_save_objects(metrics)
-
-        # delete *only* the rows we just used (safer than TRUNCATE in prod)
-        session.query(BiometricHourly).delete(synchronize_session=False)
-
-        session.commit()
-        print(f"Analytics written: {len(metrics)}  •  Buffer cleared.")
+        # ── 3. Write analytics in one statement ──────────────────────────────────
+        with span(JOB_NAME, "write"):
+            computed_at = (computed_at or datetime.utcnow()).replace(second=0, microsecond=0)
+            session.execute(
+                insert(Analytics),
+                [
+                    {"patient_id": pid, "metric_name": name, "value": value, "computed_at": computed_at}
+                    for (pid, name), value in metrics.items()
+                ],
+            )
+            invalidate_on_commit(session, "analytics", {pid for pid, _ in metrics})
+
+            # staging is private to the job, so clearing it cannot touch fresh readings
+            session.execute(delete(BiometricHourlyClaimed.__table__))
+
+            session.commit()
+            if on_commit:
+                on_commit()
+        print(f"Analytics written: {len(metrics)}  •  Buffer slice cleared.")
     except Exception as exc:
         session.rollback()
         print(f"Analytics job failed: {exc}")
@@ -0,0 +1,226 @@
+"""Fleet-wide analytics scheduling.
+
+Every API process runs an APScheduler ticking on ``ANALYTICS_CRON_SCHEDULE``
+(UTC). On each tick a process runs the analytics job only while it holds the
+``analytics`` lease in ``job_leases``, and only for cron slots it manages to
+claim in ``job_runs`` (unique per job and slot). The job renews the lease
+after each chunk it commits and stops when renewal fails, so a run that
+outlasts ``SCHEDULER_LEASE_SECONDS`` keeps its leadership, and one that lost
+it is not overlapped. So whatever the number of workers and replicas, each
+interval is aggregated once and runs never overlap.
+
+Slots missed while nothing was running are caught up by one run for the
+newest of them, the older ones being recorded as skipped, with a note naming
+that run. Neither job works per slot: they process whatever changed since
+their last run (the dirty-series queue, the hourly buffer and the deferred
+hours), so running the older slots first would find nothing left for the
+newer ones, and analytics only keep the latest values per series anyway.
+After a successful run, readings past ``ARCHIVE_AFTER_DAYS`` move to cold
+storage.
+APScheduler is only imported when the scheduler is started.
+"""
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Callable, List, Optional
+
+from sqlalchemy import func, update
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.metrics import span
+from app.db.archive import archive_old
+from app.db.bulk import insert_ignore
+from app.db.lease import acquire_lease, process_owner, release_lease, renew_lease
+from app.db.models import JobRun
+from app.db.session import SessionLocal
+
+JOB_NAME = "analytics"
+DONE = ("ok", "skipped")                # slot statuses that are never run again
+CATCHUP_HORIZON = timedelta(days=7)     # slots older than this are never caught up
+
+_owner = process_owner()
+_running = threading.Lock()             # overlap guard within this process
+_scheduler = None
+
+
+def analytics_job() -> Callable[..., None]:
+    if settings.ANALYTICS_VERSION == "1":
+        from app.analytics.run_hourly_analytics import run_hourly_analytics
+        return run_hourly_analytics
+    from app.analytics.run_hourly_analytics_v2 import run_hourly_analytics_v2
+    return run_hourly_analytics_v2
+
+
+def cron_trigger(expression: Optional[str] = None):
+    from apscheduler.triggers.cron import CronTrigger
+    return CronTrigger.from_crontab(expression or settings.ANALYTICS_CRON_SCHEDULE, timezone=timezone.utc)
+
+
+def fire_times(trigger, after: datetime, until: datetime) -> List[datetime]:
+    """Fire times of ``trigger`` in (after, until], as naive UTC datetimes."""
+    times = []
+    until = until.replace(tzinfo=timezone.utc)
+    at = trigger.get_next_fire_time(None, after.replace(tzinfo=timezone.utc) + timedelta(seconds=1))
+    while at is not None and at <= until:
+        times.append(at.replace(tzinfo=None))
+        at = trigger.get_next_fire_time(at, at + timedelta(seconds=1))
+    return times
+
+
+def due_slots(session: Session, now: datetime, trigger=None) -> List[datetime]:
+    """Slots not yet covered, oldest first: every slot since the last one that ran or
+    was skipped successfully (at most ``SCHEDULER_MAX_CATCHUP``), so failed and
+    interrupted slots come round again; only the latest one when the job never ran."""
+    trigger = trigger or cron_trigger()
+    last = session.query(func.max(JobRun.scheduled_for)).filter(
+        JobRun.job_name == JOB_NAME, JobRun.status.in_(DONE),
+    ).scalar()
+    if last is None:
+        return fire_times(trigger, now - timedelta(days=1), now)[-1:]
+    return fire_times(trigger, max(last, now - CATCHUP_HORIZON), now)[-settings.SCHEDULER_MAX_CATCHUP:]
+
+
+def _claim(session: Session, slot: datetime, owner: str, now: datetime) -> Optional[int]:
+    """Record ``slot`` as running for ``owner``; ``None`` when it already ran or was skipped.
+
+    A failed slot, or one left running by a worker that died, is taken over:
+    the caller holds the lease, so nobody else can be running it.
+    """
+    values = {"owner": owner, "status": "running", "started_at": now, "lag_seconds": (now - slot).total_seconds()}
+    claimed = insert_ignore(
+        session, JobRun.__table__, [{"job_name": JOB_NAME, "scheduled_for": slot, **values}],
+        ("job_name", "scheduled_for"), returning=("id",),
+    )
+    if not claimed:
+        session.execute(
+            update(JobRun)
+            .where(JobRun.job_name == JOB_NAME, JobRun.scheduled_for == slot, JobRun.status.notin_(DONE))
+            .values(**values, error=None, finished_at=None, duration_seconds=None)
+            .execution_options(synchronize_session=False)
+        )
+        claimed = session.query(JobRun.id).filter(
+            JobRun.job_name == JOB_NAME, JobRun.scheduled_for == slot, JobRun.owner == owner,
+            JobRun.status == "running",
+        ).all()
+    session.commit()
+    return claimed[0][0] if claimed else None
+
+
+def _skip(session: Session, slots: List[datetime], covered_by: datetime, owner: str, now: datetime) -> None:
+    """Record older due slots as covered by the run of the newer slot ``covered_by``."""
+    if not slots:
+        return
+    note = (
+        f"covered by the {covered_by:%Y-%m-%d %H:%M} run: the job is incremental and "
+        "processed every reading queued since the last run"
+    )
+    insert_ignore(
+        session, JobRun.__table__,
+        [
+            {"job_name": JOB_NAME, "scheduled_for": slot, "owner": owner, "status": "skipped", "note": note}
+            for slot in slots
+        ],
+        ("job_name", "scheduled_for"),
+    )
+    session.execute(
+        update(JobRun)
+        .where(JobRun.job_name == JOB_NAME, JobRun.scheduled_for.in_(slots), JobRun.status.notin_(DONE))
+        .values(owner=owner, status="skipped", finished_at=now, note=note)
+        .execution_options(synchronize_session=False)
+    )
+    session.commit()
+
+
+def _execute(session: Session, run_id: int, slot: datetime, job: Callable[..., None], owner: str) -> bool:
+    """Run ``job`` for ``slot``, renewing the lease after each chunk it commits.
+
+    A lost lease aborts the job at its next chunk. The outcome is recorded only
+    while the slot is still ``owner``'s, so it never overwrites the record of
+    a worker that took the slot over.
+    """
+    def renew() -> None:
+        renew_lease(session, JOB_NAME, owner, settings.SCHEDULER_LEASE_SECONDS)
+
+    started = datetime.utcnow()
+    status, error = "ok", None
+    try:
+        with span("scheduler", "run"):
+            job(computed_at=slot, on_commit=renew)
+    except Exception as e:
+        status, error = "failed", repr(e)[:1000]
+    finished = datetime.utcnow()
+    session.execute(
+        update(JobRun).where(JobRun.id == run_id, JobRun.owner == owner).values(
+            status=status, error=error, started_at=started, finished_at=finished,
+            duration_seconds=(finished - started).total_seconds(), lag_seconds=(started - slot).total_seconds(),
+        )
+    )
+    session.commit()
+    return status == "ok"
+
+
+def run_due(now: Optional[datetime] = None, owner: Optional[str] = None) -> int:
+    """Run the analytics job once for the newest due slot; returns how many runs happened (0 or 1).
+
+    Skips straight away while a previous run (here or on another worker) still
+    holds the lease. Older due slots are recorded as skipped once the run
+    succeeds; a failed run is recorded, and it and the slots before it are
+    due again on the next tick. A run that loses the lease stops and leaves
+    the lease, and its slots, to the new holder.
+    """
+    if not _running.acquire(blocking=False):
+        print("Previous analytics run still going; skipping.")
+        return 0
+    try:
+        owner = owner or _owner
+        session = SessionLocal()
+        try:
+            if not acquire_lease(session, JOB_NAME, owner, settings.SCHEDULER_LEASE_SECONDS):
+                print("Analytics run held by another worker; skipping.")
+                return 0
+            ran, finished = 0, False
+            try:
+                slots = due_slots(session, now or datetime.utcnow())
+                run_id = _claim(session, slots[-1], owner, datetime.utcnow()) if slots else None
+                if run_id is not None:
+                    ran = 1
+                    if _execute(session, run_id, slots[-1], analytics_job(), owner):
+                        _skip(session, slots[:-1], slots[-1], owner, datetime.utcnow())
+                        finished = True
+                elif not slots:
+                    finished = True
+                if finished:
+                    archive_old(owner=owner)        # no-op unless ARCHIVE_AFTER_DAYS is set
+                return ran
+            finally:
+                release_lease(session, JOB_NAME, owner, finished=finished)
+        finally:
+            session.close()
+    finally:
+        _running.release()
+
+
+def recent_runs(session: Session, limit: int = 50) -> List[JobRun]:
+    return (
+        session.query(JobRun).filter(JobRun.job_name == JOB_NAME)
+        .order_by(JobRun.scheduled_for.desc()).limit(limit).all()
+    )
+
+
+def start_scheduler() -> None:
+    """Tick ``run_due`` on the configured cron, plus once now to catch up after downtime."""
+    global _scheduler
+    if _scheduler is not None:
+        return
+    from apscheduler.schedulers.background import BackgroundScheduler
+    _scheduler = BackgroundScheduler(timezone=timezone.utc)
+    _scheduler.add_job(run_due, cron_trigger(), id=JOB_NAME, max_instances=1, coalesce=True, misfire_grace_time=None)
+    _scheduler.add_job(run_due, id=f"{JOB_NAME}-catchup", max_instances=1)
+    _scheduler.start()
+
+
+def shutdown_scheduler() -> None:
+    global _scheduler
+    if _scheduler is not None:
+        _scheduler.shutdown(wait=False)
+        _scheduler = None
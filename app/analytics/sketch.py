@@ -0,0 +1,119 @@
+import math
+import struct
+from typing import Dict, Iterable, Optional
+
+RELATIVE_ACCURACY = 0.01
+MAX_BINS = 2048
+MIN_INDEXABLE = 1e-9              # |value| below this is counted as zero
+
+_GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+_LOG_GAMMA = math.log(_GAMMA)
+
+_HEADER = struct.Struct("<BQII")  # version, zero count, positive bins, negative bins
+_BIN = struct.Struct("<iI")       # bin index, count
+_VERSION = 1
+
+
+def _index(value: float) -> int:
+    return math.ceil(math.log(value) / _LOG_GAMMA)
+
+
+def _value(index: int) -> float:
+    return 2 * _GAMMA ** index / (_GAMMA + 1)
+
+
+class QuantileSketch:
+    """DDSketch-style mergeable quantile sketch.
+
+    Values fall into logarithmic bins, so every quantile is returned within
+    ``RELATIVE_ACCURACY`` of the true value. Merging two sketches adds their bin
+    counts, which is exact, so per-hour sketches can be combined over any range.
+    Size is bounded by the spread of the values (and capped at ``MAX_BINS`` by
+    collapsing the lowest bins), never by the number of readings.
+    """
+
+    __slots__ = ("positive", "negative", "zero_count")
+
+    def __init__(self):
+        self.positive: Dict[int, int] = {}
+        self.negative: Dict[int, int] = {}
+        self.zero_count = 0
+
+    @classmethod
+    def of(cls, values: Iterable[float]) -> "QuantileSketch":
+        sketch = cls()
+        for value in values:
+            sketch.add(value)
+        return sketch
+
+    @property
+    def count(self) -> int:
+        return self.zero_count + sum(self.positive.values()) + sum(self.negative.values())
+
+    def add(self, value: float, count: int = 1) -> None:
+        if value > MIN_INDEXABLE:
+            bins, key = self.positive, _index(value)
+        elif value < -MIN_INDEXABLE:
+            bins, key = self.negative, _index(-value)
+        else:
+            self.zero_count += count
+            return
+        bins[key] = bins.get(key, 0) + count
+        if len(bins) > MAX_BINS:
+            self._collapse(bins)
+
+    def merge(self, other: "QuantileSketch") -> "QuantileSketch":
+        for bins, theirs in ((self.positive, other.positive), (self.negative, other.negative)):
+            for key, count in theirs.items():
+                bins[key] = bins.get(key, 0) + count
+            if len(bins) > MAX_BINS:
+                self._collapse(bins)
+        self.zero_count += other.zero_count
+        return self
+
+    @staticmethod
+    def _collapse(bins: Dict[int, int]) -> None:
+        """Fold the lowest-magnitude bins together until ``MAX_BINS`` remain."""
+        keys = sorted(bins)
+        excess = keys[: len(keys) - MAX_BINS + 1]
+        bins[excess[-1]] += sum(bins.pop(key) for key in excess[:-1])
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Value at quantile ``q`` (0 ≤ q ≤ 1); ``None`` for an empty sketch."""
+        total = self.count
+        if not total:
+            return None
+        rank = q * (total - 1)
+        seen = 0
+        for key in sorted(self.negative, reverse=True):
+            seen += self.negative[key]
+            if seen > rank:
+                return -_value(key)
+        seen += self.zero_count
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.positive):
+            seen += self.positive[key]
+            if seen > rank:
+                return _value(key)
+        return _value(max(self.positive))
+
+    def to_bytes(self) -> bytes:
+        parts = [_HEADER.pack(_VERSION, self.zero_count, len(self.positive), len(self.negative))]
+        for bins in (self.positive, self.negative):
+            parts.extend(_BIN.pack(key, count) for key, count in sorted(bins.items()))
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "QuantileSketch":
+        version, zero_count, n_positive, n_negative = _HEADER.unpack_from(data)
+        if version != _VERSION:
+            raise ValueError(f"Unsupported sketch version {version}")
+        sketch = cls()
+        sketch.zero_count = zero_count
+        offset = _HEADER.size
+        for bins, n in ((sketch.positive, n_positive), (sketch.negative, n_negative)):
+            for key, count in _BIN.iter_unpack(data[offset:offset + n * _BIN.size]):
+                bins[key] = count
+            offset += n * _BIN.size
+        return sketch
@@ -0,0 +1,188 @@
+"""Columnar analytics engine (``ANALYTICS_ENGINE="numpy"``).
+
+Readings are pulled as NumPy columns, sorted once by (patient, type, value)
+and reduced per series with ``ufunc.reduceat`` over the group boundaries, so
+the cost is a sort plus a handful of vectorised passes however many metrics
+are produced. The incremental job only feeds it a trailing 30-day window, for
+exact percentiles, time-in-range and trends, and takes whole-history metrics
+from the rollups and live statistics.
+NumPy is an optional dependency, only needed when this engine is selected.
+"""
+import math
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, NamedTuple, Sequence, Set, Tuple
+
+import numpy as np
+from sqlalchemy import and_, func, or_, select, tuple_
+from sqlalchemy.orm import Session
+
+from app.analytics.aggregates import PERCENTILES, type_name, write_metrics
+from app.db import archive
+from app.db.bulk import chunked
+from app.db.models import (
+    Biometric, BiometricHourlyStats, BiometricLiveStats, BiometricMonthlyStats, BiometricType,
+)
+
+TYPE_NAMES = tuple(t.value for t in BiometricType)
+TYPE_CODES = {name: code for code, name in enumerate(TYPE_NAMES)}
+
+TREND_WINDOWS_DAYS = (7, 30)
+WINDOW_DAYS = max(TREND_WINDOWS_DAYS)    # trailing raw-reading window of the incremental job
+WINDOW_METRICS = tuple(f"_p{q}" for q in PERCENTILES) + ("_tir",) + tuple(f"_trend_{w}d" for w in TREND_WINDOWS_DAYS)
+GLUCOSE_RANGE = (70.0, 180.0)    # mg/dL, consensus time-in-range target
+
+SECONDS_PER_DAY = 86400.0
+
+
+class Columns(NamedTuple):
+    patient_id: np.ndarray   # int64
+    type_code: np.ndarray    # int64, index into TYPE_NAMES
+    timestamp: np.ndarray    # float64, seconds since the epoch
+    value: np.ndarray        # float64
+
+
+def to_columns(rows: Iterable[Tuple[int, str, datetime, float]]) -> Columns:
+    """(patient_id, type, timestamp, value) rows → ``Columns``."""
+    rows = list(rows)
+    if not rows:
+        return Columns(*(np.empty(0, dtype) for dtype in (np.int64, np.int64, np.float64, np.float64)))
+    pids, types, stamps, values = zip(*rows)
+    return Columns(
+        np.asarray(pids, dtype=np.int64),
+        np.fromiter((TYPE_CODES[type_name(t)] for t in types), dtype=np.int64, count=len(types)),
+        np.asarray(stamps, dtype="datetime64[us]").astype(np.int64) / 1e6,
+        np.asarray(values, dtype=np.float64),
+    )
+
+
+def compute_metrics(cols: Columns) -> Dict[Tuple[int, str], float]:
+    """All per-series metrics of ``cols``, keyed by (patient_id, metric name).
+
+    Per series: ``min``, ``max``, ``avg``, ``std`` (sample), ``p<N>`` for each of
+    ``PERCENTILES`` (linear interpolation), ``trend_7d``/``trend_30d`` (least-squares slope in
+    units per day over the window ending at the series' latest reading) and, for
+    glucose, ``tir`` (percentage of readings within ``GLUCOSE_RANGE``).
+    """
+    if not len(cols.value):
+        return {}
+    order = np.lexsort((cols.value, cols.type_code, cols.patient_id))
+    pid, code, ts, val = (column[order] for column in cols)
+
+    boundary = (pid[1:] != pid[:-1]) | (code[1:] != code[:-1])
+    starts = np.concatenate(([0], np.flatnonzero(boundary) + 1))
+    counts = np.diff(np.append(starts, len(val)))
+    last = starts + counts - 1
+
+    stats: Dict[str, np.ndarray] = {}
+    # values are sorted within each series, so order statistics are plain indexing
+    stats["min"], stats["max"] = val[starts], val[last]
+    means = np.add.reduceat(val, starts) / counts
+    stats["avg"] = means
+    deviation = val - np.repeat(means, counts)
+    stats["std"] = np.sqrt(np.add.reduceat(deviation * deviation, starts) / np.maximum(counts - 1, 1))
+    for q in PERCENTILES:
+        pos = starts + (q / 100) * (counts - 1)
+        lo = np.floor(pos).astype(np.int64)
+        hi = np.minimum(lo + 1, last)
+        stats[f"p{q}"] = val[lo] + (val[hi] - val[lo]) * (pos - lo)
+
+    in_range = ((val >= GLUCOSE_RANGE[0]) & (val <= GLUCOSE_RANGE[1])).astype(np.float64)
+    tir = 100 * np.add.reduceat(in_range, starts) / counts
+
+    # days relative to the series' latest reading (≤ 0)
+    days = (ts - np.repeat(np.maximum.reduceat(ts, starts), counts)) / SECONDS_PER_DAY
+    trends = {}
+    for window in TREND_WINDOWS_DAYS:
+        w = (days > -window).astype(np.float64)
+        n = np.add.reduceat(w, starts)
+        st, sv = np.add.reduceat(w * days, starts), np.add.reduceat(w * val, starts)
+        stt, stv = np.add.reduceat(w * days * days, starts), np.add.reduceat(w * days * val, starts)
+        denom = n * stt - st * st
+        valid = (n >= 2) & (denom > 1e-12)
+        slope = np.full(len(starts), np.nan)
+        np.divide(n * stv - st * sv, denom, out=slope, where=valid)
+        trends[f"trend_{window}d"] = slope
+
+    group_pid, group_type = pid[starts].tolist(), [TYPE_NAMES[c] for c in code[starts].tolist()]
+    columns = {name: values.tolist() for name, values in {**stats, **trends}.items()}
+    tir = tir.tolist()
+
+    metrics: Dict[Tuple[int, str], float] = {}
+    for i, (p, typ) in enumerate(zip(group_pid, group_type)):
+        for name, values in columns.items():
+            if values[i] == values[i]:          # skip NaN (trend without two readings)
+                metrics[(p, f"{typ}_{name}")] = values[i]
+        if typ == BiometricType.glucose.value:
+            metrics[(p, f"{typ}_tir")] = tir[i]
+    return metrics
+
+
+def refresh_series(session: Session, series: Set[Tuple[int, str]], computed_at: datetime) -> int:
+    """``refresh_analytics`` for the columnar engine.
+
+    Whole-history metrics come from the stored aggregates: ``min``/``max``/``avg``
+    from the monthly rollup and ``std`` from the live Welford state, skipped when
+    the live state does not cover every reading of the series. Percentiles,
+    ``tir`` and trends are computed exactly from the raw readings, archived ones
+    included, of the last ``WINDOW_DAYS`` days before the series' latest hour.
+    """
+    metrics: Dict[Tuple[int, str], float] = {}
+    for chunk in chunked(sorted(series), 200):
+        latest = _summary_metrics(session, chunk, metrics)
+        metrics.update(_window_metrics(session, latest))
+    write_metrics(session, metrics, computed_at)
+    return len(metrics)
+
+
+def _summary_metrics(
+    session: Session, chunk: Sequence[Tuple[int, str]], metrics: Dict[Tuple[int, str], float],
+) -> Dict[Tuple[int, str], datetime]:
+    """Add the rollup- and Welford-derived metrics of ``chunk`` to ``metrics``;
+    returns the latest hour bucket of each series."""
+    monthly, hourly, live = BiometricMonthlyStats, BiometricHourlyStats, BiometricLiveStats
+    counts: Dict[Tuple[int, str], int] = {}
+    for pid, typ, count, total, mn, mx in session.query(
+        monthly.patient_id, monthly.type,
+        func.sum(monthly.count), func.sum(monthly.sum), func.min(monthly.min), func.max(monthly.max),
+    ).filter(tuple_(monthly.patient_id, monthly.type).in_(chunk)).group_by(monthly.patient_id, monthly.type):
+        counts[(pid, typ)] = count
+        metrics.update({(pid, f"{typ}_min"): mn, (pid, f"{typ}_max"): mx, (pid, f"{typ}_avg"): total / count})
+
+    for pid, typ, count, m2 in session.query(live.patient_id, live.type, live.count, live.m2).filter(
+        tuple_(live.patient_id, live.type).in_(chunk)
+    ):
+        if count and count == counts.get((pid, typ)):
+            metrics[(pid, f"{typ}_std")] = math.sqrt(m2 / max(count - 1, 1))
+
+    return {
+        (pid, typ): bucket
+        for pid, typ, bucket in session.query(hourly.patient_id, hourly.type, func.max(hourly.bucket))
+        .filter(tuple_(hourly.patient_id, hourly.type).in_(chunk))
+        .group_by(hourly.patient_id, hourly.type)
+    }
+
+
+def _window_metrics(session: Session, latest: Dict[Tuple[int, str], datetime]) -> Dict[Tuple[int, str], float]:
+    """Percentile, ``tir`` and ``trend_<N>d`` metrics from the raw readings of the last
+    ``WINDOW_DAYS`` days before each series' latest hour."""
+    if not latest:
+        return {}
+    since = {key: hour - timedelta(days=WINDOW_DAYS) for key, hour in latest.items()}
+    raw = select(Biometric.patient_id, Biometric.type, Biometric.timestamp, Biometric.value).where(or_(*(
+        and_(Biometric.patient_id == pid, Biometric.type == typ, Biometric.timestamp >= start)
+        for (pid, typ), start in since.items()
+    )))
+    rows = session.execute(raw).all()
+
+    cold_until = archive.horizon()
+    if cold_until is not None and min(since.values()) < cold_until:
+        cold = [key for key, start in since.items() if start < cold_until]
+        rows.extend(
+            (r.patient_id, r.type, r.timestamp, r.value)
+            for r in archive.visible_rows(
+                session, {pid for pid, _ in cold}, start=min(since[key] for key in cold),
+                types={typ for _, typ in cold},
+            )
+            if r.timestamp >= since.get((r.patient_id, r.type.value), cold_until)
+        )
+    return {key: value for key, value in compute_metrics(to_columns(rows)).items() if key[1].endswith(WINDOW_METRICS)}
@@ -1,30 +1,156 @@
+from datetime import datetime
 from typing import List, Optional
 
-from fastapi import APIRouter, Depends, Query
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import select
+from sqlalchemy.orm import Session, aliased
 
-from app.db.models import Analytics
-from app.db.session import SessionLocal
+from app.api.export import export_response
+from app.analytics.rollups import read_quantiles
+from app.analytics.scheduler import recent_runs
+from app.analytics.sketch import RELATIVE_ACCURACY
+from app.api.params import parse_id_list, parse_quantiles
+from app.api.serialization import cached_json, parse_fields, project
+from app.core.cache import get_cache
+from app.core.config import settings
+from app.db.models import Analytics, BiometricType
+from app.db.session import DbSession, get_read_db, run_db
 from app.schemas.pydantic_models import AnalyticsOut
 
 
-def get_db():
-    db = SessionLocal()
-    try: yield db
-    finally: db.close()
-
 router = APIRouter()
 
+ANALYTICS_FIELDS = tuple(AnalyticsOut.model_fields)
+
 @router.get("/analytics", response_model=List[AnalyticsOut])
-def get_patient_analytics(
-    patient_id: int = Query(...),
+async def get_patient_analytics(
+    patient_id: Optional[int] = Query(None),
+    patient_ids: Optional[List[str]] = Query(None, description="Several patients at once, comma-separated or repeated"),
     metric: Optional[str] = Query(None, description="Optional metric name filter (e.g., glucose_min)"),
-    db: Session = Depends(get_db)
+    latest: bool = Query(False, description="Only the most recent value of each metric"),
+    from_: Optional[datetime] = Query(None, alias="from"),
+    to: Optional[datetime] = Query(None),
+    fields: Optional[str] = Query(None, description=f"Comma-separated subset of {', '.join(ANALYTICS_FIELDS)}"),
+    db: DbSession = Depends(get_read_db)
 ):
-    query = db.query(Analytics).filter(Analytics.patient_id == patient_id)
+    ids = parse_id_list(patient_ids) or []
+    if patient_id is not None:
+        ids.append(patient_id)
+    if not ids:
+        raise HTTPException(status_code=400, detail="patient_id or patient_ids is required")
 
-    if metric:
-        query = query.filter(Analytics.metric_name == metric)
+    selected = parse_fields(fields, ANALYTICS_FIELDS)
+
+    def build(db: Session):
+        filters = [Analytics.patient_id.in_(ids) if len(ids) > 1 else Analytics.patient_id == ids[0]]
+        if metric:
+            filters.append(Analytics.metric_name == metric)
+        if from_ is not None:
+            filters.append(Analytics.computed_at >= from_)
+        if to is not None:
+            filters.append(Analytics.computed_at < to)
+
+        if latest:
+            # per row, one seek on the (patient_id, metric_name, computed_at) index for the
+            # newest id of its series; rows that are not the newest are dropped without a sort
+            newer = aliased(Analytics)
+            bounds = []
+            if from_ is not None:
+                bounds.append(newer.computed_at >= from_)
+            if to is not None:
+                bounds.append(newer.computed_at < to)
+            newest_id = (
+                select(newer.id)
+                .where(newer.patient_id == Analytics.patient_id, newer.metric_name == Analytics.metric_name, *bounds)
+                .order_by(newer.computed_at.desc(), newer.id.desc())
+                .limit(1)
+                .correlate(Analytics)
+                .scalar_subquery()
+            )
+            order = [getattr(Analytics, f) for f in ("patient_id", "metric_name") if f in selected]
+            results = db.execute(
+                select(*(getattr(Analytics, f) for f in selected))
+                .where(*filters, Analytics.id == newest_id)
+                .order_by(*order)
+            ).all()
+        else:
+            query = db.query(*(getattr(Analytics, f) for f in selected)).filter(*filters)
+            results = query.order_by(Analytics.computed_at.desc()).all()
+        return project(results, selected, selected)
+
+    params = ("history", tuple(sorted(ids)), metric, latest, from_, to, selected)
+    return await cached_json("analytics", ids, params, lambda: run_db(db, build))
+
+
+@router.get("/analytics/quantiles")
+async def get_quantiles(
+    patient_id: int = Query(...),
+    type: BiometricType = Query(...),
+    from_: Optional[datetime] = Query(None, alias="from"),
+    to: Optional[datetime] = Query(None),
+    q: Optional[List[str]] = Query(None, description="Quantiles in [0, 1], comma-separated or repeated (default 0.5)"),
+    db: DbSession = Depends(get_read_db)
+):
+    """Quantiles of one series over a time range, merged from the hourly quantile sketches."""
+    qs = parse_quantiles(q, [0.5])
+
+    def build(db: Session):
+        count, values = read_quantiles(db, patient_id, type.value, qs, from_, to)
+        return {
+            "patient_id": patient_id,
+            "type": type.value,
+            "count": count,
+            "relative_accuracy": RELATIVE_ACCURACY,
+            "quantiles": [{"q": quantile, "value": value} for quantile, value in zip(qs, values)],
+        }
 
-    results = query.order_by(Analytics.computed_at.desc()).all()
-    return results
\ No newline at end of file
+    params = ("quantiles", type.value, from_, to, tuple(qs))
+    return await cached_json("series", [patient_id], params, lambda: run_db(db, build))
+
+
+@router.get("/analytics/cache/stats")
+def get_cache_stats():
+    """Hit rate, evictions and memory use of the analytics/rollup read cache."""
+    return {"enabled": settings.CACHE_ENABLED, **get_cache().stats()}
+
+
+@router.get("/analytics/jobs")
+async def get_job_runs(limit: int = Query(50, ge=1, le=1000), db: DbSession = Depends(get_read_db)):
+    """Recent scheduled analytics runs, newest first, with their duration and lag behind the schedule."""
+    def read(db: Session):
+        return [
+            {
+                "scheduled_for": run.scheduled_for, "status": run.status, "owner": run.owner,
+                "started_at": run.started_at, "finished_at": run.finished_at,
+                "duration_seconds": run.duration_seconds, "lag_seconds": run.lag_seconds, "error": run.error,
+                "note": run.note,
+            }
+            for run in recent_runs(db, limit)
+        ]
+
+    return {"cron": settings.ANALYTICS_CRON_SCHEDULE, "runs": await run_db(db, read)}
+
+
+ANALYTICS_EXPORT_COLUMNS = ("patient_id", "metric_name", "value", "computed_at")
+
+@router.get("/analytics/export")
+async def export_analytics(
+    patient_ids: Optional[List[str]] = Query(None, description="Patient ids, comma-separated or repeated"),
+    metric: Optional[str] = Query(None, description="Optional metric name filter (e.g., glucose_min)"),
+    from_: Optional[datetime] = Query(None, alias="from"),
+    to: Optional[datetime] = Query(None),
+    format: str = Query("ndjson", description="ndjson, csv or parquet"),
+):
+    """Stream matching analytics rows from a server-side cursor, in constant memory."""
+    ids = parse_id_list(patient_ids)
+    stmt = select(*(getattr(Analytics, c) for c in ANALYTICS_EXPORT_COLUMNS))
+    if ids is not None:
+        stmt = stmt.where(Analytics.patient_id.in_(ids))
+    if metric:
+        stmt = stmt.where(Analytics.metric_name == metric)
+    if from_ is not None:
+        stmt = stmt.where(Analytics.computed_at >= from_)
+    if to is not None:
+        stmt = stmt.where(Analytics.computed_at < to)
+    stmt = stmt.order_by(Analytics.patient_id, Analytics.computed_at, Analytics.id)
+    return export_response(stmt, ANALYTICS_EXPORT_COLUMNS, format, "analytics")
@@ -1,60 +1,200 @@
+import asyncio
+import json
+import queue
+from collections import namedtuple
+from datetime import datetime
 from typing import Optional, List
 
-from fastapi import APIRouter, Depends, HTTPException, Query, Path
-from pydantic import BaseModel
+from fastapi import APIRouter, Depends, HTTPException, Query, Path, Request
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import select
 from sqlalchemy.orm import Session
-from app.db.session import SessionLocal
-from app.db.models import Biometric, BiometricHourly
+from app.core.config import settings
+from app.db import archive
+from app.db.bulk import upsert
+from app.db.session import DbSession, get_db, get_read_db, run_db
+from app.db.models import Biometric, BiometricHourly, BiometricType
+from app.analytics.live import update_live_stats
+from app.analytics.rollups import defer_hours, read_series, recompute_hours
+from app.api.export import export_response
+from app.api.pagination import paginate
+from app.api.params import parse_id_list
+from app.api.serialization import FastJSONResponse, cached_json, parse_fields, project
+from app.etl.load import BIOMETRIC_KEY, upsert_biometrics
+from app.etl.write_behind import BufferClosed, get_write_behind
 from app.schemas.pydantic_models import BiometricIn, BiometricOut
 
 router = APIRouter(tags=["biometrics"])
 
-def get_db():
-    db = SessionLocal()
-    try: yield db
-    finally: db.close()
-
 
 class BiometricListOut(BaseModel):
-    page: int
+    page: Optional[int]
     size: int
-    total: int
+    total: Optional[int]
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
     items: List[BiometricOut]
 
+
+class BiometricBatchItemStatus(BaseModel):
+    index: int
+    status: str                     # "ok" | "error"
+    detail: Optional[str] = None
+
+
+class BiometricBatchOut(BaseModel):
+    accepted: int
+    rejected: int
+    items: List[BiometricBatchItemStatus]
+
+class SeriesPoint(BaseModel):
+    start: datetime
+    count: int
+    min: float
+    max: float
+    avg: float
+
+
+class BiometricSeriesOut(BaseModel):
+    patient_id: int
+    type: BiometricType
+    bucket: str
+    resolution: str                 # rollup the points were read from
+    points: List[SeriesPoint]
+
+BIOMETRIC_FIELDS = tuple(BiometricOut.model_fields)
+BIOMETRIC_EXPORT_COLUMNS = ("id", "patient_id", "timestamp", "type", "value")
+NDJSON_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+
 @router.get("/biometrics", response_model=BiometricListOut)
-def get_biometric_history(
+async def get_biometric_history(
     patient_id: int = Query(...),
     type: Optional[str] = Query(None),
     page: int = Query(1, ge=1),
     size: int = Query(20, ge=1, le=100),
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = Query(None, description="next_cursor/prev_cursor from a previous page; overrides page"),
+    include_total: Optional[bool] = Query(None, description="Count matching rows (default: yes with page, no with cursor)"),
+    fields: Optional[str] = Query(None, description=f"Comma-separated subset of {', '.join(BIOMETRIC_FIELDS)}"),
+    db: DbSession = Depends(get_read_db)
 ):
-    query = db.query(Biometric).filter(Biometric.patient_id == patient_id)
+    selected = parse_fields(fields, BIOMETRIC_FIELDS)
+    names = tuple(dict.fromkeys(selected + ("timestamp", "id")))   # sort key is always fetched
+    if include_total is None:
+        include_total = cursor is None
+    Row = namedtuple("Row", names)
 
-    if type:
-        query = query.filter(Biometric.type == type)
-
-    total = query.count()
-    items = (
-        query.order_by(Biometric.timestamp.desc())
-        .offset((page - 1) * size)
-        .limit(size)
-        .all()
-    )
+    def read(db: Session):
+        query = db.query(*(getattr(Biometric, n) for n in names)).filter(Biometric.patient_id == patient_id)
+        if type:
+            query = query.filter(Biometric.type == type)
+
+        types = [type] if type else None
+
+        def cold(after, descending):
+            return (
+                Row(*(getattr(r, n) for n in names))
+                for r in archive.ordered_rows(db, patient_id, types, after, descending)
+            )
+
+        total = None
+        if include_total:
+            total = query.count() + archive.count_rows(db, patient_id, types)
+        page_rows = paginate(
+            query,
+            (Biometric.timestamp, Biometric.id),
+            lambda b: (b.timestamp, b.id),
+            size,
+            cursor=cursor,
+            offset=(page - 1) * size,
+            descending=True,
+            extra=cold,
+        )
+        return total, page_rows
 
-    return {
-        "page": page,
+    total, (items, next_cursor, prev_cursor) = await run_db(db, read)
+
+    return FastJSONResponse({
+        "page": None if cursor else page,
         "size": size,
         "total": total,
-        "items": items,
-    }
+        "next_cursor": next_cursor,
+        "prev_cursor": prev_cursor,
+        "items": project(items, names, selected),
+    })
+
+
+@router.get("/biometrics/series", response_model=BiometricSeriesOut)
+async def get_biometric_series(
+    patient_id: int = Query(...),
+    type: BiometricType = Query(...),
+    from_: Optional[datetime] = Query(None, alias="from"),
+    to: Optional[datetime] = Query(None),
+    bucket: str = Query("1d", description="Bucket width: 1h, 6h, 1d, 1w, 1M, … or hour/day/week/month"),
+    db: DbSession = Depends(get_read_db)
+):
+    """Downsampled count/min/max/avg series served from the hourly, daily or monthly rollup."""
+    def build(db: Session):
+        try:
+            resolution, points = read_series(db, patient_id, type.value, bucket, from_, to)
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=str(exc))
+        return {"patient_id": patient_id, "type": type.value, "bucket": bucket, "resolution": resolution, "points": points}
+
+    return await cached_json("series", [patient_id], (type.value, bucket, from_, to), lambda: run_db(db, build))
+
+
+@router.get("/biometrics/export")
+async def export_biometrics(
+    patient_ids: Optional[List[str]] = Query(None, description="Patient ids, comma-separated or repeated"),
+    type: Optional[BiometricType] = Query(None),
+    from_: Optional[datetime] = Query(None, alias="from"),
+    to: Optional[datetime] = Query(None),
+    format: str = Query("ndjson", description="ndjson, csv or parquet"),
+    db: DbSession = Depends(get_read_db)
+):
+    """Stream matching readings from a server-side cursor, in constant memory."""
+    ids = parse_id_list(patient_ids)
+    stmt = select(*(getattr(Biometric, c) for c in BIOMETRIC_EXPORT_COLUMNS))
+    if ids is not None:
+        stmt = stmt.where(Biometric.patient_id.in_(ids))
+    if type:
+        stmt = stmt.where(Biometric.type == type)
+    if from_ is not None:
+        stmt = stmt.where(Biometric.timestamp >= from_)
+    if to is not None:
+        stmt = stmt.where(Biometric.timestamp < to)
+    stmt = stmt.order_by(Biometric.patient_id, Biometric.timestamp, Biometric.id)
+    return export_response(
+        stmt, BIOMETRIC_EXPORT_COLUMNS, format, "biometrics",
+        extra=await run_db(db, _archived_export_rows, ids, type, from_, to), key=lambda r: (r[1], r[2], r[0]),
+    )
+
+
+def _archived_export_rows(session: Session, ids, type, start, end):
+    """Archived readings matching an export, as export column tuples in its order."""
+    cold_until = archive.horizon()
+    if cold_until is None or (start is not None and start.replace(tzinfo=None) >= cold_until):
+        return None
+    hidden = archive.shadowed(session, ids)
+    return (
+        tuple(getattr(r, c) for c in BIOMETRIC_EXPORT_COLUMNS)
+        for r in archive.read_rows(ids, start, end, [type] if type else None)
+        if (r.patient_id, r.type.value, r.timestamp) not in hidden
+    )
 
 
 @router.post("/biometrics", response_model=BiometricOut)
-def upsert_biometric(
+async def upsert_biometric(
     data: BiometricIn,
-    db: Session = Depends(get_db)
+    db: DbSession = Depends(get_db)
 ):
+    if settings.WRITE_BEHIND_ENABLED:
+        return await _enqueue_biometric(data)
+    return await run_db(db, _upsert_biometric, data)
+
+
+def _upsert_biometric(db: Session, data: BiometricIn) -> Biometric:
     # ---------- 1. Upsert into the main table ---------------------------------
     biometric = (
         db.query(Biometric)
@@ -66,6 +206,11 @@ def upsert_biometric(
         .first()
     )
 
+    if biometric:
+        previous = biometric.value
+    else:                                                  # an archived reading counts as the stored one
+        key = (data.patient_id, data.timestamp.replace(tzinfo=None), data.type)
+        previous = archive.archived_values([key]).get(key)
     if biometric:
         biometric.value = data.value                       # update
     else:
@@ -73,39 +218,111 @@ def upsert_biometric(
         db.add(biometric)
 
     # ---------- 2. Upsert into the hourly buffer ------------------------------
-    hourly = (
-        db.query(BiometricHourly)
-        .filter_by(
-            patient_id=data.patient_id,
-            timestamp=data.timestamp,
-            type=data.type
-        )
-        .first()
-    )
+    upsert(db, BiometricHourly.__table__, [data.dict()], BIOMETRIC_KEY, lambda excluded: {"value": excluded.value})
 
-    if hourly:
-        hourly.value = data.value                          # update
-    else:
-        db.add(BiometricHourly(**data.dict()))             # insert
+    # ---------- 3. Live stats now, rollups with the next analytics run --------
+    db.flush()
+    reading = (biometric.id, data.patient_id, data.type, biometric.timestamp, data.value)
+    if previous is None:
+        update_live_stats(db, [reading])
+    elif previous != data.value:
+        update_live_stats(db, [reading], [(data.patient_id, data.type, previous)])
+    if previous != data.value:
+        defer_hours(db, [(data.patient_id, data.type, biometric.timestamp)])
 
-    # ---------- 3. Commit ------------------------------------------------------
+    # ---------- 4. Commit ------------------------------------------------------
     db.commit()
     db.refresh(biometric)
     return biometric
 
+async def _enqueue_biometric(data: BiometricIn):
+    """Write-behind path: hand the reading to the group-commit buffer."""
+    row = data.model_dump()
+    try:
+        future = get_write_behind().submit(row)
+    except queue.Full:
+        raise HTTPException(status_code=503, detail="Ingestion buffer is full, retry later")
+    except BufferClosed:
+        raise HTTPException(status_code=503, detail="Ingestion buffer is shutting down, retry later")
+
+    if settings.WRITE_BEHIND_DURABILITY == "enqueue":
+        return JSONResponse(status_code=202, content={"status": "queued"})
+    return BiometricOut(id=await asyncio.wrap_future(future), **row)
+
+
+@router.get("/biometrics/ingest/stats")
+def get_ingest_stats():
+    """Write-behind buffer queue depth, flush sizes and flush latency."""
+    return {"enabled": settings.WRITE_BEHIND_ENABLED, **get_write_behind().stats()}
+
+
 @router.delete("/biometrics/{biometric_id}")
-def delete_biometric(
+async def delete_biometric(
     biometric_id: int,
-    db: Session = Depends(get_db)
+    db: DbSession = Depends(get_db)
 ):
+    await run_db(db, _delete_biometric, biometric_id)
+    return {"ok": True, "deleted_id": biometric_id}
+
+
+def _delete_biometric(db: Session, biometric_id: int) -> None:
     biometric = db.query(Biometric).filter_by(id=biometric_id).first()
 
     if not biometric:
         raise HTTPException(status_code=404, detail="Biometric record not found")
 
     db.delete(biometric)
+    db.flush()
+    recompute_hours(db, [(biometric.patient_id, biometric.type, biometric.timestamp)])
+    update_live_stats(db, [], [(biometric.patient_id, biometric.type, biometric.value)])
     db.commit()
 
-    return {"ok": True, "deleted_id": biometric_id}
 
+def _parse_batch_body(body: bytes, content_type: str) -> list:
+    """Decode a JSON array or an NDJSON (one object per line) request body."""
+    try:
+        if content_type.split(";")[0].strip() in NDJSON_TYPES:
+            return [json.loads(line) for line in body.splitlines() if line.strip()]
+        items = json.loads(body)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=f"Malformed batch body: {exc}")
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="Batch body must be a JSON array or NDJSON")
+    return items
+
+
+def _write_batch(db: Session, rows: List[dict]) -> None:
+    upsert_biometrics(db, rows)
+    db.commit()
+
+
+@router.post("/biometrics:batch", response_model=BiometricBatchOut)
+async def upsert_biometrics_batch(
+    request: Request,
+    db: DbSession = Depends(get_db)
+):
+    """Upsert many readings (JSON array or NDJSON) in one transaction."""
+    items = _parse_batch_body(await request.body(), request.headers.get("content-type", ""))
+    if len(items) > settings.BIOMETRIC_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch exceeds {settings.BIOMETRIC_BATCH_MAX_ITEMS} items",
+        )
+
+    # ---------- 1. Validate every item, collecting per-item status ------------
+    rows, statuses = [], []
+    for index, item in enumerate(items):
+        try:
+            data = BiometricIn.model_validate(item)
+            BiometricType(data.type)
+        except (ValidationError, ValueError) as exc:
+            statuses.append(BiometricBatchItemStatus(index=index, status="error", detail=str(exc)))
+            continue
+        rows.append(data.model_dump())
+        statuses.append(BiometricBatchItemStatus(index=index, status="ok"))
+
+    # ---------- 2. Set-based upsert into both tables, one commit ---------------
+    if rows:
+        await run_db(db, _write_batch, rows)
 
+    return BiometricBatchOut(accepted=len(rows), rejected=len(items) - len(rows), items=statuses)
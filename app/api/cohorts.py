@@ -0,0 +1,45 @@
+from datetime import datetime
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+
+from app.analytics.cohorts import read_cohort_stats
+from app.api.serialization import FastJSONResponse
+from app.db.models import BiometricType, Gender
+from app.db.session import DbSession, get_read_db, run_db
+
+router = APIRouter(tags=["cohorts"])
+
+COHORT_GROUPS = ("age_band", "gender", "day", "month")
+
+
+@router.get("/cohorts/stats")
+async def get_cohort_stats(
+    type: BiometricType = Query(...),
+    gender: Optional[List[Gender]] = Query(None, description="One or more genders (repeat the parameter)"),
+    age_min: Optional[int] = Query(None, ge=0),
+    age_max: Optional[int] = Query(None, ge=0),
+    from_: Optional[datetime] = Query(None, alias="from"),
+    to: Optional[datetime] = Query(None),
+    group_by: Optional[str] = Query(None, description=f"Comma-separated subset of {', '.join(COHORT_GROUPS)}"),
+    db: DbSession = Depends(get_read_db)
+):
+    """count/min/max/avg of a biometric type across a population cohort, from the cohort daily aggregates.
+
+    Ages are matched per 10-year band (age at the reading's day); only bands lying
+    entirely within [age_min, age_max] are included.
+    """
+    groups = tuple(g.strip() for g in group_by.split(",") if g.strip()) if group_by else ()
+    unknown = [g for g in groups if g not in COHORT_GROUPS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown group_by: {', '.join(unknown)}")
+    if "day" in groups and "month" in groups:
+        raise HTTPException(status_code=400, detail="Group by day or month, not both")
+
+    def read(db: Session):
+        return read_cohort_stats(
+            db, type.value, [g.value for g in gender] if gender else None, age_min, age_max, from_, to, groups
+        )
+
+    return FastJSONResponse({"type": type.value, "group_by": list(groups), "groups": await run_db(db, read)})
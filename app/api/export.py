@@ -0,0 +1,225 @@
+import csv
+import enum
+import heapq
+import io
+import json
+from datetime import date, datetime
+from typing import AsyncIterator, Callable, Iterable, Iterator, List, Optional, Sequence
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from sqlalchemy import Select
+
+from app.core.config import settings
+from app.db.bulk import chunked
+from app.db.session import ReadSessionLocal, new_async_session
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+_END = object()
+
+
+def _plain(value):
+    if isinstance(value, enum.Enum):
+        return value.value
+    return value
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialise {type(value).__name__}")
+
+
+def _iter_partitions(stmt: Select, extra: Optional[Iterable[tuple]] = None, key=None) -> Iterator[List[tuple]]:
+    """Run ``stmt`` on a server-side cursor and yield it ``EXPORT_BATCH_SIZE`` rows at a time.
+
+    ``extra`` rows, sorted by ``key`` as ``stmt`` is, are merged into the stream.
+    The generator owns its session because it outlives the request handler.
+    """
+    session = ReadSessionLocal()
+    try:
+        result = session.execute(stmt.execution_options(yield_per=settings.EXPORT_BATCH_SIZE))
+        if extra is None:
+            partitions = result.partitions()
+        else:
+            partitions = chunked(heapq.merge(result, extra, key=key), settings.EXPORT_BATCH_SIZE)
+        for partition in partitions:
+            yield [tuple(_plain(v) for v in row) for row in partition]
+    finally:
+        session.close()
+
+
+async def _aiter_partitions(
+    stmt: Select, extra: Optional[Iterable[tuple]] = None, key=None,
+) -> AsyncIterator[List[tuple]]:
+    """``_iter_partitions`` on the async engine: ``AsyncSession.stream`` fetches each batch
+    without holding a thread while it waits on the database."""
+    async with new_async_session() as session:
+        result = await session.stream(stmt.execution_options(yield_per=settings.EXPORT_BATCH_SIZE))
+        if extra is None:
+            async for partition in result.partitions():
+                yield [tuple(_plain(v) for v in row) for row in partition]
+            return
+        partition = []
+        async for row in _merge_sorted(result, extra, key):
+            partition.append(tuple(_plain(v) for v in row))
+            if len(partition) == settings.EXPORT_BATCH_SIZE:
+                yield partition
+                partition = []
+        if partition:
+            yield partition
+
+
+async def _merge_sorted(rows: AsyncIterator[tuple], extra: Iterable[tuple], key) -> AsyncIterator[tuple]:
+    """``heapq.merge(rows, extra, key=key)`` for an async ``rows``; ties go to ``rows`` first."""
+    extra = iter(extra)
+    pending = next(extra, _END)
+    async for row in rows:
+        while pending is not _END and key(pending) < key(row):
+            yield pending
+            pending = next(extra, _END)
+        yield row
+    while pending is not _END:
+        yield pending
+        pending = next(extra, _END)
+
+
+class _Ndjson:
+    def __init__(self, columns: Sequence[str]):
+        self.columns = columns
+
+    def start(self) -> bytes:
+        return b""
+
+    def write(self, rows: List[tuple]) -> bytes:
+        return "".join(json.dumps(dict(zip(self.columns, row)), default=_json_default) + "\n" for row in rows).encode()
+
+    def finish(self) -> bytes:
+        return b""
+
+
+class _Csv:
+    def __init__(self, columns: Sequence[str]):
+        self.columns = columns
+        self._buf = io.StringIO()
+        self._writer = csv.writer(self._buf)
+
+    def start(self) -> bytes:
+        self._writer.writerow(self.columns)
+        return self._drain()
+
+    def write(self, rows: List[tuple]) -> bytes:
+        self._writer.writerows((v.isoformat() if isinstance(v, (datetime, date)) else v for v in row) for row in rows)
+        return self._drain()
+
+    def finish(self) -> bytes:
+        return b""
+
+    def _drain(self) -> bytes:
+        data = self._buf.getvalue().encode()
+        self._buf.seek(0)
+        self._buf.truncate()
+        return data
+
+
+class _Sink(io.RawIOBase):
+    """Write-only file that hands everything written so far to the caller on ``drain()``."""
+
+    def __init__(self):
+        self._chunks, self._pos = [], 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        self._pos += len(b)
+        return len(b)
+
+    def tell(self):
+        return self._pos
+
+    def drain(self) -> bytes:
+        data, self._chunks = b"".join(self._chunks), []
+        return data
+
+
+class _Parquet:
+    def __init__(self, columns: Sequence[str]):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.columns, self._pa, self._pq = columns, pa, pq
+        self._sink, self._writer = _Sink(), None
+
+    def start(self) -> bytes:
+        return b""
+
+    def write(self, rows: List[tuple]) -> bytes:
+        table = self._pa.Table.from_pydict({c: list(values) for c, values in zip(self.columns, zip(*rows))})
+        if self._writer is None:
+            self._writer = self._pq.ParquetWriter(self._sink, table.schema, compression="zstd")
+        self._writer.write_table(table)            # one row group per partition
+        return self._sink.drain()
+
+    def finish(self) -> bytes:
+        if self._writer is None:
+            self._writer = self._pq.ParquetWriter(self._sink, self._pa.schema([(c, self._pa.null()) for c in self.columns]))
+        self._writer.close()
+        return self._sink.drain()
+
+
+def _encode(encoder, partitions: Iterable[List[tuple]]) -> Iterator[bytes]:
+    yield encoder.start()
+    for rows in partitions:
+        yield encoder.write(rows)
+    yield encoder.finish()
+
+
+async def _aencode(encoder, partitions: AsyncIterator[List[tuple]]) -> AsyncIterator[bytes]:
+    yield encoder.start()
+    async for rows in partitions:
+        yield encoder.write(rows)
+    yield encoder.finish()
+
+
+ENCODERS = {"ndjson": _Ndjson, "csv": _Csv, "parquet": _Parquet}
+
+
+def export_response(
+    stmt: Select,
+    columns: Sequence[str],
+    fmt: str,
+    filename: str,
+    extra: Optional[Iterable[tuple]] = None,
+    key: Optional[Callable[[tuple], tuple]] = None,
+) -> StreamingResponse:
+    """Stream the result of ``stmt`` as NDJSON, CSV or Parquet without materialising it.
+
+    ``extra`` adds rows from outside the database (the cold archive), already
+    ordered by ``key`` like ``stmt``'s rows. With ``ASYNC_DB_ENABLED`` the rows
+    are streamed from the async engine, so a slow download holds no thread.
+    """
+    if fmt not in ENCODERS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(ENCODERS)}")
+    if fmt == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise HTTPException(status_code=501, detail="Parquet export requires the 'pyarrow' package")
+
+    encoder = ENCODERS[fmt](columns)
+    if settings.ASYNC_DB_ENABLED:
+        body = _aencode(encoder, _aiter_partitions(stmt, extra, key))
+    else:
+        body = _encode(encoder, _iter_partitions(stmt, extra, key))
+    return StreamingResponse(
+        body,
+        media_type=MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{fmt}"'},
+    )
@@ -0,0 +1,48 @@
+from typing import Optional
+
+from fastapi import APIRouter, Depends
+from fastapi.responses import JSONResponse, PlainTextResponse
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.core import metrics
+from app.db.lease import ETL_JOB, last_finished
+from app.db.session import DbSession, get_read_db, run_db
+
+router = APIRouter(tags=["health"])
+
+_ready = False      # once ready, stays ready for the life of the process
+
+
+@router.get("/healthz")
+async def healthz():
+    """Liveness: the process is up and serving; touches nothing else."""
+    return {"status": "ok"}
+
+
+@router.get("/readyz")
+async def readyz(db: DbSession = Depends(get_read_db)):
+    """Readiness: the database answers and the ETL has completed at least once."""
+    global _ready
+    if _ready:
+        return {"status": "ready"}
+
+    def check(db: Session) -> Optional[str]:
+        db.execute(text("SELECT 1"))
+        finished = last_finished(db, ETL_JOB)
+        return finished and finished.isoformat()
+
+    try:
+        finished = await run_db(db, check)
+    except Exception as e:
+        return JSONResponse({"status": "unavailable", "detail": str(e)}, status_code=503)
+    if not finished:
+        return JSONResponse({"status": "loading"}, status_code=503)
+    _ready = True
+    return {"status": "ready", "etl_finished_at": finished}
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Prometheus text exposition of the request, SQL and job metrics (empty unless METRICS_ENABLED)."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,85 @@
+import base64
+import heapq
+import json
+from datetime import datetime
+from itertools import islice
+from typing import Any, Callable, Iterable, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Query
+
+
+def encode_cursor(values: Sequence[Any], direction: str) -> str:
+    """Opaque, URL-safe cursor for the row whose sort key is ``values``."""
+    raw = json.dumps({"k": list(values), "d": direction}, default=lambda v: v.isoformat())
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, columns: Sequence) -> Tuple[List[Any], str]:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        values, direction = payload["k"], payload["d"]
+        if direction not in ("next", "prev") or len(values) != len(columns):
+            raise ValueError(direction)
+        return [
+            datetime.fromisoformat(v) if col.type.python_type is datetime else col.type.python_type(v)
+            for col, v in zip(columns, values)
+        ], direction
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _seek(columns: Sequence, values: Sequence, less: bool):
+    """``(c1, c2, …) < (v1, v2, …)`` (or ``>``) expanded so every dialect can use the index."""
+    clauses = []
+    for i, (col, val) in enumerate(zip(columns, values)):
+        prefix = [c == v for c, v in zip(columns[:i], values[:i])]
+        clauses.append(and_(*prefix, col < val if less else col > val))
+    return or_(*clauses)
+
+
+def paginate(
+    query: Query,
+    columns: Sequence,
+    key_of: Callable[[Any], Sequence[Any]],
+    size: int,
+    cursor: Optional[str] = None,
+    offset: int = 0,
+    descending: bool = False,
+    extra: Optional[Callable[[Optional[Sequence], bool], Iterable]] = None,
+) -> Tuple[list, Optional[str], Optional[str]]:
+    """Return ``(items, next_cursor, prev_cursor)`` for one page ordered by ``columns``.
+
+    With a cursor the page is found by seeking on the (indexed) sort key, so its
+    cost does not depend on how deep the page is; without one ``offset`` is used,
+    which keeps page/size clients working. ``extra`` merges in rows from outside
+    the query (the cold archive): it is called with the cursor key (or ``None``)
+    and whether the page runs in descending key order, and returns the rows past
+    that key in that order, lazily; only the ones the page needs are consumed.
+    """
+    values, direction = decode_cursor(cursor, columns) if cursor else (None, "next")
+    forward = direction == "next"
+    less = descending == forward
+
+    if values is not None:
+        query = query.filter(_seek(columns, values, less))
+        offset = 0
+    query = query.order_by(*(c.desc() if less else c.asc() for c in columns))
+
+    if extra is not None:
+        hot = query.limit(offset + size + 1).all()
+        cold = extra(None if values is None else tuple(values), less)
+        rows = list(islice(heapq.merge(hot, cold, key=key_of, reverse=less), offset, offset + size + 1))
+    else:
+        rows = query.offset(offset).limit(size + 1).all()
+    more = len(rows) > size
+    rows = rows[:size]
+    if not forward:
+        rows.reverse()
+
+    has_next = more if forward else values is not None
+    has_prev = (values is not None or offset > 0) if forward else more
+    next_cursor = encode_cursor(key_of(rows[-1]), "next") if rows and has_next else None
+    prev_cursor = encode_cursor(key_of(rows[0]), "prev") if rows and has_prev else None
+    return rows, next_cursor, prev_cursor
@@ -0,0 +1,26 @@
+from typing import List, Optional
+
+from fastapi import HTTPException
+
+
+def parse_id_list(values: Optional[List[str]], name: str = "patient_ids") -> Optional[List[int]]:
+    """Accept ``?ids=1,2,3`` as well as repeated ``?ids=1&ids=2``; None when absent."""
+    if not values:
+        return None
+    try:
+        return [int(v) for value in values for v in value.split(",") if v.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name} must be a comma-separated list of integers")
+
+
+def parse_quantiles(values: Optional[List[str]], default: List[float]) -> List[float]:
+    """``?q=0.5,0.95`` or repeated ``?q=``; each must lie in [0, 1]."""
+    if not values:
+        return default
+    try:
+        qs = [float(v) for value in values for v in value.split(",") if v.strip()]
+    except ValueError:
+        qs = None
+    if not qs or not all(0 <= q <= 1 for q in qs):
+        raise HTTPException(status_code=400, detail="q must be a comma-separated list of numbers in [0, 1]")
+    return qs
@@ -1,33 +1,69 @@
+from typing import Optional
+
 from fastapi import APIRouter, Depends, Query
 from sqlalchemy.orm import Session
-from app.db.session import SessionLocal
-from app.db.models import Patient
+from app.analytics.live import describe
+from app.api.pagination import paginate
+from app.api.serialization import FastJSONResponse, parse_fields, project
+from app.db.session import DbSession, get_read_db, run_db
+from app.db.models import BiometricLiveStats, Patient
 from app.schemas.pydantic_models import PatientOut
 
 router = APIRouter(tags=["patients"])
 
-def get_db():
-    db = SessionLocal()
-    try: yield db
-    finally: db.close()
+PATIENT_FIELDS = tuple(PatientOut.model_fields)
 
 @router.get("/patients")
-def list_patients(
+async def list_patients(
     page: int = Query(1, ge=1),
     size: int = Query(20, ge=1, le=100),
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = Query(None, description="next_cursor/prev_cursor from a previous page; overrides page"),
+    include_total: Optional[bool] = Query(None, description="Count patients (default: yes with page, no with cursor)"),
+    fields: Optional[str] = Query(None, description=f"Comma-separated subset of {', '.join(PATIENT_FIELDS)}"),
+    db: DbSession = Depends(get_read_db)
 ):
-    total = db.query(Patient).count()
-    items = (
-        db.query(Patient)
-        .offset((page - 1) * size)
-        .limit(size)
-        .all()
-    )
-
-    return {
-        "page": page,
+    selected = parse_fields(fields, PATIENT_FIELDS)
+    names = tuple(dict.fromkeys(selected + ("id",)))
+
+    if include_total is None:
+        include_total = cursor is None
+
+    def read(db: Session):
+        total = db.query(Patient).count() if include_total else None
+        page_rows = paginate(
+            db.query(*(getattr(Patient, n) for n in names)),
+            (Patient.id,),
+            lambda p: (p.id,),
+            size,
+            cursor=cursor,
+            offset=(page - 1) * size,
+        )
+        return total, page_rows
+
+    total, (items, next_cursor, prev_cursor) = await run_db(db, read)
+
+    return FastJSONResponse({
+        "page": None if cursor else page,
         "size": size,
         "total": total,
-        "items": items,
-    }
+        "next_cursor": next_cursor,
+        "prev_cursor": prev_cursor,
+        "items": project(items, names, selected),
+    })
+
+
+@router.get("/patients/{patient_id}/live-stats")
+async def get_live_stats(
+    patient_id: int,
+    db: DbSession = Depends(get_read_db)
+):
+    """Running mean/std, EWMA and the latest reading's z-score per biometric type, as of the last ingest."""
+    def read(db: Session):
+        rows = (
+            db.query(BiometricLiveStats)
+            .filter(BiometricLiveStats.patient_id == patient_id, BiometricLiveStats.count > 0)
+            .order_by(BiometricLiveStats.type)
+        )
+        return [describe(row) for row in rows]
+
+    return FastJSONResponse({"patient_id": patient_id, "stats": await run_db(db, read)})
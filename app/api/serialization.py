@@ -0,0 +1,75 @@
+import enum
+import json
+from datetime import date, datetime
+from typing import Any, Awaitable, Callable, Iterable, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse, Response
+
+from app.core.cache import get_cache
+from app.core.config import settings
+
+try:
+    import orjson
+except ImportError:  # optional: fall back to the stdlib encoder
+    orjson = None
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, enum.Enum):
+        return value.value
+    raise TypeError(f"Cannot serialise {type(value).__name__}")
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, default=_default, separators=(",", ":")).encode()
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON response rendered straight from dicts/tuples, skipping per-row Pydantic validation."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def parse_fields(fields: Optional[str], allowed: Sequence[str]) -> Tuple[str, ...]:
+    """``"id,value"`` → ``("id", "value")``; all ``allowed`` fields when not given."""
+    if not fields:
+        return tuple(allowed)
+    selected = tuple(dict.fromkeys(f.strip() for f in fields.split(",") if f.strip()))
+    unknown = [f for f in selected if f not in allowed]
+    if unknown or not selected:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown field(s) {', '.join(unknown)}; choose from {', '.join(allowed)}",
+        )
+    return selected
+
+
+def project(rows: Sequence[Sequence], names: Sequence[str], fields: Sequence[str]) -> List[dict]:
+    """Turn column tuples (selected as ``names``) into dicts holding only ``fields``."""
+    index = [(f, names.index(f)) for f in fields]
+    return [{f: row[i] for f, i in index} for row in rows]
+
+
+async def cached_json(
+    namespace: str, patient_ids: Iterable[int], params: Sequence, build: Callable[[], Awaitable[Any]]
+) -> Response:
+    """Serve ``await build()`` as JSON through the read-through cache when it is enabled.
+
+    The cached value is the rendered body, so a hit costs neither a query nor
+    serialisation.
+    """
+    if not settings.CACHE_ENABLED:
+        return FastJSONResponse(await build())
+    cache = get_cache()
+    key = cache.key(namespace, patient_ids, *params)
+    body = cache.get(key)
+    if body is None:
+        body = dumps(await build())
+        cache.set(key, body)
+    return Response(body, media_type="application/json")
@@ -0,0 +1,208 @@
+from abc import ABC, abstractmethod
+import importlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+
+
+class CacheBackend(ABC):
+    """Shared second-level cache (e.g. Redis/memcached) interface.
+
+    Values are bytes; ``incr`` must be atomic across processes because it
+    drives invalidation.
+    """
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[bytes]:
+        """The value stored under ``key``, or ``None`` if missing or expired."""
+
+    @abstractmethod
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        """Store ``value`` under ``key``, expiring after ``ttl`` seconds if given."""
+
+    @abstractmethod
+    def incr(self, key: str) -> int:
+        """Atomically increment the counter ``key`` (missing counts as 0) and return the new value."""
+
+
+class LocalBackend(CacheBackend):
+    """In-process stand-in for a shared backend, for development and tests."""
+
+    def __init__(self):
+        self._data: Dict[str, Tuple[Optional[float], object]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl if ttl else None, value)
+
+    def incr(self, key):
+        with self._lock:
+            value = int(self._data.get(key, (None, 0))[1]) + 1
+            self._data[key] = (None, value)
+            return value
+
+
+class ReadThroughCache:
+    """LRU + TTL cache in front of an optional shared backend.
+
+    Entries are invalidated per (namespace, patient) by bumping a generation
+    counter that is part of every key, so a job only has to touch the patients
+    it changed and stale entries simply age out.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float, backend: Optional[CacheBackend] = None):
+        self.max_entries, self.max_bytes, self.ttl = max_entries, max_bytes, ttl
+        self.backend = backend
+        self._entries: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self._generations: Dict[str, int] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "backend_hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    # ---------- keys ----------------------------------------------------------
+    def _generation(self, namespace: str, patient_id: int) -> int:
+        gen_key = f"gen:{namespace}:{patient_id}"
+        if self.backend is not None:
+            return int(self.backend.get(gen_key) or 0)
+        return self._generations.get(gen_key, 0)
+
+    def key(self, namespace: str, patient_ids: Iterable[int], *params) -> str:
+        """Cache key for a read covering ``patient_ids`` with the given request parameters."""
+        gens = ",".join(f"{pid}.{self._generation(namespace, pid)}" for pid in sorted(set(patient_ids)))
+        return f"{namespace}|{gens}|{params!r}"
+
+    def invalidate(self, namespace: str, patient_ids: Iterable[int]) -> None:
+        """Make every cached read touching one of ``patient_ids`` in ``namespace`` unreachable."""
+        for pid in set(patient_ids):
+            gen_key = f"gen:{namespace}:{pid}"
+            if self.backend is not None:
+                self.backend.incr(gen_key)
+            else:
+                with self._lock:
+                    self._generations[gen_key] = self._generations.get(gen_key, 0) + 1
+            with self._lock:
+                self._stats["invalidations"] += 1
+
+    # ---------- values --------------------------------------------------------
+    def get(self, key: str) -> Optional[bytes]:
+        now = time.monotonic()
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None:
+                expires_at, value = item
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return value
+                self._drop(key)
+        value = self.backend.get(key) if self.backend is not None else None
+        with self._lock:
+            if value is None:
+                self._stats["misses"] += 1
+                return None
+            self._stats["backend_hits"] += 1
+        self._store(key, value)
+        return value
+
+    def set(self, key: str, value: bytes) -> None:
+        self._store(key, value)
+        if self.backend is not None:
+            self.backend.set(key, value, self.ttl)
+
+    def _store(self, key: str, value: bytes) -> None:
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._bytes += len(value)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self._stats["evictions"] += 1
+
+    def _drop(self, key: str) -> None:
+        _, value = self._entries.pop(key)
+        self._bytes -= len(value)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update(entries=len(self._entries), bytes=self._bytes)
+        lookups = stats["hits"] + stats["backend_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["hits"] + stats["backend_hits"]) / lookups if lookups else 0.0
+        return stats
+
+
+def _load_backend(spec: str) -> Optional[CacheBackend]:
+    """``""`` → none, ``"local"`` → LocalBackend, ``"pkg.module:Class"`` → that class."""
+    if not spec:
+        return None
+    if spec == "local":
+        return LocalBackend()
+    module, _, name = spec.partition(":")
+    return getattr(importlib.import_module(module), name)()
+
+
+_cache: Optional[ReadThroughCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> ReadThroughCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ReadThroughCache(
+                max_entries=settings.CACHE_MAX_ENTRIES,
+                max_bytes=settings.CACHE_MAX_BYTES,
+                ttl=settings.CACHE_TTL_SECONDS,
+                backend=_load_backend(settings.CACHE_BACKEND),
+            )
+        return _cache
+
+
+def invalidate(namespace: str, patient_ids: Iterable[int]) -> None:
+    """Invalidate cached reads for ``patient_ids``; a no-op when caching is disabled."""
+    if settings.CACHE_ENABLED:
+        get_cache().invalidate(namespace, patient_ids)
+
+
+def invalidate_on_commit(session: Session, namespace: str, patient_ids: Iterable[int]) -> None:
+    """Invalidate once ``session`` commits, so no reader can re-cache pre-commit data."""
+    if settings.CACHE_ENABLED:
+        session.info.setdefault("cache_invalidations", {}).setdefault(namespace, set()).update(patient_ids)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session: Session) -> None:
+    for namespace, patient_ids in session.info.pop("cache_invalidations", {}).items():
+        invalidate(namespace, patient_ids)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_invalidations(session: Session) -> None:
+    session.info.pop("cache_invalidations", None)
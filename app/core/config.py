@@ -1,16 +1,68 @@
+from typing import Dict
+
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
-    DATABASE_URL: str
+    DATABASE_URL: str = "sqlite:///./test.db"
+    ASYNC_DB_ENABLED: bool = False
+    ASYNC_DATABASE_URL: str = "" #derived from DATABASE_URL (asyncpg/aiosqlite) when empty
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_TIMEOUT: float = 30
+    DB_POOL_PRE_PING: bool = False
+    SQLITE_PROFILE: bool = True #file SQLite: WAL + pragmas below, one writer connection, read-only pool
+    SQLITE_SYNCHRONOUS: str = "NORMAL" #WAL stays consistent; a power loss can drop the last commits
+    SQLITE_CACHE_SIZE_KB: int = 65536 #page cache per connection
+    SQLITE_MMAP_SIZE: int = 268435456
+    SQLITE_TEMP_STORE: str = "MEMORY"
+    SQLITE_BUSY_TIMEOUT_MS: int = 5000 #wait for another process's write lock
+    SQLITE_READ_POOL_SIZE: int = 8
     ENVIRONMENT: str = "development"
-    ANALYTICS_CRON_SCHEDULE: str = "0 * * * *"
+    ANALYTICS_CRON_SCHEDULE: str = "0 * * * *" #crontab, UTC
+    SCHEDULER_ENABLED: bool = True
+    SCHEDULER_LEASE_SECONDS: int = 900 #renewed after each chunk a run commits; must outlast one chunk
+    SCHEDULER_MAX_CATCHUP: int = 24 #missed slots covered after downtime by one run of the newest
     ANALYTICS_VERSION: str = "1" #or "2"
+    STARTUP_CREATE_TABLES: bool = True
+    STARTUP_ETL: str = "background" #"background", "sync" or "off" (run `python -m app.analytics.compute` instead)
+    ETL_CHUNK_SIZE: int = 5000
+    ETL_LEASE_SECONDS: int = 3600 #must outlast one ETL run
+    ETL_REJECTS_FILE: str = "" #CSV report of rejected rows, written when set
+    READING_ALIASES: Dict[str, str] = {} #CSV column -> biometric type, e.g. {"sugar": "glucose"}
+    INGEST_DIR: str = "data/incoming"
+    INGEST_PATTERN: str = "**/*.csv"
+    INGEST_WORKERS: int = 0 #0 = one per CPU core
+    INGEST_MAX_IN_FLIGHT: int = 0 #files hashed/parsed ahead of the writer; 0 = twice the worker count
+    ANALYTICS_CHUNK_SIZE: int = 10000
+    ANALYTICS_ENGINE: str = "sql" #or "numpy" (std, percentiles, time-in-range, trends)
+    BIOMETRIC_BATCH_MAX_ITEMS: int = 10000
+    WRITE_BEHIND_ENABLED: bool = False
+    WRITE_BEHIND_MAX_BATCH: int = 500
+    WRITE_BEHIND_MAX_DELAY_MS: int = 20
+    WRITE_BEHIND_MAX_QUEUE: int = 100000
+    WRITE_BEHIND_DURABILITY: str = "flush" #or "enqueue"
+    EXPORT_BATCH_SIZE: int = 5000
+    ARCHIVE_DIR: str = "data/archive" #month partitions of archived biometrics
+    ARCHIVE_AFTER_DAYS: int = 0 #readings this old (whole months) move to ARCHIVE_DIR; 0 = keep everything hot
+    ARCHIVE_LEASE_SECONDS: int = 3600 #must outlast one archival run
+    LIVE_STATS_EWMA_ALPHA: float = 0.1
+    LIVE_STATS_OUTLIER_Z: float = 3.0
+    LIVE_STATS_MIN_COUNT: int = 10 #readings before z-scores are reported
+    METRICS_ENABLED: bool = False #request/SQL/job instrumentation, served at /metrics
+    METRICS_SLOW_QUERY_MS: float = 200 #slower statements are logged with their plan
+    METRICS_N_PLUS_ONE_THRESHOLD: int = 20 #same statement this often in one request
+    CACHE_ENABLED: bool = False
+    CACHE_TTL_SECONDS: float = 300
+    CACHE_MAX_ENTRIES: int = 10000
+    CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    CACHE_BACKEND: str = "" #"", "local" or "package.module:BackendClass"
 
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
 
-settings = Settings(DATABASE_URL = "sqlite:///./test.db")
+settings = Settings()
 
 DATABASE_URL = settings.DATABASE_URL
 ENVIRONMENT = settings.ENVIRONMENT
@@ -0,0 +1,275 @@
+"""Performance instrumentation, exported in Prometheus text format at ``/metrics``.
+
+* ``MetricsMiddleware``: per-route request latency histograms.
+* ``install_sql_hooks``: cursor-execute hooks counting and timing every query,
+  per request too. A statement repeated ``METRICS_N_PLUS_ONE_THRESHOLD`` times
+  in one request is reported as a likely N+1. Statements slower than
+  ``METRICS_SLOW_QUERY_MS`` are logged with their query plan.
+* ``span(job, phase)``: timing of ETL and analytics job phases.
+
+Nothing is installed or recorded unless ``METRICS_ENABLED``; the middleware
+then costs one flag check per request and ``span`` one per phase.
+"""
+import bisect
+import contextvars
+import logging
+import threading
+import time
+from collections import Counter as Tally
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+JOB_BUCKETS = (0.01, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+Labels = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Sequence[str], values: Labels, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}_total{_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label set, as Prometheus expects."""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name, self.help, self.labelnames, self.buckets = name, help, tuple(labelnames), tuple(buckets)
+        self._series: Dict[Labels, List] = {}      # labels → [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[i] += 1
+            series[-1] += value
+
+    def count(self, *labels: str) -> int:
+        series = self._series.get(labels)
+        return sum(series[:-1]) if series else 0
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets + ("+Inf",), series[:-1]):
+                    cumulative += n
+                    le = 'le="%s"' % (bound if bound == "+Inf" else _number(bound))
+                    lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(series[-1])}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+    def clear(self) -> None:
+        with self._lock:
+            self._series.clear()
+
+
+HTTP_LATENCY = Histogram(
+    "http_request_duration_seconds", "Request latency by route template.", ("method", "route", "status"))
+DB_QUERY_LATENCY = Histogram("db_query_duration_seconds", "SQL statement latency.", ("operation",))
+DB_QUERIES_PER_REQUEST = Histogram(
+    "db_queries_per_request", "SQL statements executed per request.", ("route",), COUNT_BUCKETS)
+DB_SLOW_QUERIES = Counter("db_slow_queries", "Statements slower than METRICS_SLOW_QUERY_MS.", ("operation",))
+DB_N_PLUS_ONE = Counter("db_n_plus_one", "Requests that repeated one statement METRICS_N_PLUS_ONE_THRESHOLD+ times.", ("route",))
+JOB_PHASE_LATENCY = Histogram("job_phase_duration_seconds", "ETL and analytics job phase durations.", ("job", "phase"), JOB_BUCKETS)
+
+REGISTRY = (HTTP_LATENCY, DB_QUERY_LATENCY, DB_QUERIES_PER_REQUEST, DB_SLOW_QUERIES, DB_N_PLUS_ONE, JOB_PHASE_LATENCY)
+
+
+def render() -> str:
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+
+def clear() -> None:
+    for metric in REGISTRY:
+        metric.clear()
+
+
+# ── spans ─────────────────────────────────────────────────────────────────────
+
+@contextmanager
+def span(job: str, phase: str) -> Iterator[None]:
+    """Time one phase of a job into ``job_phase_duration_seconds``."""
+    if not settings.METRICS_ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        JOB_PHASE_LATENCY.observe(time.perf_counter() - start, job, phase)
+
+
+# ── SQL hooks ─────────────────────────────────────────────────────────────────
+
+class RequestStats:
+    __slots__ = ("queries", "seconds", "statements")
+
+    def __init__(self):
+        self.queries, self.seconds, self.statements = 0, 0.0, Tally()
+
+
+_request: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar("request_sql_stats", default=None)
+
+
+def _operation(statement: str) -> str:
+    return statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+
+
+def _explain(cursor, statement: str, parameters, dialect: str) -> Optional[str]:
+    """Plan of a slow SELECT, from a second cursor on the same DBAPI connection.
+
+    On SQLite ``EXPLAIN QUERY PLAN`` only compiles the statement. Elsewhere the
+    EXPLAIN runs inside a savepoint, so if it fails the caller's transaction is
+    rolled back to it rather than left aborted.
+    """
+    if _operation(statement) not in ("SELECT", "WITH"):
+        return None
+    prefix = "EXPLAIN QUERY PLAN " if dialect == "sqlite" else "EXPLAIN "
+    savepoint = dialect != "sqlite"
+    try:
+        plan_cursor = cursor.connection.cursor()
+    except Exception as e:
+        return f"(EXPLAIN failed: {e!r})"
+    try:
+        if savepoint:
+            plan_cursor.execute("SAVEPOINT metrics_explain")
+        try:
+            plan_cursor.execute(prefix + statement, parameters)
+            plan = "\n".join(" ".join(str(c) for c in row) for row in plan_cursor.fetchall())
+        except Exception as e:  # the plan is a diagnostic; never fail the query over it
+            if savepoint:
+                plan_cursor.execute("ROLLBACK TO SAVEPOINT metrics_explain")
+            plan = f"(EXPLAIN failed: {e!r})"
+        if savepoint:
+            plan_cursor.execute("RELEASE SAVEPOINT metrics_explain")
+        return plan
+    except Exception as e:      # e.g. no transaction to hold a savepoint in
+        return f"(EXPLAIN failed: {e!r})"
+    finally:
+        plan_cursor.close()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._metrics_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, "_metrics_start", None)
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+    operation = _operation(statement)
+    DB_QUERY_LATENCY.observe(elapsed, operation)
+    stats = _request.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.seconds += elapsed
+        stats.statements[statement] += 1
+    if elapsed * 1000 >= settings.METRICS_SLOW_QUERY_MS:
+        DB_SLOW_QUERIES.inc(operation)
+        plan = None if executemany else _explain(cursor, statement, parameters, conn.dialect.name)
+        logger.warning("Slow query (%.1f ms): %s\nPlan:\n%s", elapsed * 1000, statement, plan)
+
+
+def install_sql_hooks(engine: Engine) -> None:
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def remove_sql_hooks(engine: Engine) -> None:
+    if event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.remove(engine, "before_cursor_execute", _before_cursor_execute)
+        event.remove(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+# ── middleware ────────────────────────────────────────────────────────────────
+
+class MetricsMiddleware:
+    """ASGI middleware timing each request by route template and accounting its SQL."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        status = ["500"]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = str(message["status"])
+            await send(message)
+
+        stats = RequestStats()
+        token = _request.set(stats)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            _request.reset(token)
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            HTTP_LATENCY.observe(elapsed, scope["method"], route, status[0])
+            DB_QUERIES_PER_REQUEST.observe(stats.queries, route)
+            self._check_n_plus_one(route, stats)
+
+    @staticmethod
+    def _check_n_plus_one(route: str, stats: RequestStats) -> None:
+        if not stats.statements:
+            return
+        statement, repeats = stats.statements.most_common(1)[0]
+        if repeats >= settings.METRICS_N_PLUS_ONE_THRESHOLD:
+            DB_N_PLUS_ONE.inc(route)
+            logger.warning("Possible N+1 in %s: statement ran %d times: %s", route, repeats, statement)
@@ -0,0 +1,526 @@
+"""Cold storage for old biometrics: compressed, columnar, month-partitioned files.
+
+Readings older than ``ARCHIVE_AFTER_DAYS`` (whole months only) are moved out
+of the ``biometrics`` table into ``ARCHIVE_DIR/YYYY-MM.bin``. Their rollups,
+cohorts and live stats stay in the database untouched, so series, quantile and
+analytics reads never look at the files; raw reads (history, export, hour
+recomputes, the numpy engine) merge them back in through ``read_rows``.
+
+A partition file is::
+
+    MAGIC | n_types u32 | n_patients u32 | types (u8 length + name)…
+          | index: (patient_id, offset, length, count, min_ts, max_ts) per patient, sorted
+          | type counts: one u32 per type per patient, in index order
+          | one zlib block per patient
+
+and a block holds the patient's readings in (timestamp, id) order as
+little-endian columns: id i64, timestamp µs i64, type u8, value f64,
+zscore f64 (NaN = null), outlier i8 (-1 = null). Reads map the file and
+decompress only the blocks of the requested patients whose time range
+overlaps the query; the index of each file is parsed once per version. The
+type counts let a history total come from the index alone. Files written
+before they existed (``PPARCH01``) are still read; their counts come from
+decoding the patient's block.
+
+Archived readings are read-only: an upsert for an archived key stores a hot
+row that shadows the archived one until the next archival run folds it in,
+and ``DELETE /biometrics/{id}`` only sees hot rows.
+
+    python -m app.db.archive                       # archive per ARCHIVE_AFTER_DAYS
+    python -m app.db.archive --before 2024-01-01   # or everything before a date
+"""
+import argparse
+import bisect
+import heapq
+import math
+import mmap
+import os
+import struct
+import sys
+import threading
+import zlib
+from array import array
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+from sqlalchemy import delete, func, select, tuple_
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.metrics import span
+from app.db.bulk import chunked
+from app.db.lease import acquire_lease, process_owner, release_lease
+from app.db.models import Biometric, BiometricType
+from app.db.session import ReadSessionLocal, SessionLocal
+
+ARCHIVE_JOB = "archive"
+MAGIC = b"PPARCH02"
+MAGIC_V1 = b"PPARCH01"                # same layout without the type counts
+SUFFIX = ".bin"
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+COUNTS = struct.Struct("<II")
+ENTRY = struct.Struct("<qQQQqq")     # patient_id, offset, length, count, min_ts, max_ts
+COLUMN_CODES = ("q", "q", "B", "d", "d", "b")
+BIG_ENDIAN = sys.byteorder == "big"
+
+Key = Tuple[int, str, datetime]      # (patient_id, type, timestamp)
+
+
+class Reading(NamedTuple):
+    id: int
+    patient_id: int
+    timestamp: datetime
+    type: BiometricType
+    value: float
+    zscore: Optional[float]
+    outlier: Optional[bool]
+
+
+def _micros(ts: datetime) -> int:
+    return (ts.replace(tzinfo=None) - EPOCH) // MICROSECOND
+
+
+def _month(ts: datetime) -> datetime:
+    return ts.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _next_month(month: datetime) -> datetime:
+    return _month(month + timedelta(days=32))
+
+
+def _type_name(btype) -> str:
+    return getattr(btype, "value", btype)
+
+
+# ── file format ───────────────────────────────────────────────────────────────
+
+def _encode_block(rows: Sequence[Reading], types: Dict[str, int]) -> bytes:
+    columns = [array(code) for code in COLUMN_CODES]
+    ids, stamps, codes, values, zscores, outliers = columns
+    for r in rows:
+        ids.append(r.id)
+        stamps.append(_micros(r.timestamp))
+        codes.append(types[_type_name(r.type)])
+        values.append(r.value)
+        zscores.append(math.nan if r.zscore is None else r.zscore)
+        outliers.append(-1 if r.outlier is None else int(r.outlier))
+    if BIG_ENDIAN:
+        for column in columns:
+            column.byteswap()
+    return zlib.compress(b"".join(column.tobytes() for column in columns), 6)
+
+
+def _decode_block(data: bytes, patient_id: int, count: int, types: Sequence[BiometricType]) -> List[Reading]:
+    columns, pos = [], 0
+    for code in COLUMN_CODES:
+        column = array(code)
+        end = pos + column.itemsize * count
+        column.frombytes(data[pos:end])
+        if BIG_ENDIAN:
+            column.byteswap()
+        columns.append(column)
+        pos = end
+    return [
+        Reading(
+            row_id, patient_id, EPOCH + ts * MICROSECOND, types[code], value,
+            None if zscore != zscore else zscore, None if outlier < 0 else bool(outlier),
+        )
+        for row_id, ts, code, value, zscore, outlier in zip(*columns)
+    ]
+
+
+def write_partition(path: Path, rows: Iterable[Reading]) -> int:
+    """Write ``rows`` as one partition file, atomically replacing ``path``; returns the row count."""
+    by_patient: Dict[int, List[Reading]] = {}
+    for r in rows:
+        by_patient.setdefault(r.patient_id, []).append(r)
+    patient_ids = sorted(by_patient)
+    return write_blocks(path, patient_ids, (by_patient[pid] for pid in patient_ids))
+
+
+def write_blocks(path: Path, patient_ids: Sequence[int], readings: Iterable[List[Reading]]) -> int:
+    """Write a partition from each patient's readings, given in ``patient_ids`` order.
+
+    Blocks are compressed and written as they arrive, so only one patient's
+    readings are held at a time; the index is reserved up front and filled in
+    at the end. Atomically replaces ``path``; returns the row count.
+    """
+    names = [t.value for t in BiometricType]
+    types = {name: code for code, name in enumerate(names)}
+    head = MAGIC + COUNTS.pack(len(names), len(patient_ids)) + b"".join(
+        bytes([len(name.encode())]) + name.encode() for name in names
+    )
+
+    entries, type_counts, total = [], array("I"), 0
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(head + bytes((ENTRY.size + type_counts.itemsize * len(names)) * len(patient_ids)))
+        offset = f.tell()
+        for pid, rows in zip(patient_ids, readings):
+            rows = sorted(rows, key=lambda r: (r.timestamp, r.id))
+            block = _encode_block(rows, types)
+            f.write(block)
+            entries.append(ENTRY.pack(
+                pid, offset, len(block), len(rows), _micros(rows[0].timestamp), _micros(rows[-1].timestamp),
+            ))
+            counts = [0] * len(names)
+            for r in rows:
+                counts[types[_type_name(r.type)]] += 1
+            type_counts.extend(counts)
+            offset += len(block)
+            total += len(rows)
+        if len(entries) != len(patient_ids):
+            raise ValueError(f"{len(patient_ids)} patients announced, {len(entries)} written")
+        if BIG_ENDIAN:
+            type_counts.byteswap()
+        f.seek(len(head))
+        f.writelines(entries)
+        f.write(type_counts.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return total
+
+
+class Partition:
+    """Parsed index of one month's file; blocks are read on demand through ``mmap``."""
+
+    def __init__(self, path: Path, month: datetime):
+        self.path, self.month = path, month
+        with open(path, "rb") as f:
+            head = f.read(len(MAGIC) + COUNTS.size)
+            if head[:len(MAGIC)] not in (MAGIC, MAGIC_V1):
+                raise ValueError(f"{path} is not a biometrics archive partition")
+            n_types, n_patients = COUNTS.unpack(head[len(MAGIC):])
+            self.types = []
+            for _ in range(n_types):
+                self.types.append(BiometricType(f.read(f.read(1)[0]).decode()))
+            self.entries = [ENTRY.unpack(e) for e in _chunks(f.read(ENTRY.size * n_patients), ENTRY.size)]
+            self.type_counts = None
+            if head[:len(MAGIC)] == MAGIC:
+                counts = array("I")
+                counts.frombytes(f.read(counts.itemsize * n_types * n_patients))
+                if BIG_ENDIAN:
+                    counts.byteswap()
+                self.type_counts = [counts[i:i + n_types] for i in range(0, len(counts), n_types)]
+        self.patient_ids = [e[0] for e in self.entries]
+
+    def count(self, patient_id: int, types: Optional[Set[BiometricType]] = None) -> int:
+        """How many readings ``patient_id`` has here, of ``types`` if given; from the index when it has type counts."""
+        i = bisect.bisect_left(self.patient_ids, patient_id)
+        if i == len(self.patient_ids) or self.patient_ids[i] != patient_id:
+            return 0
+        if self.type_counts is None:
+            return sum(1 for block in self.read([patient_id]) for r in block if types is None or r.type in types)
+        return sum(n for btype, n in zip(self.types, self.type_counts[i]) if types is None or btype in types)
+
+    def __contains__(self, patient_id: int) -> bool:
+        i = bisect.bisect_left(self.patient_ids, patient_id)
+        return i < len(self.patient_ids) and self.patient_ids[i] == patient_id
+
+    def read(
+        self, patient_ids: Optional[Iterable[int]] = None, start: Optional[datetime] = None, end: Optional[datetime] = None,
+    ) -> Iterator[List[Reading]]:
+        """Each selected patient's readings, by patient id, skipping blocks outside [start, end)."""
+        lo = -(2 ** 63) if start is None else _micros(start)
+        hi = 2 ** 63 - 1 if end is None else _micros(end)
+        if patient_ids is None:
+            entries = self.entries
+        else:
+            entries = [
+                self.entries[bisect.bisect_left(self.patient_ids, pid)] for pid in sorted(set(patient_ids)) if pid in self
+            ]
+        entries = [e for e in entries if e[4] < hi and e[5] >= lo]
+        if not entries:
+            return
+        with open(self.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for pid, offset, length, count, _, _ in entries:
+                yield _decode_block(zlib.decompress(data[offset:offset + length]), pid, count, self.types)
+
+
+def _chunks(data: bytes, size: int) -> Iterator[bytes]:
+    return (data[i:i + size] for i in range(0, len(data), size))
+
+
+# ── partition registry ────────────────────────────────────────────────────────
+
+_cache: Dict[Path, Tuple[Tuple[int, int, int], Partition]] = {}
+_cache_lock = threading.Lock()
+
+
+def archive_dir() -> Path:
+    return Path(settings.ARCHIVE_DIR)
+
+
+def partition_path(month: datetime) -> Path:
+    return archive_dir() / f"{month:%Y-%m}{SUFFIX}"
+
+
+def partitions(start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[Partition]:
+    """Partitions whose month overlaps [start, end), oldest first.
+
+    Listing the directory is the only cost when nothing changed: a file's index
+    is re-parsed only when its size, mtime or inode does.
+    """
+    root = archive_dir()
+    if not root.is_dir():
+        return []
+    found = []
+    for entry in os.scandir(root):
+        if not entry.name.endswith(SUFFIX):
+            continue
+        try:
+            month = datetime.strptime(entry.name[:-len(SUFFIX)], "%Y-%m")
+        except ValueError:
+            continue
+        if (start is not None and _next_month(month) <= start) or (end is not None and month >= end):
+            continue
+        stat = entry.stat()
+        version = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+        path = Path(entry.path)
+        with _cache_lock:
+            cached = _cache.get(path)
+        if cached is None or cached[0] != version:
+            cached = (version, Partition(path, month))
+            with _cache_lock:
+                _cache[path] = cached
+        found.append(cached[1])
+    return sorted(found, key=lambda p: p.month)
+
+
+def horizon() -> Optional[datetime]:
+    """End of the newest archived month; no archived reading is at or after it."""
+    months = partitions()
+    return _next_month(months[-1].month) if months else None
+
+
+def read_rows(
+    patient_ids: Optional[Iterable[int]] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    types: Optional[Iterable] = None,
+) -> Iterator[Reading]:
+    """Archived readings in [start, end), ordered by (patient_id, timestamp, id).
+
+    Files are pruned by month and blocks by patient and time range. Each file is
+    mapped once and walked patient by patient; the files' streams are merged, so
+    only one patient block per month is decompressed at a time.
+    """
+    start = None if start is None else start.replace(tzinfo=None)
+    end = None if end is None else end.replace(tzinfo=None)
+    wanted = None if types is None else {BiometricType(_type_name(t)) for t in types}
+    months = partitions(start, end)
+    if not months:
+        return
+    ids = None if patient_ids is None else set(patient_ids)
+
+    def month_rows(partition: Partition) -> Iterator[Reading]:
+        for block in partition.read(ids, start, end):
+            for r in block:
+                if (start is None or r.timestamp >= start) and (end is None or r.timestamp < end) \
+                        and (wanted is None or r.type in wanted):
+                    yield r
+
+    yield from heapq.merge(*(month_rows(p) for p in months), key=lambda r: (r.patient_id, r.timestamp, r.id))
+
+
+def shadowed(session: Session, patient_ids: Optional[Iterable[int]] = None) -> Set[Key]:
+    """Keys of hot rows inside archived months; they take precedence over the archived reading.
+
+    Normally empty: such rows only exist between an upsert of an archived key
+    and the next archival run.
+    """
+    end = horizon()
+    if end is None:
+        return set()
+    query = session.query(Biometric.patient_id, Biometric.type, Biometric.timestamp).filter(Biometric.timestamp < end)
+    if patient_ids is not None:
+        query = query.filter(Biometric.patient_id.in_(list(patient_ids)))
+    return {(pid, _type_name(typ), ts) for pid, typ, ts in query}
+
+
+def visible_rows(session: Session, patient_ids=None, start=None, end=None, types=None) -> Iterator[Reading]:
+    """``read_rows`` without the readings shadowed by a hot row."""
+    hidden = shadowed(session, patient_ids)
+    for r in read_rows(patient_ids, start, end, types):
+        if (r.patient_id, r.type.value, r.timestamp) not in hidden:
+            yield r
+
+
+def count_rows(session: Session, patient_id: int, types: Optional[Iterable] = None) -> int:
+    """How many visible archived readings ``patient_id`` has, of ``types`` if given.
+
+    Summed from the partition indexes; only the months holding a hot row that
+    shadows an archived reading, normally none, have blocks decoded.
+    """
+    wanted = None if types is None else {BiometricType(_type_name(t)) for t in types}
+    months = [p for p in partitions() if patient_id in p]
+    if not months:
+        return 0
+    total = sum(p.count(patient_id, wanted) for p in months)
+    hidden = [
+        (pid, ts, typ) for pid, typ, ts in shadowed(session, [patient_id])
+        if wanted is None or BiometricType(typ) in wanted
+    ]
+    return total - len(archived_values(hidden)) if hidden else total
+
+
+def ordered_rows(
+    session: Session,
+    patient_id: int,
+    types: Optional[Iterable] = None,
+    after: Optional[Tuple[datetime, int]] = None,
+    descending: bool = True,
+) -> Iterator[Reading]:
+    """One patient's visible archived readings by (timestamp, id), newest first when ``descending``.
+
+    ``after`` is an exclusive (timestamp, id) key to continue from, e.g. a page
+    cursor. Months are walked outwards from it and decoded one at a time, so a
+    consumer that stops after one page only reads the months that page spans.
+    """
+    start = end = None
+    if after is not None:
+        ts = after[0].replace(tzinfo=None)
+        after = (ts, after[1])
+        if descending:
+            end = ts + timedelta(microseconds=1)
+        else:
+            start = ts
+    wanted = None if types is None else {BiometricType(_type_name(t)) for t in types}
+    months = [p for p in partitions(start, end) if patient_id in p]
+    hidden = shadowed(session, [patient_id]) if months else set()
+    for partition in (reversed(months) if descending else months):
+        rows = [
+            r for block in partition.read([patient_id], start, end) for r in block
+            if (wanted is None or r.type in wanted) and (r.patient_id, r.type.value, r.timestamp) not in hidden
+            and (after is None or ((r.timestamp, r.id) < after if descending else (r.timestamp, r.id) > after))
+        ]
+        rows.sort(key=lambda r: (r.timestamp, r.id), reverse=descending)
+        yield from rows
+
+
+def archived_values(keys: Iterable[Tuple[int, datetime, str]]) -> Dict[Tuple[int, datetime, str], float]:
+    """Archived value of each ``(patient_id, timestamp, type)`` key that has one.
+
+    Lets upserts treat an archived reading as the previous value; costs a
+    directory listing when none of the keys falls in an archived month.
+    """
+    keys = {(pid, ts.replace(tzinfo=None), _type_name(typ)) for pid, ts, typ in keys}
+    found = {}
+    months = {p.month: p for p in partitions()}
+    by_partition: Dict[datetime, Set[int]] = {}
+    for pid, ts, _ in keys:
+        if _month(ts) in months:
+            by_partition.setdefault(_month(ts), set()).add(pid)
+    for month, pids in by_partition.items():
+        for block in months[month].read(pids):
+            for r in block:
+                key = (r.patient_id, r.timestamp, r.type.value)
+                if key in keys:
+                    found[key] = r.value
+    return found
+
+
+# ── archival ──────────────────────────────────────────────────────────────────
+
+def archive_month(session: Session, month: datetime) -> int:
+    """Move the hot readings of ``month`` into its partition; returns how many moved.
+
+    The partition is rewritten, a chunk of patients at a time, with its existing
+    rows plus the hot ones read from one snapshot (a hot row replaces an archived
+    reading with the same key), and swapped in before any hot row is deleted, so
+    a crash in between leaves duplicates that the next run folds in again, never
+    a gap. A hot row is then deleted only if its id and value are still the ones
+    archived: one updated meanwhile stays hot and shadows its archived copy until
+    the next run. Rollups are left as they are.
+    """
+    end = _next_month(month)
+    columns = [getattr(Biometric, c) for c in Reading._fields]
+    path = partition_path(month)
+    with ReadSessionLocal() as snapshot:
+        in_month = (Biometric.timestamp >= month, Biometric.timestamp < end)
+        hot_ids = [pid for (pid,) in snapshot.query(Biometric.patient_id).filter(*in_month).distinct()]
+        if not hot_ids:
+            return 0
+        previous = Partition(path, month) if path.exists() else None
+        patient_ids = sorted(set(hot_ids) | set(previous.patient_ids if previous else ()))
+
+        def merged_blocks() -> Iterator[List[Reading]]:
+            for chunk in chunked(patient_ids, 500):
+                merged: Dict[int, Dict[Key, Reading]] = {pid: {} for pid in chunk}
+                for block in previous.read(chunk) if previous else ():
+                    merged[block[0].patient_id].update(((r.patient_id, r.type.value, r.timestamp), r) for r in block)
+                for row in snapshot.execute(select(*columns).where(*in_month, Biometric.patient_id.in_(chunk))):
+                    r = Reading(*row)
+                    merged[r.patient_id][(r.patient_id, _type_name(r.type), r.timestamp)] = r
+                for pid in chunk:
+                    yield list(merged[pid].values())
+
+        with span(ARCHIVE_JOB, "write"):
+            write_blocks(path, patient_ids, merged_blocks())
+
+    archived = Partition(path, month)
+    moved = 0
+    with span(ARCHIVE_JOB, "delete"):
+        for chunk in chunked(sorted(hot_ids), 500):
+            pairs = [(r.id, r.value) for block in archived.read(chunk) for r in block]
+            for pair_chunk in chunked(pairs, 500):
+                moved += session.execute(
+                    delete(Biometric).where(*in_month, tuple_(Biometric.id, Biometric.value).in_(pair_chunk))
+                ).rowcount
+    session.commit()
+    return moved
+
+
+def archive_before(cutoff: datetime, owner: Optional[str] = None) -> Optional[Dict]:
+    """Archive every whole month before ``cutoff``'s month, oldest first.
+
+    Runs under the ``archive`` lease; returns None when another process holds
+    it, else ``{"months": [...], "archived": n}``.
+    """
+    cutoff = _month(cutoff)
+    owner = owner or process_owner()
+    session = SessionLocal()
+    try:
+        if not acquire_lease(session, ARCHIVE_JOB, owner, settings.ARCHIVE_LEASE_SECONDS):
+            print("Archival held by another process; skipping.")
+            return None
+        summary, finished = {"months": [], "archived": 0}, False
+        try:
+            # read outside the writer session, which would otherwise hold the write lock through the file writes
+            with ReadSessionLocal() as snapshot:
+                oldest = snapshot.query(func.min(Biometric.timestamp)).filter(Biometric.timestamp < cutoff).scalar()
+            month = _month(oldest) if oldest is not None else cutoff
+            while month < cutoff:
+                moved = archive_month(session, month)
+                if moved:
+                    summary["months"].append(f"{month:%Y-%m}")
+                    summary["archived"] += moved
+                acquire_lease(session, ARCHIVE_JOB, owner, settings.ARCHIVE_LEASE_SECONDS)     # renew
+                month = _next_month(month)
+            finished = True
+        finally:
+            release_lease(session, ARCHIVE_JOB, owner, finished=finished)
+        print(f"Archived {summary['archived']} readings from {len(summary['months'])} month(s).")
+        return summary
+    finally:
+        session.close()
+
+
+def archive_old(now: Optional[datetime] = None, owner: Optional[str] = None) -> Optional[Dict]:
+    """``archive_before`` the configured age; does nothing when ``ARCHIVE_AFTER_DAYS`` is 0."""
+    if settings.ARCHIVE_AFTER_DAYS <= 0:
+        return None
+    return archive_before((now or datetime.utcnow()) - timedelta(days=settings.ARCHIVE_AFTER_DAYS), owner)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move old biometrics into the cold archive")
+    parser.add_argument("--before", type=datetime.fromisoformat, help="archive whole months before this date")
+    args = parser.parse_args()
+    if args.before is None and settings.ARCHIVE_AFTER_DAYS <= 0:
+        parser.error("set ARCHIVE_AFTER_DAYS or pass --before")
+    archive_before(args.before) if args.before else archive_old()
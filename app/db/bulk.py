@@ -0,0 +1,109 @@
+from itertools import islice
+from types import SimpleNamespace
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence
+
+from sqlalchemy import Table, and_, insert, literal, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+
+def chunked(iterable: Iterable, size: int) -> Iterator[List]:
+    """Yield lists of at most ``size`` items without materialising the iterable."""
+    it = iter(iterable)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _dialect_insert(session: Session, table: Table):
+    """Return a dialect-native INSERT supporting ON CONFLICT, or None if unsupported."""
+    name = session.get_bind().dialect.name
+    if name == "postgresql":
+        return postgresql.insert(table)
+    if name == "sqlite":
+        return sqlite.insert(table)
+    return None
+
+
+def insert_ignore(
+    session: Session,
+    table: Table,
+    rows: Sequence[Dict],
+    index_elements: Sequence[str],
+    returning: Sequence[str] = (),
+) -> Optional[List[tuple]]:
+    """INSERT … ON CONFLICT (index_elements) DO NOTHING for a batch of rows.
+
+    With ``returning`` the listed columns of the rows that were actually
+    inserted are returned (in no particular order); conflicting rows are not.
+    """
+    if not rows:
+        return [] if returning else None
+
+    stmt = _dialect_insert(session, table)
+    if stmt is not None:
+        stmt = stmt.on_conflict_do_nothing(index_elements=list(index_elements))
+        if returning:
+            return [tuple(r) for r in session.execute(stmt.returning(*(table.c[c] for c in returning)), rows)]
+        session.execute(stmt, rows)
+        return None
+
+    # ---------- fallback: one SAVEPOINT per row --------------------------------
+    inserted = []
+    for row in rows:
+        try:
+            with session.begin_nested():
+                session.execute(insert(table), [row])
+            inserted.append(tuple(row[c] for c in returning))
+        except IntegrityError:
+            pass
+    return inserted if returning else None
+
+
+def upsert(
+    session: Session,
+    table: Table,
+    rows: Sequence[Dict],
+    index_elements: Sequence[str],
+    set_: Callable[[object], Dict],
+    returning: Optional[str] = None,
+) -> Optional[List]:
+    """INSERT … ON CONFLICT (index_elements) DO UPDATE for a batch of rows.
+
+    ``set_`` receives the incoming row (``excluded``) and returns the column →
+    expression mapping applied to the conflicting row, e.g.
+    ``lambda excluded: {"value": excluded.value}``. With ``returning`` the value
+    of that column is returned for every row, in the order of ``rows``.
+    """
+    if not rows:
+        return [] if returning else None
+
+    stmt = _dialect_insert(session, table)
+    if stmt is not None:
+        stmt = stmt.on_conflict_do_update(index_elements=list(index_elements), set_=set_(stmt.excluded))
+        if returning:
+            stmt = stmt.returning(table.c[returning], sort_by_parameter_order=True)
+            return session.execute(stmt, rows).scalars().all()
+        session.execute(stmt, rows)
+        return None
+
+    # ---------- fallback: insert, or update with the row bound as literals -----
+    for row in rows:
+        try:
+            with session.begin_nested():
+                session.execute(insert(table), [row])
+        except IntegrityError:
+            excluded = SimpleNamespace(**{k: literal(v, table.c[k].type) for k, v in row.items()})
+            key = and_(*(table.c[k] == row[k] for k in index_elements))
+            session.execute(update(table).where(key).values(**set_(excluded)))
+    if returning:
+        return [
+            session.execute(
+                select(table.c[returning]).where(and_(*(table.c[k] == row[k] for k in index_elements)))
+            ).scalar_one()
+            for row in rows
+        ]
+    return None
@@ -0,0 +1,68 @@
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import or_, update
+from sqlalchemy.orm import Session
+
+from app.db.bulk import insert_ignore
+from app.db.models import JobLease
+
+ETL_JOB = "etl"     # startup ETL; its last finish is what /readyz waits for
+
+
+class LeaseLost(RuntimeError):
+    """Raised by ``renew_lease`` when the lease expired and another owner took it."""
+
+
+def process_owner() -> str:
+    """Owner id unique to this process: host, pid and a random suffix."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def acquire_lease(session: Session, name: str, owner: str, ttl_seconds: float) -> bool:
+    """Take (or extend) the lease ``name`` for ``owner`` unless another owner holds an unexpired one.
+
+    A single conditional UPDATE decides the race, so it is safe across
+    processes and hosts sharing the database. Commits.
+    """
+    insert_ignore(session, JobLease.__table__, [{"name": name}], ("name",))
+    now = datetime.utcnow()
+    taken = session.execute(
+        update(JobLease)
+        .where(
+            JobLease.name == name,
+            or_(JobLease.owner.is_(None), JobLease.owner == owner, JobLease.expires_at < now),
+        )
+        .values(owner=owner, acquired_at=now, expires_at=now + timedelta(seconds=ttl_seconds))
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    session.commit()
+    return taken == 1
+
+
+def renew_lease(session: Session, name: str, owner: str, ttl_seconds: float) -> None:
+    """Extend the lease ``owner`` holds, from inside its run; raises ``LeaseLost`` when
+    another owner took it over, so the run can stop instead of overlapping. Commits."""
+    if not acquire_lease(session, name, owner, ttl_seconds):
+        raise LeaseLost(f"Lease {name!r} was taken over from {owner}")
+
+
+def release_lease(session: Session, name: str, owner: str, finished: bool = False) -> None:
+    """Give the lease back; with ``finished`` also record the run as the job's last success. Commits."""
+    values = {"owner": None, "expires_at": None}
+    if finished:
+        values["last_finished_at"] = datetime.utcnow()
+    session.execute(
+        update(JobLease)
+        .where(JobLease.name == name, JobLease.owner == owner)
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    session.commit()
+
+
+def last_finished(session: Session, name: str) -> Optional[datetime]:
+    return session.query(JobLease.last_finished_at).filter(JobLease.name == name).scalar()
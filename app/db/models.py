@@ -1,7 +1,7 @@
 from datetime import datetime
 
 from sqlalchemy import (
-    Column, Integer, String, Date, DateTime, Float, Enum, ForeignKey, UniqueConstraint
+    BigInteger, Boolean, Column, Integer, String, Date, DateTime, Float, Enum, ForeignKey, Index, LargeBinary, UniqueConstraint
 )
 from sqlalchemy.orm import relationship, declarative_base
 import enum
@@ -38,9 +38,15 @@ class Biometric(Base):
     timestamp = Column(DateTime, nullable=False, index=True)
     type = Column(Enum(BiometricType), nullable=False)
     value = Column(Float, nullable=False)
+    zscore = Column(Float, nullable=True)      # vs. the patient's running stats when stored
+    outlier = Column(Boolean, nullable=True)
     patient = relationship("Patient", back_populates="biometrics")
     __table_args__ = (
         UniqueConstraint("patient_id", "timestamp", "type", name="u_patient_time_type"),
+        # keyset pagination of a patient's history: ORDER BY timestamp DESC, id DESC
+        Index("ix_biometrics_patient_ts_id", "patient_id", "timestamp", "id"),
+        # ids of archived rows must never be handed out again, even when the newest row moved out
+        {"sqlite_autoincrement": True},
     )
 
 from sqlalchemy.orm import relationship
@@ -56,6 +62,11 @@ class Analytics(Base):
 
     patient = relationship("Patient", back_populates="analytics")
 
+    __table_args__ = (
+        # per-patient history and latest-value lookups: WHERE patient_id … ORDER BY computed_at
+        Index("ix_analytics_patient_metric_computed", "patient_id", "metric_name", "computed_at"),
+    )
+
 
 # models.py  (or wherever you keep your ORM models)
 
@@ -73,3 +84,187 @@ class BiometricHourly(Base):
         UniqueConstraint("patient_id", "timestamp", "type", name="uix_bh_pid_ts_type"),
     )
 
+
+class BucketStatsMixin:
+    """Mergeable per patient/type/bucket aggregates (count, sum, min, max)."""
+    id          = Column(Integer, primary_key=True)
+    patient_id  = Column(Integer, nullable=False)
+    type        = Column(String,  nullable=False)
+    bucket      = Column(DateTime, nullable=False)   # start of the hour/day/month
+    count       = Column(Integer, nullable=False)
+    sum         = Column(Float,   nullable=False)
+    min         = Column(Float,   nullable=False)
+    max         = Column(Float,   nullable=False)
+
+
+class BiometricHourlyStats(BucketStatsMixin, Base):
+    __tablename__ = "biometric_hourly_stats"
+    sketch      = Column(LargeBinary, nullable=True)  # serialised QuantileSketch of the hour's values
+    __table_args__ = (
+        UniqueConstraint("patient_id", "type", "bucket", name="uix_bhs_pid_type_bucket"),
+    )
+
+
+class BiometricDailyStats(BucketStatsMixin, Base):
+    __tablename__ = "biometric_daily_stats"
+    __table_args__ = (
+        UniqueConstraint("patient_id", "type", "bucket", name="uix_bds_pid_type_bucket"),
+        # one day of one type across patients, for cohort rebuilds
+        Index("ix_biometric_daily_stats_type_bucket", "type", "bucket"),
+    )
+
+
+class BiometricMonthlyStats(BucketStatsMixin, Base):
+    __tablename__ = "biometric_monthly_stats"
+    __table_args__ = (
+        UniqueConstraint("patient_id", "type", "bucket", name="uix_bms_pid_type_bucket"),
+    )
+
+
+class CohortDailyStats(Base):
+    """Daily aggregates per demographic cohort (10-year age band × gender) and type."""
+    __tablename__ = "cohort_daily_stats"
+
+    id          = Column(Integer, primary_key=True)
+    age_band    = Column(Integer, nullable=False)   # lower bound: 50 → ages 50–59; -1 when unknown
+    gender      = Column(String,  nullable=False)
+    type        = Column(String,  nullable=False)
+    bucket      = Column(DateTime, nullable=False)  # start of the day
+    count       = Column(Integer, nullable=False)
+    sum         = Column(Float,   nullable=False)
+    min         = Column(Float,   nullable=False)
+    max         = Column(Float,   nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("age_band", "gender", "type", "bucket", name="uix_cds_band_gender_type_bucket"),
+        Index("ix_cohort_daily_stats_type_bucket", "type", "bucket"),
+    )
+
+
+class BiometricLiveStats(Base):
+    """Running per patient/type statistics, updated on every ingest (Welford + EWMA)."""
+    __tablename__ = "biometric_live_stats"
+
+    id              = Column(Integer, primary_key=True)
+    patient_id      = Column(Integer, nullable=False)
+    type            = Column(String,  nullable=False)
+    count           = Column(Integer, nullable=False, default=0)
+    mean            = Column(Float,   nullable=False, default=0.0)
+    m2              = Column(Float,   nullable=False, default=0.0)   # sum of squared deviations
+    ewma_mean       = Column(Float,   nullable=True)
+    ewma_var        = Column(Float,   nullable=False, default=0.0)
+    outliers        = Column(Integer, nullable=False, default=0)
+    last_value      = Column(Float,   nullable=True)
+    last_timestamp  = Column(DateTime, nullable=True)
+    last_zscore     = Column(Float,   nullable=True)
+    updated_at      = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint("patient_id", "type", name="uix_bls_pid_type"),
+    )
+
+
+class IngestedFile(Base):
+    """Manifest of reading files already loaded by directory ingestion."""
+    __tablename__ = "ingested_files"
+
+    id          = Column(Integer, primary_key=True)
+    path        = Column(String,  nullable=False)
+    size        = Column(Integer, nullable=False)
+    sha256      = Column(String(64), nullable=False)
+    mtime_ns    = Column(BigInteger, nullable=True)  # lets unchanged files be skipped without hashing
+    readings    = Column(Integer, nullable=False)   # normalised readings parsed from the file
+    inserted    = Column(Integer, nullable=False)   # of which were new
+    ingested_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint("path", "size", "sha256", name="uix_ingested_files_path_size_hash"),
+    )
+
+
+class DirtySeries(Base):
+    """(patient, type) series whose readings changed since v1 analytics last refreshed them.
+
+    Every write path marks its series here, bumping ``version``; the job drains
+    a row only if its version is still the one it refreshed.
+    """
+    __tablename__ = "analytics_dirty_series"
+
+    id          = Column(Integer, primary_key=True)
+    patient_id  = Column(Integer, nullable=False)
+    type        = Column(String,  nullable=False)
+    version     = Column(Integer, nullable=False, default=1)
+    marked_at   = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint("patient_id", "type", name="uix_ads_pid_type"),
+    )
+
+
+class DeferredHour(Base):
+    """(patient, type, hour) buckets whose rollups a single-reading POST left to the analytics jobs.
+
+    Versioned like ``DirtySeries``: a row is dequeued only if it was not marked
+    again while its hour was being recomputed.
+    """
+    __tablename__ = "rollup_deferred_hours"
+
+    id          = Column(Integer, primary_key=True)
+    patient_id  = Column(Integer, nullable=False)
+    type        = Column(String,  nullable=False)
+    bucket      = Column(DateTime, nullable=False)
+    version     = Column(Integer, nullable=False, default=1)
+    marked_at   = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint("patient_id", "type", "bucket", name="uix_rdh_pid_type_bucket"),
+    )
+
+
+class JobLease(Base):
+    """Time-bounded exclusive lease on a job, so only one process runs it at a time.
+
+    ``last_finished_at`` records the last successful run of the job.
+    """
+    __tablename__ = "job_leases"
+
+    name              = Column(String, primary_key=True)
+    owner             = Column(String)
+    acquired_at       = Column(DateTime)
+    expires_at        = Column(DateTime)
+    last_finished_at  = Column(DateTime)
+
+
+class JobRun(Base):
+    """One scheduled run of a job; the unique slot makes each interval run at most once fleet-wide."""
+    __tablename__ = "job_runs"
+
+    id               = Column(Integer, primary_key=True)
+    job_name         = Column(String, nullable=False)
+    scheduled_for    = Column(DateTime, nullable=False)
+    owner            = Column(String)
+    status           = Column(String, nullable=False, default="running")   # running / ok / failed / skipped
+    started_at       = Column(DateTime)
+    finished_at      = Column(DateTime)
+    duration_seconds = Column(Float)
+    lag_seconds      = Column(Float)          # started_at - scheduled_for
+    error            = Column(String)
+    note             = Column(String)         # why a skipped slot needed no run of its own
+
+    __table_args__ = (UniqueConstraint("job_name", "scheduled_for", name="uq_job_run_slot"),)
+
+
+class BiometricHourlyClaimed(Base):
+    """Staging area for buffer rows claimed by a v2 analytics run.
+
+    Rows are moved here from ``biometrics_hourly`` in small transactions and
+    removed again in the same transaction that writes their analytics.
+    """
+    __tablename__ = "biometrics_hourly_claimed"
+
+    id          = Column(Integer, primary_key=True)
+    buffer_id   = Column(Integer, nullable=False)
+    patient_id  = Column(Integer, nullable=False)
+    timestamp   = Column(DateTime, nullable=False)
+    type        = Column(String,  nullable=False)
+    value       = Column(Float,   nullable=False)
@@ -0,0 +1,55 @@
+from typing import Callable, List
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.schema import CreateIndex
+
+from app.db.models import Base
+
+
+def create_schema(engine: Engine) -> List[str]:
+    """Create missing tables, then bring tables created by an earlier version up to date.
+
+    ``create_all`` leaves existing tables alone, so nullable columns and indexes
+    added to a model since are added here with ``ALTER TABLE … ADD COLUMN`` and
+    ``CREATE INDEX``. Idempotent, and safe when several workers start at once.
+    Returns what was added, as ``table.column`` and index names.
+    """
+    Base.metadata.create_all(bind=engine)
+    quote = engine.dialect.identifier_preparer.quote
+    added = []
+    for table in Base.metadata.sorted_tables:
+        def columns():
+            return {c["name"] for c in inspect(engine).get_columns(table.name)}
+
+        def indexes():
+            return {i["name"] for i in inspect(engine).get_indexes(table.name)}
+
+        existing = columns()
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            if not column.nullable:
+                raise RuntimeError(f"Cannot add NOT NULL column {table.name}.{column.name} to an existing table")
+            ddl = f"ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column.name)} {column.type.compile(engine.dialect)}"
+            if _apply(engine, text(ddl), lambda: column.name in columns()):
+                added.append(f"{table.name}.{column.name}")
+
+        existing = indexes()
+        for index in table.indexes:
+            if index.name not in existing and _apply(engine, CreateIndex(index), lambda: index.name in indexes()):
+                added.append(index.name)
+    return added
+
+
+def _apply(engine: Engine, ddl, done: Callable[[], bool]) -> bool:
+    """Run ``ddl``; ``False`` when it failed because another process applied it first."""
+    try:
+        with engine.begin() as conn:
+            conn.execute(ddl)
+    except DBAPIError:
+        if done():
+            return False
+        raise
+    return True
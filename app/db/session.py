@@ -1,6 +1,251 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from app.core.config import DATABASE_URL
+import os
+import threading
+import time
+from collections import deque
+from typing import AsyncIterator, Callable, Deque, Optional, TypeVar, Union
 
-engine = create_engine(DATABASE_URL, echo=False, future=True)
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
\ No newline at end of file
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.engine import URL, Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import QueuePool
+from app.core.config import DATABASE_URL, settings
+from app.core.metrics import install_sql_hooks
+
+T = TypeVar("T")
+DbSession = Union[Session, AsyncSession]
+
+# backend → async DBAPI driver used when ASYNC_DB_ENABLED (installed separately)
+ASYNC_DRIVERS = {"postgresql": "asyncpg", "sqlite": "aiosqlite"}
+
+
+def pool_options(url: Union[str, URL]) -> dict:
+    """Pool sizing from ``settings``; in-memory SQLite keeps its single-connection pool."""
+    url = make_url(url)
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return {}
+    return {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+    }
+
+
+def async_url(url: Union[str, URL]) -> URL:
+    """``postgresql://…`` → ``postgresql+asyncpg://…``, ``sqlite:///…`` → ``sqlite+aiosqlite:///…``."""
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for {backend!r}; set ASYNC_DATABASE_URL")
+    return url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}")
+
+
+def sqlite_profile(url: Union[str, URL]) -> bool:
+    """Whether ``url`` gets the SQLite profile: ``SQLITE_PROFILE`` and a file database."""
+    url = make_url(url)
+    return (
+        settings.SQLITE_PROFILE
+        and url.get_backend_name() == "sqlite"
+        and url.database not in (None, "", ":memory:")
+        and not url.query.get("uri")
+    )
+
+
+def read_only_url(url: Union[str, URL]) -> URL:
+    """``sqlite:///./app.db`` → the same file opened read-only (``file:…?mode=ro``)."""
+    url = make_url(url)
+    return url.set(database=f"file:{os.path.abspath(url.database)}", query={"mode": "ro", "uri": "true"})
+
+
+class FifoLock:
+    """Lock handed to waiters in arrival order, so a busy thread can't starve the others."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._waiters: Deque[object] = deque()
+        self._held = False
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        with self._cond:
+            if not self._held and not self._waiters:
+                self._held = True
+                return True
+            ticket = object()
+            self._waiters.append(ticket)
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while self._held or self._waiters[0] is not ticket:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    self._waiters.remove(ticket)
+                    self._cond.notify_all()
+                    return False
+                self._cond.wait(remaining)
+            self._waiters.popleft()
+            self._held = True
+            return True
+
+    def release(self) -> None:
+        with self._cond:
+            self._held = False
+            self._cond.notify_all()
+
+
+class WriterPool(QueuePool):
+    """The single SQLite writer connection; threads wanting it queue up first come, first served.
+
+    ``QueuePool`` alone lets a thread that just returned the connection take it
+    straight back, which starves other writers behind a job committing in a loop.
+    """
+
+    def __init__(self, creator, **kw):
+        kw.update(pool_size=1, max_overflow=0)
+        super().__init__(creator, **kw)
+        self.turns = FifoLock()
+
+    def _do_get(self):
+        if not self.turns.acquire(self._timeout):
+            raise exc.TimeoutError(f"Waited {self._timeout}s for the SQLite writer connection")
+        try:
+            return super()._do_get()
+        except BaseException:
+            self.turns.release()
+            raise
+
+    def _do_return_conn(self, record) -> None:
+        try:
+            super()._do_return_conn(record)
+        finally:
+            self.turns.release()
+
+
+def _pragmas(dbapi_connection, writer: bool) -> None:
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(f"PRAGMA busy_timeout = {int(settings.SQLITE_BUSY_TIMEOUT_MS)}")
+        if writer:
+            cursor.execute("PRAGMA journal_mode = WAL")
+            cursor.execute(f"PRAGMA synchronous = {settings.SQLITE_SYNCHRONOUS}")
+        else:
+            cursor.execute("PRAGMA query_only = ON")
+        cursor.execute(f"PRAGMA cache_size = {-int(settings.SQLITE_CACHE_SIZE_KB)}")
+        cursor.execute(f"PRAGMA mmap_size = {int(settings.SQLITE_MMAP_SIZE)}")
+        cursor.execute(f"PRAGMA temp_store = {settings.SQLITE_TEMP_STORE}")
+    finally:
+        cursor.close()
+
+
+def apply_sqlite_profile(engine_: Engine, writer: bool) -> None:
+    """Tune every new connection of ``engine_``; the writer also starts its transactions
+    with ``BEGIN IMMEDIATE``, so a write waits for the lock up front (``busy_timeout``)
+    instead of failing when a read transaction tries to upgrade."""
+    @event.listens_for(engine_, "connect")
+    def connect(dbapi_connection, _record):
+        _pragmas(dbapi_connection, writer)
+        if writer:
+            dbapi_connection.isolation_level = None     # the driver must not emit its own BEGIN
+
+    if writer:
+        @event.listens_for(engine_, "begin")
+        def begin(connection):
+            connection.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+if sqlite_profile(DATABASE_URL):
+    # One writer connection: its pool is the write queue, served in order and
+    # bounded by DB_POOL_TIMEOUT. Reads go to a separate pool of read-only
+    # connections, which WAL lets run alongside the write transaction.
+    engine = create_engine(
+        DATABASE_URL, echo=False, future=True, poolclass=WriterPool,
+        **{k: v for k, v in pool_options(DATABASE_URL).items() if k not in ("pool_size", "max_overflow")},
+    )
+    apply_sqlite_profile(engine, writer=True)
+    read_engine = create_engine(
+        read_only_url(DATABASE_URL), echo=False, future=True,
+        **{**pool_options(DATABASE_URL), "pool_size": settings.SQLITE_READ_POOL_SIZE},
+    )
+    apply_sqlite_profile(read_engine, writer=False)
+else:
+    engine = read_engine = create_engine(DATABASE_URL, echo=False, future=True, **pool_options(DATABASE_URL))
+SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+ReadSessionLocal = sessionmaker(bind=read_engine, autoflush=False, autocommit=False)
+if settings.METRICS_ENABLED:
+    install_sql_hooks(engine)
+    install_sql_hooks(read_engine)
+
+_async_engine: Optional[AsyncEngine] = None
+_async_sessionmaker: Optional[async_sessionmaker] = None
+
+
+def get_async_engine() -> AsyncEngine:
+    """Process-wide ``AsyncEngine``, created on first use so the driver stays optional."""
+    global _async_engine, _async_sessionmaker
+    if _async_engine is None:
+        url = settings.ASYNC_DATABASE_URL or async_url(DATABASE_URL)
+        _async_engine = create_async_engine(url, echo=False, **pool_options(url))
+        if settings.METRICS_ENABLED:
+            install_sql_hooks(_async_engine.sync_engine)
+        _async_sessionmaker = async_sessionmaker(bind=_async_engine, autoflush=False, autocommit=False)
+    return _async_engine
+
+
+def new_async_session() -> AsyncSession:
+    """A fresh ``AsyncSession`` on the shared async engine, for work that outlives a request."""
+    get_async_engine()
+    return _async_sessionmaker()
+
+
+async def dispose_async_engine() -> None:
+    global _async_engine, _async_sessionmaker
+    if _async_engine is not None:
+        engine_, _async_engine, _async_sessionmaker = _async_engine, None, None
+        await engine_.dispose()
+
+
+async def get_db() -> AsyncIterator[DbSession]:
+    """Request-scoped session shared by every router.
+
+    Yields an ``AsyncSession`` when ``ASYNC_DB_ENABLED`` is set and a plain
+    ``Session`` otherwise; endpoints stay agnostic by going through ``run_db``.
+    """
+    if settings.ASYNC_DB_ENABLED:
+        async with new_async_session() as db:
+            yield db
+    else:
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+
+async def get_read_db() -> AsyncIterator[DbSession]:
+    """``get_db`` for endpoints that only read: on the SQLite profile the session
+    uses the read-only pool, so it never queues behind ingest or analytics writes."""
+    if settings.ASYNC_DB_ENABLED:
+        async for db in get_db():
+            yield db
+    else:
+        db = ReadSessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+
+async def run_db(db: DbSession, fn: Callable[..., T], *args) -> T:
+    """Run ``fn(session, *args)`` without blocking the event loop.
+
+    On the async engine ``fn`` runs on the loop itself (``AsyncSession.run_sync``)
+    and waits on the network without holding a thread; on the sync engine it
+    runs on the threadpool, as sync endpoints did.
+    """
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(fn, *args)
+    return await run_in_threadpool(fn, db, *args)
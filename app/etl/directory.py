@@ -0,0 +1,190 @@
+import argparse
+import hashlib
+import os
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from itertools import islice
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import bindparam, update
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.metrics import span
+from app.db.bulk import chunked
+from app.db.models import IngestedFile, Patient
+from app.db.session import SessionLocal
+from app.etl.load import load_biometrics
+from app.etl.transform import ParsedReading, RejectReport, read_reading_file
+
+# (path, size, sha256)
+Fingerprint = Tuple[str, int, str]
+# (path, size, mtime in ns)
+FileStat = Tuple[str, int, int]
+
+
+def stat_file(path: str) -> FileStat:
+    st = os.stat(path)
+    return path, st.st_size, st.st_mtime_ns
+
+
+def fingerprint(path: str) -> Fingerprint:
+    """Size and SHA-256 of a file, read in 1 MiB blocks."""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+            size += len(block)
+    return path, size, digest.hexdigest()
+
+
+def parse_file(path: str) -> Tuple[List[ParsedReading], RejectReport]:
+    """Parse and normalise one readings CSV; runs in a worker process."""
+    rejects = RejectReport()
+    return list(read_reading_file(path, rejects)), rejects
+
+
+def discover(directory: Path, pattern: str) -> List[str]:
+    return sorted(str(p) for p in directory.glob(pattern) if p.is_file())
+
+
+def _bounded_map(executor: Executor, fn: Callable, items: Iterable, window: int) -> Iterator:
+    """``executor.map`` in order, with at most ``window`` calls submitted ahead of the consumer."""
+    items = iter(items)
+    pending = deque(executor.submit(fn, item) for item in islice(items, window))
+    try:
+        while pending:
+            result = pending.popleft().result()
+            pending.extend(executor.submit(fn, item) for item in islice(items, 1))
+            yield result
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def _unchanged(session: Session, stats: List[FileStat]) -> set:
+    """Files whose path, size and mtime match a manifest entry."""
+    seen = set()
+    for chunk in chunked(stats, 500):
+        seen.update(
+            session.query(IngestedFile.path, IngestedFile.size, IngestedFile.mtime_ns)
+            .filter(IngestedFile.path.in_([path for path, _, _ in chunk]), IngestedFile.mtime_ns.isnot(None))
+        )
+    return seen
+
+
+def _already_ingested(session: Session, prints: List[Fingerprint]) -> set:
+    seen = set()
+    for chunk in chunked(prints, 500):
+        seen.update(
+            session.query(IngestedFile.path, IngestedFile.size, IngestedFile.sha256)
+            .filter(IngestedFile.path.in_([path for path, _, _ in chunk]))
+        )
+    return seen
+
+
+def _touch(session: Session, prints: List[Fingerprint], mtimes: Dict[str, int]) -> None:
+    """Record the current mtime of files found unchanged by hash, so the next run skips them by stat."""
+    if prints:
+        table = IngestedFile.__table__
+        session.execute(
+            update(table)
+            .where(table.c.path == bindparam("p"), table.c.size == bindparam("s"), table.c.sha256 == bindparam("h"))
+            .values(mtime_ns=bindparam("m")),
+            [{"p": path, "s": size, "h": sha256, "m": mtimes[path]} for path, size, sha256 in prints],
+        )
+    session.commit()
+
+
+def _write_file(
+    session: Session,
+    fp: Fingerprint,
+    parsed: List[ParsedReading],
+    patient_ids: Dict[str, int],
+    mtime_ns: Optional[int] = None,
+) -> int:
+    """Load one file's readings and record it in the manifest, in one transaction."""
+    rows = [
+        {"patient_id": patient_ids[email], "timestamp": ts, "type": typ, "value": value}
+        for email, ts, typ, value in parsed
+        if email in patient_ids
+    ]
+    inserted = 0
+    for chunk in chunked(rows, settings.ETL_CHUNK_SIZE):
+        inserted += load_biometrics(session, chunk)
+    path, size, sha256 = fp
+    session.add(IngestedFile(
+        path=path, size=size, sha256=sha256, mtime_ns=mtime_ns, readings=len(parsed), inserted=inserted,
+    ))
+    session.commit()
+    return inserted
+
+
+def ingest_directory(
+    directory: Optional[Path] = None,
+    pattern: Optional[str] = None,
+    workers: Optional[int] = None,
+    executor: Optional[Executor] = None,
+) -> Dict[str, int]:
+    """Load every readings file under ``directory`` that is not in the ``ingested_files`` manifest.
+
+    Files whose path, size and mtime match the manifest are skipped on a stat
+    alone; the rest are fingerprinted and parsed in a process pool, at most
+    ``INGEST_MAX_IN_FLIGHT`` ahead of the writer. This process is the single
+    writer and commits each file together with its manifest entry, so a crashed
+    run resumes with the first unrecorded file. A file that was only partly
+    written before a crash is loaded again, its already stored readings being
+    skipped by the database.
+    """
+    directory = Path(directory or settings.INGEST_DIR)
+    paths = discover(directory, pattern or settings.INGEST_PATTERN)
+    summary = {"discovered": len(paths), "skipped": 0, "ingested": 0, "readings": 0, "inserted": 0, "rejected": 0}
+    if not paths:
+        return summary
+
+    workers = workers or settings.INGEST_WORKERS or os.cpu_count()
+    window = settings.INGEST_MAX_IN_FLIGHT or 2 * workers
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=workers)
+    session = SessionLocal()
+    try:
+        with span("ingest_directory", "fingerprint"):
+            stats = [stat_file(path) for path in paths]
+            unchanged = _unchanged(session, stats)
+            mtimes = {path: mtime for path, _, mtime in stats}
+            candidates = [path for path, size, mtime in stats if (path, size, mtime) not in unchanged]
+            prints = list(_bounded_map(executor, fingerprint, candidates, window))
+            seen = _already_ingested(session, prints)
+            # same content under a new mtime (or an entry recorded before mtimes were)
+            _touch(session, [fp for fp in prints if fp in seen], mtimes)
+        new = [fp for fp in prints if fp not in seen]
+        summary["skipped"] = len(paths) - len(new)
+
+        patient_ids = dict(session.query(Patient.email, Patient.id).all())
+        session.rollback()
+        # results arrive in file order while later files are still being parsed
+        parsed_files = _bounded_map(executor, parse_file, [path for path, _, _ in new], window)
+        for fp, (parsed, rejects) in zip(new, parsed_files):
+            with span("ingest_directory", "write_file"):
+                summary["inserted"] += _write_file(session, fp, parsed, patient_ids, mtimes[fp[0]])
+            summary["readings"] += len(parsed)
+            summary["rejected"] += rejects.count
+            summary["ingested"] += 1
+            print(f"Ingested {fp[0]}: {len(parsed)} readings, {rejects.count} rejected {rejects.reasons or ''}.")
+        return summary
+    finally:
+        session.close()
+        if own_executor:
+            executor.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Incremental, parallel ingestion of a directory of reading files")
+    parser.add_argument("directory", nargs="?", default=None)
+    parser.add_argument("--pattern", default=None)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    print(ingest_directory(args.directory, args.pattern, args.workers))
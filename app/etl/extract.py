@@ -1,17 +1,17 @@
 import json, csv
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Iterator, Optional
 
 DATA_DIR = Path(__file__).parent.parent.parent / "data"
 
-def load_patients() -> List[Dict]:
-    with open(DATA_DIR / "patients.json", "r", encoding="utf-8") as f:
+def load_patients(path: Optional[Path] = None) -> List[Dict]:
+    with open(path or DATA_DIR / "patients.json", "r", encoding="utf-8") as f:
         return json.load(f)
 
-def load_readings() -> List[Dict]:
-    rows = []
-    with open(DATA_DIR / "readings.csv", newline="") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            rows.append(row)
-    return rows
\ No newline at end of file
+def iter_readings(path: Optional[Path] = None) -> Iterator[Dict]:
+    """Stream rows from the readings CSV one at a time."""
+    with open(path or DATA_DIR / "readings.csv", newline="") as f:
+        yield from csv.DictReader(f)
+
+def load_readings(path: Optional[Path] = None) -> List[Dict]:
+    return list(iter_readings(path))
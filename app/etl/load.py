@@ -0,0 +1,87 @@
+from typing import Dict, List, Sequence, Tuple
+
+from sqlalchemy import tuple_
+from sqlalchemy.orm import Session
+
+from app.analytics.aggregates import type_name
+from app.analytics.live import update_live_stats
+from app.analytics.rollups import add_readings, recompute_hours
+from app.db import archive
+from app.db.bulk import chunked, insert_ignore, upsert
+from app.db.models import Biometric, BiometricHourly
+
+BIOMETRIC_KEY = ("patient_id", "timestamp", "type")
+READING_COLUMNS = ("patient_id", "type", "timestamp", "value")
+STATEMENT_ROWS = 1000
+
+
+def _key(row: Dict) -> Tuple:
+    """Natural key as the database compares it: naive timestamp, plain type name."""
+    return row["patient_id"], row["timestamp"].replace(tzinfo=None), type_name(row["type"])
+
+
+def load_biometrics(session: Session, rows: Sequence[Dict]) -> int:
+    """Bulk-insert biometric rows, skipping (patient_id, timestamp, type) keys already stored.
+
+    Only the rows actually inserted are folded into the rollups and live stats;
+    returns how many that were. Keys already in the cold archive count as stored.
+    """
+    count = 0
+    for chunk in chunked(rows, STATEMENT_ROWS):
+        archived = archive.archived_values(_key(r) for r in chunk)
+        if archived:
+            chunk = [r for r in chunk if _key(r) not in archived]
+            if not chunk:
+                continue
+        inserted = insert_ignore(session, Biometric.__table__, chunk, BIOMETRIC_KEY, returning=("id",) + READING_COLUMNS)
+        add_readings(session, [reading[1:] for reading in inserted])
+        update_live_stats(session, inserted)
+        count += len(inserted)
+    return count
+
+
+def upsert_biometrics(session: Session, rows: Sequence[Dict]) -> List[int]:
+    """Insert-or-update biometric rows in ``biometrics`` and the ``biometrics_hourly`` buffer.
+
+    Set-based equivalent of ``POST /biometrics`` for many rows: the last row wins
+    when a key appears more than once. New readings are folded into the rollups
+    and live stats; hours whose readings changed value are recomputed and the
+    old value is taken back out of the live stats. Returns the
+    ``biometrics.id`` of every input row, in input order. The caller owns the
+    transaction.
+    """
+    latest = {_key(r): r for r in rows}
+    ids = {}
+    for chunk in chunked(list(latest.items()), STATEMENT_ROWS):
+        keys = [key for key, _ in chunk]
+        values = [row for _, row in chunk]
+        existing = {
+            (pid, ts, type_name(typ)): value
+            for pid, ts, typ, value in session.query(
+                Biometric.patient_id, Biometric.timestamp, Biometric.type, Biometric.value
+            ).filter(tuple_(Biometric.patient_id, Biometric.timestamp, Biometric.type).in_(keys))
+        }
+        existing.update(archive.archived_values(key for key in keys if key not in existing))
+
+        chunk_ids = upsert(
+            session, Biometric.__table__, values, BIOMETRIC_KEY,
+            lambda excluded: {"value": excluded.value}, returning="id",
+        )
+        upsert(session, BiometricHourly.__table__, values, BIOMETRIC_KEY, lambda excluded: {"value": excluded.value})
+        ids.update(zip(keys, chunk_ids))
+
+        new, changed, stored, replaced = [], set(), [], []
+        for (pid, ts, typ), row in chunk:
+            old = existing.get((pid, ts, typ))
+            if old is None:
+                new.append((pid, typ, ts, row["value"]))
+            elif old != row["value"]:
+                changed.add((pid, typ, ts))
+                replaced.append((pid, typ, old))
+            else:
+                continue
+            stored.append((ids[(pid, ts, typ)], pid, typ, ts, row["value"]))
+        add_readings(session, new)
+        recompute_hours(session, changed)
+        update_live_stats(session, stored, replaced)
+    return [ids[_key(r)] for r in rows]
@@ -1,9 +1,166 @@
+import csv
+import math
 import re
 from datetime import datetime
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Mapping, NamedTuple, Optional, Sequence, Tuple
+
+from app.core.config import settings
 from app.db.models import BiometricType
 
 EMAIL_REGEX = re.compile(r"[^@]+@[^@]+\.[^@]+")
 
+EMAIL_COLUMN, TIMESTAMP_COLUMN = "patient_email", "timestamp"
+
+# CSV column → biometric type, for headers whose name is not (or not only) the type.
+# Extended or overridden by ``settings.READING_ALIASES``.
+DEFAULT_ALIASES = {
+    "glucose_mg_dl": BiometricType.glucose.value,
+    "bp_systolic": BiometricType.systolic.value,
+    "bp_diastolic": BiometricType.diastolic.value,
+    "weight_kg": BiometricType.weight.value,
+}
+
+# (patient e-mail, timestamp, type, value)
+ParsedReading = Tuple[str, datetime, str, float]
+
+
+class ReadingPlan(NamedTuple):
+    """A readings header compiled once: where the e-mail and timestamp are and which column is which type."""
+    email: int
+    timestamp: int
+    columns: Tuple[Tuple[int, str, str], ...]   # (position, column name, type)
+    ignored: Tuple[str, ...]
+
+
+class RejectReport:
+    """Rows (or single values) the transform stage could not use, with the reason.
+
+    Counts every reject but keeps only the first ``max_samples`` rows, so a
+    badly broken file cannot grow it without bound.
+    """
+
+    def __init__(self, max_samples: int = 1000):
+        self.max_samples = max_samples
+        self.count = 0
+        self.reasons: Dict[str, int] = {}
+        self.samples: List[Tuple[str, object, str, object]] = []    # (source, line, reason, row)
+
+    def add(self, source: str, line: object, reason: str, row: object = None) -> None:
+        self.count += 1
+        self.reasons[reason] = self.reasons.get(reason, 0) + 1
+        if len(self.samples) < self.max_samples:
+            self.samples.append((source, line, reason, row))
+
+    def merge(self, other: "RejectReport") -> "RejectReport":
+        self.count += other.count
+        for reason, n in other.reasons.items():
+            self.reasons[reason] = self.reasons.get(reason, 0) + n
+        self.samples.extend(other.samples[: max(self.max_samples - len(self.samples), 0)])
+        return self
+
+    def summary(self) -> Dict:
+        return {"rejected": self.count, "reasons": dict(self.reasons)}
+
+    def write_csv(self, path: str) -> None:
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(("source", "line", "reason", "row"))
+            writer.writerows(self.samples)
+
+
+def _resolve_type(column: str, aliases: Mapping[str, str]) -> Optional[str]:
+    """Type of a reading column: alias, then exact type name, then any ``_``-separated part."""
+    name = column.strip().lower()
+    if name in aliases:
+        return aliases[name]
+    members = BiometricType.__members__
+    if name in members:
+        return members[name].value
+    for part in name.split("_"):
+        if part in members:
+            return members[part].value
+    return None
+
+
+@lru_cache(maxsize=64)
+def _compile(header: Tuple[str, ...], aliases: Tuple[Tuple[str, str], ...]) -> ReadingPlan:
+    lookup = dict(aliases)
+    positions = {name.strip().lower(): i for i, name in enumerate(header)}
+    if EMAIL_COLUMN not in positions or TIMESTAMP_COLUMN not in positions:
+        raise ValueError(f"Readings header needs {EMAIL_COLUMN!r} and {TIMESTAMP_COLUMN!r} columns: {list(header)}")
+    columns, ignored = [], []
+    for i, name in enumerate(header):
+        if i in (positions[EMAIL_COLUMN], positions[TIMESTAMP_COLUMN]):
+            continue
+        typ = _resolve_type(name, lookup)
+        if typ is None:
+            ignored.append(name)
+        else:
+            columns.append((i, name, typ))
+    return ReadingPlan(positions[EMAIL_COLUMN], positions[TIMESTAMP_COLUMN], tuple(columns), tuple(ignored))
+
+
+def compile_header(header: Sequence[str], aliases: Optional[Mapping[str, str]] = None) -> ReadingPlan:
+    """Compile a readings CSV header into a ``ReadingPlan`` (cached per header and aliases)."""
+    merged = {**DEFAULT_ALIASES, **settings.READING_ALIASES, **(aliases or {})}
+    return _compile(
+        tuple(header), tuple(sorted((k.strip().lower(), BiometricType(v).value) for k, v in merged.items()))
+    )
+
+
+def transform_rows(
+    plan: ReadingPlan,
+    rows: Iterable[Sequence[str]],
+    rejects: Optional[RejectReport] = None,
+    source: str = "",
+    first_line: int = 2,
+) -> Iterator[ParsedReading]:
+    """Turn raw CSV rows (lists, as from ``csv.reader``) into reading tuples following ``plan``.
+
+    A row with no e-mail or an unparseable timestamp is rejected whole; a value
+    that is not a finite number is rejected on its own. Empty cells are skipped.
+    """
+    email_at, ts_at, columns = plan.email, plan.timestamp, plan.columns
+    width = max([email_at, ts_at] + [i for i, _, _ in columns]) + 1
+    for line, row in enumerate(rows, first_line):
+        if len(row) < width:
+            row = list(row) + [""] * (width - len(row))
+        email = row[email_at].strip()
+        if not email:
+            if rejects is not None and any(row):
+                rejects.add(source, line, "missing email", row)
+            continue
+        try:
+            ts = datetime.fromisoformat(row[ts_at].strip())
+        except ValueError:
+            if rejects is not None:
+                rejects.add(source, line, "invalid timestamp", row)
+            continue
+        for i, name, typ in columns:
+            cell = row[i]
+            if not cell:
+                continue
+            try:
+                value = float(cell)
+            except ValueError:
+                value = math.nan
+            if math.isfinite(value):
+                yield email, ts, typ, value
+            elif rejects is not None:
+                rejects.add(source, line, f"invalid {name}", row)
+
+
+def read_reading_file(path, rejects: Optional[RejectReport] = None) -> Iterator[ParsedReading]:
+    """Stream the reading tuples of one CSV file; the header is compiled once."""
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return
+        yield from transform_rows(compile_header(header), reader, rejects, str(path))
+
+
 def validate_patient(raw: dict) -> dict:
     raw["dob"] = datetime.fromisoformat(raw["dob"]).date()
     if not EMAIL_REGEX.fullmatch(raw["email"]):
@@ -11,19 +168,24 @@ def validate_patient(raw: dict) -> dict:
     raw["gender"] = raw["gender"].lower()
     return raw
 
+
+def validate_patients(raws: Iterable[dict], rejects: RejectReport, source: str = "patients", first: int = 0) -> List[dict]:
+    """``validate_patient`` over a batch; invalid records go to ``rejects`` instead of aborting it."""
+    valid = []
+    for i, raw in enumerate(raws, first):
+        try:
+            valid.append(validate_patient(dict(raw)))
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            rejects.add(source, i, f"invalid patient: {e}", raw)
+    return valid
+
+
 def normalize_reading(raw: dict) -> list[dict]:
-    raw["timestamp"] = datetime.fromisoformat(raw["timestamp"])
-    normalized = []
-    for key, val in raw.items():
-        if key in ("patient_email", "timestamp") or val in (None, ""):
-            continue
-        name = key.split("_")[0]
-        if name not in BiometricType.__members__:
-            continue
-        normalized.append({
-            "email": raw["patient_email"],
-            "timestamp": raw["timestamp"],
-            "type": name,
-            "value": float(val)
-        })
-    return normalized
\ No newline at end of file
+    """One ``csv.DictReader`` row → reading dicts. Kept for callers that work with dicts;
+    bulk paths use ``compile_header``/``transform_rows``."""
+    header = tuple(raw)
+    plan = compile_header(header)
+    return [
+        {"email": email, "timestamp": ts, "type": typ, "value": value}
+        for email, ts, typ, value in transform_rows(plan, [tuple(raw.values())])
+    ]
@@ -0,0 +1,190 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.etl.load import upsert_biometrics
+
+_STOP = object()
+
+
+class BufferClosed(RuntimeError):
+    """Raised by ``submit`` once the buffer has been shut down."""
+
+
+class WriteBehindBuffer:
+    """Group-commit queue for single-reading ingestion.
+
+    ``submit`` enqueues a validated reading and returns a ``Future``; a background
+    thread coalesces queued readings until ``max_batch`` rows or ``max_delay_ms``
+    have accumulated and writes them with one multi-row upsert and one commit.
+    The future resolves to the stored ``biometrics.id`` once that commit is done.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        max_batch: int = 500,
+        max_delay_ms: int = 20,
+        max_queue: int = 100_000,
+    ):
+        self._session_factory = session_factory
+        self.max_batch = max_batch
+        self.max_delay = max_delay_ms / 1000
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._closed = False
+        self._stats = {
+            "enqueued": 0,
+            "flushed_rows": 0,
+            "flushes": 0,
+            "failed_rows": 0,
+            "last_flush_size": 0,
+            "max_flush_size": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+            "total_flush_ms": 0.0,
+        }
+
+    # ---------- producer side -------------------------------------------------
+    def submit(self, row: Dict) -> Future:
+        """Enqueue one reading.
+
+        Raises ``queue.Full`` when the buffer is saturated and ``BufferClosed``
+        after ``shutdown``, so no future is ever left without a flusher.
+        """
+        future: Future = Future()
+        with self._lock:
+            if self._closed:
+                raise BufferClosed("write-behind buffer is shut down")
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="biometrics-write-behind", daemon=True)
+                self._thread.start()
+            # enqueued under the lock so nothing can land behind the stop marker
+            self._queue.put_nowait((row, future))
+            self._stats["enqueued"] += 1
+        return future
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["queue_depth"] = self._queue.qsize()
+        stats["avg_flush_ms"] = stats["total_flush_ms"] / stats["flushes"] if stats["flushes"] else 0.0
+        return stats
+
+    def shutdown(self, timeout: Optional[float] = None) -> None:
+        """Reject new submissions, flush everything still queued, then stop the flusher thread."""
+        with self._lock:
+            self._closed = True
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+
+    # ---------- flusher side --------------------------------------------------
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._flush(batch)
+
+        # drain whatever producers managed to enqueue before the stop marker
+        leftovers = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                leftovers.append(item)
+        for start in range(0, len(leftovers), self.max_batch):
+            self._flush(leftovers[start:start + self.max_batch])
+
+    def _flush(self, batch: List[Tuple[Dict, Future]]) -> None:
+        started = time.perf_counter()
+        try:
+            ids = self._write([row for row, _ in batch])
+        except Exception:
+            # isolate the offending reading(s) instead of failing the whole group
+            for row, future in batch:
+                try:
+                    future.set_result(self._write([row])[0])
+                except Exception as exc:
+                    future.set_exception(exc)
+                    with self._lock:
+                        self._stats["failed_rows"] += 1
+        else:
+            for (_, future), biometric_id in zip(batch, ids):
+                future.set_result(biometric_id)
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            s = self._stats
+            s["flushes"] += 1
+            s["flushed_rows"] += len(batch)
+            s["last_flush_size"] = len(batch)
+            s["max_flush_size"] = max(s["max_flush_size"], len(batch))
+            s["last_flush_ms"] = elapsed_ms
+            s["max_flush_ms"] = max(s["max_flush_ms"], elapsed_ms)
+            s["total_flush_ms"] += elapsed_ms
+
+    def _write(self, rows: List[Dict]) -> List[int]:
+        session = self._session_factory()
+        try:
+            ids = upsert_biometrics(session, rows)
+            session.commit()
+            return ids
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+
+_buffer: Optional[WriteBehindBuffer] = None
+_buffer_lock = threading.Lock()
+
+
+def get_write_behind() -> WriteBehindBuffer:
+    """Process-wide buffer, created on first use from ``settings``."""
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            from app.db.session import SessionLocal
+            _buffer = WriteBehindBuffer(
+                SessionLocal,
+                max_batch=settings.WRITE_BEHIND_MAX_BATCH,
+                max_delay_ms=settings.WRITE_BEHIND_MAX_DELAY_MS,
+                max_queue=settings.WRITE_BEHIND_MAX_QUEUE,
+            )
+        return _buffer
+
+
+def shutdown_write_behind() -> None:
+    """Drain and stop the process-wide buffer, if one was ever started."""
+    global _buffer
+    with _buffer_lock:
+        buffer, _buffer = _buffer, None
+    if buffer is not None:
+        buffer.shutdown()
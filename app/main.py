@@ -1,37 +1,64 @@
+import threading
+
 import uvicorn
 from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
 
-from app.analytics.run_hourly_analytics import run_hourly_analytics
-from app.analytics.run_hourly_analytics_v2 import run_hourly_analytics_v2
-from app.api import patients, biometrics, analytics
-from app.analytics.compute import run_etl
-from apscheduler.schedulers.background import BackgroundScheduler
+from app.api import patients, biometrics, analytics, cohorts, health
+from app.core.metrics import MetricsMiddleware
+from app.etl.write_behind import shutdown_write_behind
+from app.db.session import dispose_async_engine
 
 from app.core.config import settings
 
 
 def create_tables():
-    from app.db.models import Base
+    from app.db.schema import create_schema
     from app.db.session import engine
-    Base.metadata.create_all(bind=engine)
+    added = create_schema(engine)
+    if added:
+        print(f"Schema upgraded: added {', '.join(added)}")
+
+
+def run_startup_etl():
+    # imported here so the ETL stack is only loaded by the process that runs it
+    from app.analytics.compute import run_etl_exclusive
+    try:
+        run_etl_exclusive()
+    except Exception as e:
+        print(f"Startup ETL failed: {e!r}")
 
 app = FastAPI(title="HealthAPI")
+app.add_middleware(MetricsMiddleware)
 
 @app.on_event("startup")
 async def on_startup():
-    create_tables()
-    run_etl()
-    create_tables()
+    # the ETL no longer blocks startup: requests are served while it runs and
+    # /readyz reports when it has finished; only one worker (lease) runs it
+    if settings.STARTUP_CREATE_TABLES:
+        await run_in_threadpool(create_tables)
+    if settings.STARTUP_ETL == "sync":
+        await run_in_threadpool(run_startup_etl)
+    elif settings.STARTUP_ETL == "background":
+        threading.Thread(target=run_startup_etl, name="startup-etl", daemon=True).start()
+
+    if settings.SCHEDULER_ENABLED:
+        from app.analytics.scheduler import start_scheduler
+        start_scheduler()
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    if settings.SCHEDULER_ENABLED:
+        from app.analytics.scheduler import shutdown_scheduler
+        shutdown_scheduler()
+    shutdown_write_behind()
+    await dispose_async_engine()
 
+app.include_router(health.router)
 app.include_router(patients.router, prefix="/api/v1")
 app.include_router(biometrics.router, prefix="/api/v1")
 app.include_router(analytics.router, prefix="/api/v1")
+app.include_router(cohorts.router, prefix="/api/v1")
 
 if __name__ == "__main__":
-    scheduler = BackgroundScheduler()
-    if settings.ANALYTICS_VERSION == 1:
-        scheduler.add_job(run_hourly_analytics, 'cron', second=10) #Change this value to your liking.
-    else:
-        scheduler.add_job(run_hourly_analytics_v2, 'cron', second=10)
-    scheduler.start()
     uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
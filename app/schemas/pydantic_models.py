@@ -28,6 +28,7 @@ class BiometricIn(BaseModel):
 
 class BiometricOut(BiometricBase):
     id: int; patient_id: int
+    zscore: Optional[float] = None; outlier: Optional[bool] = None
     class Config: orm_mode = True
 
 class AnalyticsOut(BaseModel):
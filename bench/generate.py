@@ -0,0 +1,125 @@
+"""Deterministic synthetic patients and readings, in the format of ``data/``.
+
+Each patient gets a baseline per biometric, a measurement cadence (a few
+readings a day, with jitter), occasional multi-day gaps, missing cells and a
+slow weight drift; glucose follows a daily cycle. The same seed always
+produces byte-identical files.
+
+    python -m bench.generate --patients 1000 --readings 100000 --seed 42 --out bench/data
+"""
+import argparse
+import csv
+import json
+import math
+import random
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+READINGS_HEADER = ("patient_email", "timestamp", "glucose_mg_dL", "bp_systolic", "bp_diastolic", "weight_kg")
+START = datetime(2025, 1, 1)
+GENDERS = ("female", "male", "other")
+FIRST_NAMES = ("Alice", "Bob", "Carol", "David", "Erin", "Frank", "Grace", "Heidi", "Ivan", "Judy", "Mallory", "Niaj")
+LAST_NAMES = ("Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Lopez", "Wilson")
+
+GAP_PROBABILITY = 0.01          # per reading: the patient stops measuring for a while
+GAP_DAYS = (2, 14)
+MISSING_CELL_PROBABILITY = 0.1
+
+
+def email(index: int) -> str:
+    return f"patient{index}@example.com"
+
+
+def patients(n: int, seed: int = 0) -> List[Dict]:
+    rng = random.Random(f"patients:{seed}")
+    return [
+        {
+            "name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+            "dob": (date(1940, 1, 1) + timedelta(days=rng.randrange(365 * 65))).isoformat(),
+            "gender": rng.choice(GENDERS),
+            "address": f"{rng.randrange(1, 999)} Main St",
+            "email": email(i),
+            "phone": f"555-{rng.randrange(10000):04d}",
+        }
+        for i in range(n)
+    ]
+
+
+def _split(total: int, parts: int) -> List[int]:
+    return [total // parts + (i < total % parts) for i in range(parts)]
+
+
+def patient_readings(index: int, count: int, seed: int = 0, start: datetime = START) -> Iterator[Tuple]:
+    """``count`` CSV rows for one patient, in time order from around ``start``."""
+    rng = random.Random(f"readings:{seed}:{index}")
+    glucose, systolic = rng.gauss(110, 20), rng.gauss(125, 12)
+    diastolic, weight = systolic * rng.uniform(0.6, 0.7), rng.uniform(50, 110)
+    interval = timedelta(hours=rng.choice((4, 6, 8, 12, 24)))
+    at = start + timedelta(minutes=rng.randrange(24 * 60))
+    for _ in range(count):
+        hour = at.hour + at.minute / 60
+        values = (
+            round(glucose + 25 * math.sin(2 * math.pi * (hour - 8) / 24) + rng.gauss(0, 12), 1),
+            round(systolic + rng.gauss(0, 8)),
+            round(diastolic + rng.gauss(0, 6)),
+            round(weight + rng.gauss(0, 0.3), 1),
+        )
+        yield (email(index), at.isoformat(timespec="seconds")) + tuple(
+            "" if rng.random() < MISSING_CELL_PROBABILITY else value for value in values
+        )
+        weight += rng.gauss(0, 0.05)
+        at += interval + timedelta(minutes=rng.randrange(-30, 31))
+        if rng.random() < GAP_PROBABILITY:
+            at += timedelta(days=rng.randint(*GAP_DAYS))
+
+
+def readings(n_patients: int, n_rows: int, seed: int = 0, start: datetime = START) -> Iterator[Tuple]:
+    """``n_rows`` CSV rows spread evenly over ``n_patients``, grouped by patient."""
+    for index, count in enumerate(_split(n_rows, n_patients)):
+        yield from patient_readings(index, count, seed, start)
+
+
+def api_readings(
+    n_patients: int,
+    n_rows: int,
+    seed: int = 0,
+    start: datetime = START,
+    patient_ids: Optional[List[int]] = None,
+) -> Iterator[Dict]:
+    """The same rows as ``readings``, one ``POST /biometrics`` body per value.
+
+    ``patient_ids[i]`` is the database id of ``patient{i}``; by default ``i + 1``.
+    """
+    types = ("glucose", "systolic", "diastolic", "weight")
+    for row in readings(n_patients, n_rows, seed, start):
+        index = int(row[0][len("patient"):row[0].index("@")])
+        pid = patient_ids[index] if patient_ids else index + 1
+        for typ, value in zip(types, row[2:]):
+            if value != "":
+                yield {"patient_id": pid, "timestamp": row[1], "type": typ, "value": value}
+
+
+def generate(out: Path, n_patients: int, n_rows: int, seed: int = 0) -> Tuple[Path, Path]:
+    """Write ``patients.json`` and ``readings.csv`` into ``out``; returns their paths."""
+    out = Path(out)
+    out.mkdir(parents=True, exist_ok=True)
+    patients_path, readings_path = out / "patients.json", out / "readings.csv"
+    with open(patients_path, "w", encoding="utf-8") as f:
+        json.dump(patients(n_patients, seed), f, indent=1)
+    with open(readings_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(READINGS_HEADER)
+        writer.writerows(readings(n_patients, n_rows, seed))
+    return patients_path, readings_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic patients and readings")
+    parser.add_argument("--patients", type=int, default=1000)
+    parser.add_argument("--readings", type=int, default=100_000, help="CSV rows (up to 4 values each)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="bench/data")
+    args = parser.parse_args()
+    for path in generate(Path(args.out), args.patients, args.readings, args.seed):
+        print(path)
@@ -0,0 +1,320 @@
+"""Load generator: replay a JSONL request log or a weighted request mix against the API.
+
+Requests go to the app in-process through ASGI (the default) or to a running
+instance over HTTP (``--url``). In-process runs use whatever configuration
+the environment selects, so configurations are compared by running the same
+load under different settings:
+
+    ANALYTICS_VERSION=2 ASYNC_DB_ENABLED=true python -m bench.load --seed-data 10k --concurrency 16 \\
+        --duration 30 --label v2-async --output v2-async.json
+    CACHE_ENABLED=true python -m bench.load --concurrency 16 --duration 30 --baseline v2-async.json
+
+A log line is a JSON object with ``method`` and ``path`` plus optional
+``body`` (JSON) and ``headers``. Lines without them, such as the work
+items in the repository's ``requests.jsonl``, are skipped and counted.
+The report gives throughput, p50/p95/p99 latency and error rate per endpoint
+(method + path template), along with the settings the run was made under.
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+import httpx
+
+DEFAULT_MIX = {"patients": 1, "history": 4, "series": 2, "analytics": 2, "quantiles": 1, "post": 2}
+BIOMETRIC_TYPES = ("glucose", "systolic", "diastolic", "weight")
+REPORTED_SETTINGS = (
+    "ANALYTICS_VERSION", "ANALYTICS_ENGINE", "ASYNC_DB_ENABLED", "CACHE_ENABLED", "WRITE_BEHIND_ENABLED",
+    "METRICS_ENABLED", "DB_POOL_SIZE",
+)
+POST_START = datetime(2032, 1, 1)
+
+_ID_SEGMENT = re.compile(r"/\d+(?=/|$)")
+
+
+class Request(NamedTuple):
+    method: str
+    path: str
+    body: Optional[object] = None
+    headers: Optional[Dict[str, str]] = None
+
+
+def read_log(path: Path) -> Tuple[List[Request], int]:
+    """Requests of a JSONL log and the number of lines that were not HTTP requests."""
+    requests, skipped = [], 0
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                skipped += 1
+                continue
+            if not isinstance(entry, dict) or not isinstance(entry.get("method"), str) \
+                    or not isinstance(entry.get("path"), str):
+                skipped += 1
+                continue
+            requests.append(Request(entry["method"].upper(), entry["path"], entry.get("body"), entry.get("headers")))
+    return requests, skipped
+
+
+def endpoint(request: Request) -> str:
+    """``GET /api/v1/biometrics/{id}``-style name: no query string, numeric segments collapsed."""
+    return f"{request.method} {_ID_SEGMENT.sub('/{id}', request.path.split('?', 1)[0])}"
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    weights = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        name, _, weight = part.partition("=")
+        if name not in DEFAULT_MIX:
+            raise ValueError(f"Unknown request kind {name!r}; choose from {', '.join(DEFAULT_MIX)}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def generate_mix(weights: Dict[str, float], patient_ids: Sequence[int], seed: int = 0) -> Iterator[Request]:
+    """Endless weighted mix of reads over ``patient_ids`` and reading POSTs."""
+    rng = random.Random(seed)
+    kinds, kind_weights = list(weights), list(weights.values())
+    posted = 0
+    while True:
+        kind = rng.choices(kinds, kind_weights)[0]
+        pid, typ = rng.choice(patient_ids), rng.choice(BIOMETRIC_TYPES)
+        if kind == "patients":
+            yield Request("GET", f"/api/v1/patients?page={rng.randint(1, 5)}&size=20")
+        elif kind == "history":
+            yield Request("GET", f"/api/v1/biometrics?patient_id={pid}&size=50&page={rng.randint(1, 3)}")
+        elif kind == "series":
+            yield Request("GET", f"/api/v1/biometrics/series?patient_id={pid}&type={typ}&bucket=1d")
+        elif kind == "analytics":
+            yield Request("GET", f"/api/v1/analytics?patient_id={pid}&latest=true")
+        elif kind == "quantiles":
+            yield Request("GET", f"/api/v1/analytics/quantiles?patient_id={pid}&type={typ}&q=0.5,0.95")
+        else:
+            posted += 1
+            yield Request("POST", "/api/v1/biometrics", {
+                "patient_id": pid, "type": typ, "value": round(rng.uniform(60, 180), 1),
+                "timestamp": (POST_START + timedelta(seconds=posted)).isoformat(),
+            })
+
+
+class Sample(NamedTuple):
+    endpoint: str
+    status: int            # 0 for a transport error
+    seconds: float
+
+
+async def _send(client: httpx.AsyncClient, request: Request, samples: List[Sample]) -> None:
+    start = time.perf_counter()
+    try:
+        response = await client.request(request.method, request.path, json=request.body, headers=request.headers)
+        status = response.status_code
+    except httpx.HTTPError:
+        status = 0
+    samples.append(Sample(endpoint(request), status, time.perf_counter() - start))
+
+
+async def run_load(
+    client: httpx.AsyncClient,
+    requests: Iterable[Request],
+    concurrency: int = 8,
+    rate: Optional[float] = None,
+    duration: Optional[float] = None,
+    limit: Optional[int] = None,
+) -> Tuple[List[Sample], float]:
+    """Send ``requests`` until they run out, ``limit`` were sent or ``duration`` seconds passed.
+
+    Without ``rate`` it is closed-loop: ``concurrency`` requests in flight at
+    all times. With ``rate`` it is open-loop at that many requests per second,
+    with at most ``concurrency`` in flight (the achieved rate shows when the
+    app cannot keep up). Returns the samples and the elapsed wall time.
+    """
+    samples: List[Sample] = []
+    slots = asyncio.Semaphore(concurrency)
+    tasks = set()
+    start = time.perf_counter()
+
+    async def one(request: Request) -> None:
+        try:
+            await _send(client, request, samples)
+        finally:
+            slots.release()
+
+    for i, request in enumerate(requests):
+        if limit is not None and i >= limit:
+            break
+        if duration is not None and time.perf_counter() - start >= duration:
+            break
+        if rate:
+            delay = start + i / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        await slots.acquire()
+        task = asyncio.ensure_future(one(request))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.gather(*tasks)
+    return samples, time.perf_counter() - start
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    return sorted_values[min(int(q * len(sorted_values)), len(sorted_values) - 1)]
+
+
+def summarize(samples: List[Sample], elapsed: float) -> Dict:
+    """Throughput, latency percentiles (ms) and error rate (status 0 or ≥ 400), overall and per endpoint."""
+    def stats(group: List[Sample]) -> Dict:
+        latencies = sorted(s.seconds for s in group)
+        errors = sum(1 for s in group if s.status == 0 or s.status >= 400)
+        statuses: Dict[str, int] = {}
+        for s in group:
+            statuses[str(s.status)] = statuses.get(str(s.status), 0) + 1
+        return {
+            "requests": len(group),
+            "throughput_rps": round(len(group) / elapsed, 2) if elapsed else None,
+            "p50_ms": round(1000 * _percentile(latencies, 0.50), 3),
+            "p95_ms": round(1000 * _percentile(latencies, 0.95), 3),
+            "p99_ms": round(1000 * _percentile(latencies, 0.99), 3),
+            "error_rate": round(errors / len(group), 4),
+            "statuses": statuses,
+        }
+
+    by_endpoint: Dict[str, List[Sample]] = {}
+    for s in samples:
+        by_endpoint.setdefault(s.endpoint, []).append(s)
+    return {
+        "elapsed_seconds": round(elapsed, 3),
+        "total": stats(samples) if samples else {"requests": 0},
+        "endpoints": {name: stats(group) for name, group in sorted(by_endpoint.items())},
+    }
+
+
+def compare(baseline: Dict, current: Dict) -> Dict[str, Dict]:
+    """Per endpoint: throughput ratio (> 1 is faster) and p95 ratio (< 1 is faster) against ``baseline``."""
+    result = {}
+    for name, now in current["endpoints"].items():
+        before = baseline.get("endpoints", {}).get(name)
+        if before and before.get("throughput_rps") and before.get("p95_ms"):
+            result[name] = {
+                "throughput_ratio": round(now["throughput_rps"] / before["throughput_rps"], 3),
+                "p95_ratio": round(now["p95_ms"] / before["p95_ms"], 3),
+            }
+    return result
+
+
+def client_for(url: Optional[str]) -> httpx.AsyncClient:
+    """HTTP client for a running instance at ``url``, or an in-process ASGI client."""
+    if url:
+        return httpx.AsyncClient(base_url=url, timeout=60)
+    from app.main import app, create_tables
+    create_tables()
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://app", timeout=60)
+
+
+async def patient_ids(client: httpx.AsyncClient, limit: int = 1000) -> List[int]:
+    ids, cursor = [], None
+    while len(ids) < limit:
+        params = {"size": 100, "fields": "id", **({"cursor": cursor} if cursor else {})}
+        body = (await client.get("/api/v1/patients", params=params)).json()
+        ids.extend(p["id"] for p in body["items"])
+        cursor = body.get("next_cursor")
+        if not cursor:
+            break
+    return ids
+
+
+def _settings_snapshot(url: Optional[str]) -> Dict:
+    if url:
+        return {"url": url}
+    from app.core.config import settings
+    return {name: getattr(settings, name) for name in REPORTED_SETTINGS}
+
+
+async def _main(args) -> Dict:
+    if args.seed_data:
+        from bench.generate import generate
+        from bench.run import SIZES, ROWS_PER_PATIENT
+        from app.analytics.compute import run_etl
+        from app.main import create_tables
+        import tempfile
+        create_tables()
+        rows = SIZES[args.seed_data]
+        with tempfile.TemporaryDirectory(prefix="load-data-") as tmp:
+            generate(Path(tmp), max(rows // ROWS_PER_PATIENT, 10), rows, args.seed)
+            run_etl(data_dir=Path(tmp))
+
+    async with client_for(args.url) as client:
+        skipped = 0
+        if args.log:
+            requests, skipped = read_log(Path(args.log))
+            if not requests:
+                raise SystemExit(f"{args.log}: no HTTP requests ({skipped} lines skipped)")
+            source: Iterable[Request] = requests
+            if args.loop:
+                source = (r for _ in iter(int, 1) for r in requests)
+        else:
+            ids = await patient_ids(client)
+            if not ids:
+                raise SystemExit("No patients to query; load data first (e.g. --seed-data 10k)")
+            source = generate_mix(parse_mix(args.mix) if args.mix else DEFAULT_MIX, ids, args.seed)
+        limit = args.requests if args.requests or args.duration else 1000
+        samples, elapsed = await run_load(client, source, args.concurrency, args.rate, args.duration, limit)
+
+    report = {
+        "label": args.label,
+        "started_at": datetime.utcnow().isoformat(timespec="seconds"),
+        "mode": "http" if args.url else "asgi",
+        "source": args.log or (args.mix or "default mix"),
+        "skipped_log_lines": skipped,
+        "concurrency": args.concurrency,
+        "target_rate": args.rate,
+        "settings": _settings_snapshot(args.url),
+        **summarize(samples, elapsed),
+    }
+    if args.baseline:
+        report["comparison"] = compare(json.loads(Path(args.baseline).read_text()), report)
+    return report
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Replay or generate API load and report latency per endpoint")
+    parser.add_argument("--log", help="JSONL request log to replay (non-HTTP lines are skipped)")
+    parser.add_argument("--loop", action="store_true", help="replay the log repeatedly until the limit/duration")
+    parser.add_argument("--mix", help=f"weighted mix, e.g. history=4,post=1; kinds: {', '.join(DEFAULT_MIX)}")
+    parser.add_argument("--url", help="base URL of a running instance; default is in-process ASGI")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rate", type=float, help="open-loop requests per second")
+    parser.add_argument("--duration", type=float, help="seconds to run")
+    parser.add_argument("--requests", type=int, help="requests to send (default 1000 unless --duration)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--seed-data", help="in-process only: generate and ETL a dataset first (10k, 100k, …)")
+    parser.add_argument("--label", default="")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--baseline", help="earlier report to compare against")
+    args = parser.parse_args(argv)
+    if args.seed_data and args.url:
+        parser.error("--seed-data only applies to in-process runs")
+
+    report = asyncio.run(_main(args))
+    text = json.dumps(report, indent=2, default=str)
+    if args.output:
+        Path(args.output).write_text(text)
+    else:
+        print(text)
+    total = report["total"]
+    print(f"{total['requests']} requests in {report['elapsed_seconds']}s, "
+          f"error rate {total.get('error_rate', 0)}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""Scaling benchmarks: ETL, single and batched ingest, deep history pages, v1 vs v2 analytics.
+
+Every (backend, size) runs in its own process against a freshly created
+schema, because the application binds its engine to ``DATABASE_URL`` at
+import. SQLite uses a file in a temporary directory; Postgres runs when
+``--postgres-url`` (or ``BENCH_POSTGRES_URL``) is given. The Postgres database
+is dropped and recreated table by table, so point it at a scratch database.
+
+    python -m bench.run --sizes 10k,1m --output bench-results.json
+    python -m bench.run --sizes 10k --baseline bench-results.json   # compare with an earlier run
+
+Sizes count CSV rows of generated data (about 3.6 readings each). Results are
+JSON: one record per benchmark with wall time and throughput, plus the commit
+and interpreter they were measured on.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+SIZES = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000, "10m": 10_000_000}
+ROWS_PER_PATIENT = 1000
+SINGLE_INGEST_REQUESTS = 1000
+BATCH_INGEST_ROWS = 20_000
+BATCH_SIZE = 1000
+HISTORY_PAGE_SIZE = 100
+HISTORY_SAMPLES = 20
+INGEST_START = datetime(2030, 1, 1)     # after the ETL data, so ingest benchmarks insert new rows
+
+
+def _timed(fn: Callable[[], object]) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def _record(name: str, seconds: float, rows: int, **extra) -> Dict:
+    return {"name": name, "seconds": round(seconds, 4), "rows": rows,
+            "rows_per_second": round(rows / seconds, 1) if seconds else None, **extra}
+
+
+def _latency(samples: List[float]) -> Dict:
+    samples = sorted(samples)
+    return {
+        "p50_ms": round(1000 * statistics.median(samples), 3),
+        "p95_ms": round(1000 * samples[int(0.95 * (len(samples) - 1))], 3),
+    }
+
+
+def run_size(rows: int, workdir: Path, seed: int = 0) -> List[Dict]:
+    """All benchmarks at one size, against the database of this process's ``DATABASE_URL``."""
+    from fastapi.testclient import TestClient
+    from sqlalchemy import func, text
+
+    from app.analytics.compute import run_etl
+    from app.analytics.run_hourly_analytics import run_hourly_analytics
+    from app.analytics.run_hourly_analytics_v2 import run_hourly_analytics_v2
+    from app.db.models import Base, Biometric, Patient
+    from app.db.session import SessionLocal, engine
+    from app.main import app
+    from bench.generate import api_readings, generate
+
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    n_patients = max(rows // ROWS_PER_PATIENT, 10)
+    generate(workdir / "data", n_patients, rows, seed)
+    results = []
+
+    # ── ETL ────────────────────────────────────────────────────────────────────
+    seconds = _timed(lambda: run_etl(data_dir=workdir / "data"))
+    # sessions are closed before the next job runs: on the SQLite profile an open
+    # transaction holds the single writer connection
+    with SessionLocal() as db:
+        loaded = db.query(func.count(Biometric.id)).scalar()
+        patient_ids = [pid for pid, in db.query(Patient.id).order_by(Patient.id)]
+    results.append(_record("etl", seconds, loaded, csv_rows=rows, patients=n_patients))
+
+    # ── analytics: v1 from the rollups, v2 from a full buffer ──────────────────
+    results.append(_record("analytics_v1", _timed(run_hourly_analytics), loaded))
+    with SessionLocal() as db:
+        db.execute(text(
+            "INSERT INTO biometrics_hourly (patient_id, timestamp, type, value) "
+            "SELECT patient_id, timestamp, type, value FROM biometrics"
+        ))
+        db.commit()
+    results.append(_record("analytics_v2", _timed(run_hourly_analytics_v2), loaded))
+
+    # ── history: last page by offset vs. by cursor, for the largest patient ────
+    with SessionLocal() as db:
+        pid, count = db.query(Biometric.patient_id, func.count()).group_by(Biometric.patient_id) \
+            .order_by(func.count().desc()).first()
+    client = TestClient(app)
+    base = f"/api/v1/biometrics?patient_id={pid}&size={HISTORY_PAGE_SIZE}"
+    last_page = max((count + HISTORY_PAGE_SIZE - 1) // HISTORY_PAGE_SIZE, 1)
+    offset_samples = [
+        _timed(lambda: client.get(f"{base}&page={last_page}&include_total=false")) for _ in range(HISTORY_SAMPLES)
+    ]
+    results.append(_record(
+        "history_offset_last_page", sum(offset_samples), HISTORY_SAMPLES,
+        patient_rows=count, page=last_page, **_latency(offset_samples),
+    ))
+    cursor_samples, cursor = [], None
+    while True:
+        start = time.perf_counter()
+        body = client.get(f"{base}&cursor={cursor}" if cursor else base).json()
+        cursor_samples.append(time.perf_counter() - start)
+        cursor = body["next_cursor"]
+        if not cursor:
+            break
+    results.append(_record(
+        "history_cursor_walk", sum(cursor_samples), len(cursor_samples),
+        patient_rows=count, **_latency(cursor_samples),
+    ))
+
+    # ── ingest: one reading per request, then BATCH_SIZE per request ───────────
+    single = list(api_readings(n_patients, SINGLE_INGEST_REQUESTS, seed + 1, INGEST_START, patient_ids))
+    single = single[:SINGLE_INGEST_REQUESTS]
+    samples = [_timed(lambda: client.post("/api/v1/biometrics", json=reading)) for reading in single]
+    results.append(_record("ingest_single", sum(samples), len(samples), **_latency(samples)))
+
+    batch_rows = min(BATCH_INGEST_ROWS, rows)
+    readings = list(api_readings(n_patients, batch_rows, seed + 2, INGEST_START.replace(year=2031), patient_ids))
+    batches = [readings[i:i + BATCH_SIZE] for i in range(0, len(readings), BATCH_SIZE)]
+    samples = [_timed(lambda: client.post("/api/v1/biometrics:batch", json=batch)) for batch in batches]
+    results.append(_record("ingest_batch", sum(samples), len(readings), batch_size=BATCH_SIZE, **_latency(samples)))
+    return results
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=Path(__file__).resolve().parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _child(backend: str, url: str, size: str, seed: int) -> List[Dict]:
+    with tempfile.TemporaryDirectory(prefix="bench-") as tmp:
+        if backend == "sqlite":
+            url = f"sqlite:///{tmp}/bench.db"
+        out = Path(tmp) / "results.json"
+        env = {**os.environ, "DATABASE_URL": url, "STARTUP_ETL": "off", "SCHEDULER_ENABLED": "false"}
+        cmd = [sys.executable, "-m", "bench.run", "--child", size, "--seed", str(seed), "--child-output", str(out)]
+        proc = subprocess.run(
+            cmd, env=env, cwd=Path(__file__).resolve().parent.parent, capture_output=True, text=True
+        )
+        if proc.returncode != 0:
+            return [{"name": "error", "error": proc.stderr.strip().splitlines()[-1:] or proc.returncode}]
+        return json.loads(out.read_text())
+
+
+def compare(baseline: Dict, current: Dict) -> List[Dict]:
+    """Per benchmark, current throughput relative to the baseline's (> 1 is faster)."""
+    def key(r):
+        return r["backend"], r["size"], r["name"]
+    before = {key(r): r for r in baseline["results"] if r.get("rows_per_second")}
+    return [
+        {"backend": r["backend"], "size": r["size"], "name": r["name"],
+         "speedup": round(r["rows_per_second"] / before[key(r)]["rows_per_second"], 3)}
+        for r in current["results"] if r.get("rows_per_second") and key(r) in before
+    ]
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="PatientPulse scaling benchmarks")
+    parser.add_argument("--sizes", default="10k", help=f"comma-separated, from {', '.join(SIZES)}")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--postgres-url", default=os.environ.get("BENCH_POSTGRES_URL"))
+    parser.add_argument("--output", help="write the JSON results here instead of stdout")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--child-output", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        with tempfile.TemporaryDirectory(prefix="bench-data-") as tmp:
+            results = run_size(SIZES[args.child], Path(tmp), args.seed)
+        Path(args.child_output).write_text(json.dumps(results))
+        return
+
+    sizes = [s.strip().lower() for s in args.sizes.split(",") if s.strip()]
+    unknown = [s for s in sizes if s not in SIZES]
+    if unknown:
+        parser.error(f"unknown sizes {unknown}; choose from {', '.join(SIZES)}")
+    backends = [("sqlite", "")] + ([("postgresql", args.postgres_url)] if args.postgres_url else [])
+
+    report = {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "started_at": datetime.utcnow().isoformat(timespec="seconds"),
+        "seed": args.seed,
+        "results": [],
+    }
+    for backend, url in backends:
+        for size in sizes:
+            print(f"bench: {backend} {size}…", file=sys.stderr)
+            for result in _child(backend, url, size, args.seed):
+                report["results"].append({"backend": backend, "size": size, **result})
+    if args.baseline:
+        report["comparison"] = compare(json.loads(Path(args.baseline).read_text()), report)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
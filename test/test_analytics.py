@@ -11,6 +11,18 @@ def setup_database():
     Base.metadata.drop_all(bind=engine)
 
 client = TestClient(app)
+
+
+def apply_deferred_rollups():
+    """Recompute the hours single POSTs deferred, as the next analytics run does first."""
+    from app.analytics.rollups import apply_deferred
+    db = SessionLocal()
+    try:
+        apply_deferred(db, 1000)
+    finally:
+        db.close()
+
+
 class TestAnalytics:
     def test_get_patient_analytics_empty(self):
         response = client.get("/api/v1/analytics?patient_id=1")
@@ -35,4 +47,452 @@ class TestAnalytics:
         assert response.status_code == 200
         data = response.json()
         assert len(data) == 1
-        assert data[0]["metric_name"] == "glucose_min"
\ No newline at end of file
+        assert data[0]["metric_name"] == "glucose_min"
+
+class TestIncrementalAnalytics:
+    def _add_readings(self, *readings):
+        from datetime import datetime
+        from app.etl.load import load_biometrics
+        db = SessionLocal()
+        load_biometrics(db, [
+            {"patient_id": patient_id, "timestamp": datetime.fromisoformat(ts), "type": "glucose", "value": value}
+            for patient_id, ts, value in readings
+        ])
+        db.commit()
+        db.close()
+
+    def _metrics(self, patient_id):
+        response = client.get(f"/api/v1/analytics?patient_id={patient_id}")
+        assert response.status_code == 200
+        return {row["metric_name"]: row["value"] for row in response.json()}
+
+    def test_only_touched_series_are_refreshed(self):
+        from app.analytics.run_hourly_analytics import run_hourly_analytics
+        from app.db.models import BiometricHourlyStats
+        self._add_readings((901, "2025-01-01T08:05:00", 100), (901, "2025-01-01T08:45:00", 120))
+        run_hourly_analytics()
+        assert self._metrics(901) == {"glucose_min": 100, "glucose_max": 120, "glucose_avg": 110}
+
+        run_hourly_analytics()  # nothing new: nothing to refresh
+        self._add_readings((901, "2025-01-01T09:10:00", 80))
+        run_hourly_analytics()
+        assert self._metrics(901) == {"glucose_min": 80, "glucose_max": 120, "glucose_avg": 100}
+
+        db = SessionLocal()
+        buckets = {b.bucket.hour: b.count for b in db.query(BiometricHourlyStats).filter_by(patient_id=901)}
+        db.close()
+        assert buckets == {8: 2, 9: 1}
+
+    def test_updates_and_deletes_refresh_their_series(self):
+        from app.analytics.run_hourly_analytics import run_hourly_analytics
+        reading = {"patient_id": 903, "timestamp": "2025-01-03T08:00:00", "type": "glucose", "value": 100}
+        client.post("/api/v1/biometrics", json=reading)
+        created = client.post("/api/v1/biometrics", json={**reading, "timestamp": "2025-01-03T09:00:00", "value": 120})
+        run_hourly_analytics()
+        assert self._metrics(903)["glucose_max"] == 120
+
+        client.post("/api/v1/biometrics:batch", json=[{**reading, "value": 130}])     # same id, new value
+        run_hourly_analytics()
+        assert self._metrics(903)["glucose_max"] == 130
+
+        client.delete(f"/api/v1/biometrics/{created.json()['id']}")
+        run_hourly_analytics()
+        assert self._metrics(903) == {"glucose_min": 130, "glucose_max": 130, "glucose_avg": 130}
+
+    def test_backfill_rebuilds_range(self):
+        from datetime import datetime
+        from app.analytics.run_hourly_analytics import run_hourly_analytics, backfill_rollups
+        from app.db.models import BiometricHourlyStats
+        self._add_readings((902, "2025-02-01T10:00:00", 90), (902, "2025-02-01T10:30:00", 110))
+        run_hourly_analytics()
+
+        db = SessionLocal()
+        db.query(BiometricHourlyStats).filter_by(patient_id=902).delete()
+        db.commit()
+
+        backfill_rollups(datetime(2025, 2, 1), datetime(2025, 2, 2))
+        stats = db.query(BiometricHourlyStats).filter_by(patient_id=902).one()
+        db.close()
+        assert (stats.count, stats.sum, stats.min, stats.max) == (2, 200, 90, 110)
+
+    def test_commit_hook_runs_after_each_chunk(self):
+        from app.analytics.run_hourly_analytics import run_hourly_analytics
+        run_hourly_analytics()
+        self._add_readings((905, "2025-01-01T08:05:00", 100), (906, "2025-01-01T08:05:00", 110))
+        commits = []
+        run_hourly_analytics(chunk_size=1, on_commit=lambda: commits.append(1))
+        assert len(commits) == 2
+
+
+class TestBufferDrain:
+    def test_ingest_while_draining_loses_nothing(self):
+        import threading
+        from datetime import datetime, timedelta
+        from app.analytics.run_hourly_analytics_v2 import run_hourly_analytics_v2
+        from app.db.models import BiometricHourly, BiometricHourlyClaimed
+        from app.etl.load import upsert_biometrics
+
+        patients = range(10000, 10600)   # one reading per patient → one _avg row each
+        start = datetime(2025, 3, 1)
+
+        def ingest():
+            db = SessionLocal()
+            batch = []
+            for i, pid in enumerate(patients):
+                batch.append({"patient_id": pid, "timestamp": start + timedelta(minutes=i), "type": "glucose", "value": float(pid)})
+                if len(batch) == 20:
+                    upsert_biometrics(db, batch)
+                    db.commit()
+                    batch = []
+            db.close()
+
+        writer = threading.Thread(target=ingest)
+        writer.start()
+        while writer.is_alive():
+            run_hourly_analytics_v2(chunk_size=50)
+        writer.join()
+        run_hourly_analytics_v2(chunk_size=50)
+
+        db = SessionLocal()
+        avgs = (
+            db.query(Analytics.patient_id, Analytics.value)
+            .filter(Analytics.metric_name == "glucose_avg", Analytics.patient_id.in_(list(patients)))
+            .all()
+        )
+        assert sorted(pid for pid, _ in avgs) == list(patients)      # no loss, no double count
+        assert all(value == pid for pid, value in avgs)
+        assert db.query(BiometricHourly).filter(BiometricHourly.patient_id.in_(list(patients))).count() == 0
+        assert db.query(BiometricHourlyClaimed).count() == 0
+        db.close()
+
+
+class TestAnalyticsExport:
+    def test_export_csv(self):
+        from datetime import datetime
+        db = SessionLocal()
+        for i in range(3):
+            db.add(Analytics(patient_id=950, metric_name="weight_avg", value=70 + i, computed_at=datetime(2025, 4, 1, i)))
+        db.commit()
+        db.close()
+
+        response = client.get("/api/v1/analytics/export?patient_ids=950&format=csv&from=2025-04-01T01:00:00")
+        assert response.status_code == 200
+        lines = response.text.splitlines()
+        assert lines[0] == "patient_id,metric_name,value,computed_at"
+        assert lines[1:] == ["950,weight_avg,71.0,2025-04-01T01:00:00", "950,weight_avg,72.0,2025-04-01T02:00:00"]
+
+
+class TestAnalyticsSnapshots:
+    @pytest.fixture(autouse=True)
+    def history(self):
+        from datetime import datetime
+        db = SessionLocal()
+        if not db.query(Analytics).filter_by(patient_id=960).count():
+            for pid in (960, 961):
+                for hour in range(3):
+                    for name in ("glucose_avg", "weight_avg"):
+                        db.add(Analytics(patient_id=pid, metric_name=name, value=pid + hour, computed_at=datetime(2025, 5, 1, hour)))
+            db.commit()
+        db.close()
+
+    def test_latest_per_metric(self):
+        data = client.get("/api/v1/analytics?patient_id=960&latest=true").json()
+        assert [(r["metric_name"], r["value"]) for r in data] == [("glucose_avg", 962), ("weight_avg", 962)]
+
+    def test_batch_latest(self):
+        data = client.get("/api/v1/analytics?patient_ids=960,961&latest=true&metric=weight_avg").json()
+        assert [(r["patient_id"], r["value"]) for r in data] == [(960, 962), (961, 963)]
+
+    def test_time_bounds(self):
+        data = client.get(
+            "/api/v1/analytics?patient_ids=960&patient_ids=961&metric=glucose_avg"
+            "&from=2025-05-01T00:00:00&to=2025-05-01T02:00:00&latest=true"
+        ).json()
+        assert [(r["patient_id"], r["value"]) for r in data] == [(960, 961), (961, 962)]
+
+    def test_patient_required(self):
+        assert client.get("/api/v1/analytics").status_code == 400
+
+
+class TestReadThroughCache:
+    @pytest.fixture(autouse=True)
+    def cache(self, monkeypatch):
+        from app.core import cache
+        from app.core.config import settings
+        monkeypatch.setattr(settings, "CACHE_ENABLED", True)
+        monkeypatch.setattr(cache, "_cache", cache.ReadThroughCache(max_entries=100, max_bytes=1 << 20, ttl=60))
+        yield cache._cache
+
+    def _add_reading(self, patient_id, ts, value):
+        from datetime import datetime
+        from app.etl.load import load_biometrics
+        db = SessionLocal()
+        load_biometrics(db, [{"patient_id": patient_id, "timestamp": datetime.fromisoformat(ts), "type": "glucose", "value": value}])
+        db.commit()
+        db.close()
+
+    def test_repeat_read_is_a_hit(self, cache):
+        first = client.get("/api/v1/analytics?patient_id=970")
+        second = client.get("/api/v1/analytics?patient_id=970")
+        assert first.json() == second.json() == []
+        assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+        stats = client.get("/api/v1/analytics/cache/stats").json()
+        assert stats["enabled"] is True and stats["hit_rate"] == 0.5
+
+    def test_job_commit_invalidates_touched_patients(self, cache):
+        from app.analytics.run_hourly_analytics import run_hourly_analytics
+        assert client.get("/api/v1/analytics?patient_id=971").json() == []
+        assert client.get("/api/v1/analytics?patient_id=972").json() == []
+
+        self._add_reading(971, "2025-06-01T08:00:00", 100)
+        run_hourly_analytics()
+
+        data = client.get("/api/v1/analytics?patient_id=971").json()
+        assert {r["metric_name"] for r in data} == {"glucose_min", "glucose_max", "glucose_avg"}
+        assert client.get("/api/v1/analytics?patient_id=972").json() == []
+        assert cache.stats()["hits"] == 1
+
+    def test_ingest_invalidates_series(self, cache):
+        url = "/api/v1/biometrics/series?patient_id=973&type=glucose&bucket=day"
+        self._add_reading(973, "2025-06-02T08:00:00", 90)
+        assert client.get(url).json()["points"][0]["count"] == 1
+        assert client.get(url).json()["points"][0]["count"] == 1
+
+        self._add_reading(973, "2025-06-02T09:00:00", 110)
+        assert client.get(url).json()["points"][0]["count"] == 2
+        assert cache.stats()["hits"] == 1
+
+    def test_rollback_keeps_entries(self, cache):
+        from app.core.cache import invalidate_on_commit
+        client.get("/api/v1/analytics?patient_id=974")
+        db = SessionLocal()
+        invalidate_on_commit(db, "analytics", [974])
+        db.rollback()
+        db.close()
+        client.get("/api/v1/analytics?patient_id=974")
+        assert cache.stats()["hits"] == 1
+
+    def test_lru_eviction(self):
+        from app.core.cache import ReadThroughCache
+        cache = ReadThroughCache(max_entries=2, max_bytes=1 << 20, ttl=60)
+        for pid in (1, 2, 3):
+            cache.set(cache.key("analytics", [pid]), b"[]")
+        assert cache.get(cache.key("analytics", [1])) is None
+        assert cache.get(cache.key("analytics", [3])) == b"[]"
+        assert cache.stats()["evictions"] == 1
+
+    def test_backend_must_implement_interface(self):
+        from app.core.cache import CacheBackend
+
+        class Partial(CacheBackend):
+            def get(self, key):
+                return None
+
+        with pytest.raises(TypeError):
+            Partial()
+
+
+class TestVectorizedEngine:
+    def test_metrics_match_reference(self):
+        import numpy as np
+        from datetime import datetime, timedelta
+        from app.analytics.vectorized import compute_metrics, to_columns
+        rng = np.random.default_rng(7)
+        start = datetime(2025, 7, 1)
+        rows = [
+            (pid, typ, start + timedelta(hours=int(h)), float(v))
+            for pid in (1, 2) for typ in ("glucose", "weight")
+            for h, v in zip(rng.permutation(200), rng.normal(120, 30, 200))
+        ]
+        metrics = compute_metrics(to_columns(rows))
+
+        values = np.array([v for pid, typ, _, v in rows if pid == 2 and typ == "glucose"])
+        assert metrics[(2, "glucose_avg")] == pytest.approx(values.mean())
+        assert metrics[(2, "glucose_std")] == pytest.approx(values.std(ddof=1))
+        for q in (10, 50, 90):
+            assert metrics[(2, f"glucose_p{q}")] == pytest.approx(np.percentile(values, q))
+        assert metrics[(2, "glucose_tir")] == pytest.approx(100 * np.mean((values >= 70) & (values <= 180)))
+        assert (2, "weight_tir") not in metrics
+
+    def test_trend_is_slope_per_day(self):
+        from datetime import datetime, timedelta
+        from app.analytics.vectorized import compute_metrics, to_columns
+        start = datetime(2025, 7, 1)
+        rows = [(1, "weight", start + timedelta(days=d), 80 - 0.5 * d) for d in range(40)]
+        rows.append((1, "glucose", start, 100.0))
+        metrics = compute_metrics(to_columns(rows))
+        assert metrics[(1, "weight_trend_7d")] == pytest.approx(-0.5)
+        assert metrics[(1, "weight_trend_30d")] == pytest.approx(-0.5)
+        assert (1, "glucose_trend_7d") not in metrics     # a single reading has no trend
+
+    def test_jobs_use_engine_flag(self, monkeypatch):
+        from app.analytics.run_hourly_analytics import run_hourly_analytics
+        from app.analytics.run_hourly_analytics_v2 import run_hourly_analytics_v2
+        from app.core.config import settings
+        monkeypatch.setattr(settings, "ANALYTICS_ENGINE", "numpy")
+        for minute, value in ((0, 60), (20, 100), (40, 200)):
+            client.post("/api/v1/biometrics", json={
+                "patient_id": 980, "timestamp": f"2025-07-02T08:{minute:02d}:00", "type": "glucose", "value": value,
+            })
+
+        run_hourly_analytics()
+        run_hourly_analytics_v2()
+        db = SessionLocal()
+        rows = db.query(Analytics.metric_name, Analytics.value).filter_by(patient_id=980).all()
+        db.close()
+        # one row per job; the incremental job computes percentiles exactly from its trailing window
+        for name, expected in (("glucose_p50", 100), ("glucose_tir", 100 / 3), ("glucose_max", 200)):
+            assert [v for n, v in rows if n == name] == [pytest.approx(expected)] * 2
+        assert {n for n, _ in rows} >= {"glucose_std", "glucose_trend_7d"}
+
+
+class TestQuantileSketch:
+    def _exact(self, values, q):
+        ordered = sorted(values)
+        return ordered[int(q * (len(ordered) - 1))]
+
+    def test_relative_error_bound_and_merge(self):
+        import random
+        from app.analytics.sketch import QuantileSketch, RELATIVE_ACCURACY
+        rng = random.Random(3)
+        values = [rng.lognormvariate(4.5, 0.4) for _ in range(5000)]
+        halves = QuantileSketch.of(values[:2500]).merge(QuantileSketch.of(values[2500:]))
+        restored = QuantileSketch.from_bytes(halves.to_bytes())
+        assert restored.count == 5000
+        for q in (0.01, 0.5, 0.95, 0.99):
+            exact = self._exact(values, q)
+            assert abs(restored.quantile(q) - exact) <= RELATIVE_ACCURACY * exact
+        assert len(restored.to_bytes()) < 4096
+
+    def test_quantiles_endpoint_merges_hourly_sketches(self):
+        readings = [
+            {"patient_id": 990, "timestamp": f"2025-08-01T{hour:02d}:{minute:02d}:00", "type": "systolic", "value": value}
+            for hour, values in ((8, range(100, 160)), (9, range(160, 220)))
+            for minute, value in enumerate(values)
+        ]
+        assert client.post("/api/v1/biometrics:batch", json=readings).json()["accepted"] == 120
+
+        data = client.get("/api/v1/analytics/quantiles?patient_id=990&type=systolic&q=0.5,0.95").json()
+        assert data["count"] == 120
+        for (q, exact), point in zip(((0.5, 159), (0.95, 213)), data["quantiles"]):
+            assert point["q"] == q and abs(point["value"] - exact) <= 0.01 * exact
+
+        first_hour = client.get(
+            "/api/v1/analytics/quantiles?patient_id=990&type=systolic&q=1&from=2025-08-01T08:00:00&to=2025-08-01T09:00:00"
+        ).json()
+        assert first_hour["count"] == 60 and abs(first_hour["quantiles"][0]["value"] - 159) <= 1.59
+
+        # an update rebuilds the hour's sketch exactly
+        client.post("/api/v1/biometrics", json={**readings[0], "value": 400})
+        apply_deferred_rollups()
+        top = client.get("/api/v1/analytics/quantiles?patient_id=990&type=systolic&q=1").json()
+        assert top["count"] == 120 and abs(top["quantiles"][0]["value"] - 400) <= 4
+
+    def test_rejects_bad_quantile(self):
+        assert client.get("/api/v1/analytics/quantiles?patient_id=990&type=systolic&q=1.5").status_code == 400
+
+
+class TestScheduler:
+    @pytest.fixture(autouse=True)
+    def runs(self, monkeypatch):
+        from datetime import datetime
+        from app.analytics import scheduler
+        from app.db.models import JobLease, JobRun
+
+        def clean():
+            db = SessionLocal()
+            db.query(JobRun).delete()
+            db.query(JobLease).delete()
+            db.commit()
+            db.close()
+
+        clean()
+        slots = []
+        monkeypatch.setattr(scheduler, "analytics_job", lambda: lambda computed_at, on_commit=None: slots.append(computed_at))
+        monkeypatch.setattr(scheduler.settings, "ANALYTICS_CRON_SCHEDULE", "0 * * * *")
+        self.scheduler, self.slots, self.at = scheduler, slots, lambda h, m=0: datetime(2025, 9, 1, h, m)
+        yield
+        clean()
+
+    def test_fire_times(self):
+        times = self.scheduler.fire_times(self.scheduler.cron_trigger("*/30 * * * *"), self.at(8), self.at(9, 10))
+        assert times == [self.at(8, 30), self.at(9)]
+
+    def test_runs_each_slot_once_and_catches_up_in_order(self):
+        assert self.scheduler.run_due(self.at(8, 5), owner="a") == 1
+        assert self.slots == [self.at(8)]
+        assert self.scheduler.run_due(self.at(8, 30), owner="b") == 0      # slot already taken
+
+        # catch-up: one run for the newest missed slot covers the older ones
+        assert self.scheduler.run_due(self.at(11, 1), owner="b") == 1
+        assert self.slots == [self.at(8), self.at(11)]
+        assert self.scheduler.run_due(self.at(11, 30), owner="a") == 0
+
+        runs = client.get("/api/v1/analytics/jobs").json()["runs"]
+        assert [(r["scheduled_for"][11:16], r["status"]) for r in runs] == [
+            ("11:00", "ok"), ("10:00", "skipped"), ("09:00", "skipped"), ("08:00", "ok"),
+        ]
+        assert runs[0]["owner"] == "b" and runs[0]["lag_seconds"] > 0 and runs[0]["duration_seconds"] >= 0
+        assert runs[1]["note"].startswith("covered by the 2025-09-01 11:00 run") and runs[0]["note"] is None
+
+    def test_skips_while_another_worker_holds_the_lease(self):
+        from app.db.lease import acquire_lease
+        db = SessionLocal()
+        assert acquire_lease(db, self.scheduler.JOB_NAME, "other", 60)
+        db.close()
+        assert self.scheduler.run_due(self.at(8, 5), owner="a") == 0
+        assert self.slots == []
+
+    def test_failed_slot_is_retried(self, monkeypatch):
+        self.scheduler.run_due(self.at(8, 5), owner="a")
+
+        def fail(computed_at, on_commit=None):
+            raise RuntimeError("boom")
+        monkeypatch.setattr(self.scheduler, "analytics_job", lambda: fail)
+        assert self.scheduler.run_due(self.at(10, 5), owner="a") == 1
+        runs = client.get("/api/v1/analytics/jobs").json()["runs"]
+        assert [(r["scheduled_for"][11:16], r["status"]) for r in runs] == [("10:00", "failed"), ("08:00", "ok")]
+        assert "boom" in runs[0]["error"]
+
+        # nothing was skipped, so the next tick covers 09:00 and takes over the failed 10:00
+        monkeypatch.setattr(self.scheduler, "analytics_job", lambda: lambda computed_at, on_commit=None: self.slots.append(computed_at))
+        assert self.scheduler.run_due(self.at(10, 20), owner="b") == 1
+        assert self.slots == [self.at(8), self.at(10)]
+        runs = client.get("/api/v1/analytics/jobs").json()["runs"]
+        assert [(r["scheduled_for"][11:16], r["status"], r["error"]) for r in runs][:2] == [
+            ("10:00", "ok", None), ("09:00", "skipped", None),
+        ]
+
+    def test_run_renews_its_lease_and_stops_once_it_is_lost(self, monkeypatch):
+        from datetime import datetime
+        from app.db.lease import acquire_lease
+        from app.db.models import JobLease
+
+        def job(computed_at, on_commit=None):
+            on_commit()                                     # still ours: renewed
+            self.slots.append(computed_at)
+            db = SessionLocal()
+            db.query(JobLease).update({"expires_at": datetime(2000, 1, 1)})
+            db.commit()
+            assert acquire_lease(db, self.scheduler.JOB_NAME, "other", 60)
+            db.close()
+            on_commit()                                     # taken over: aborts the run
+            self.slots.append("unreachable")
+        monkeypatch.setattr(self.scheduler, "analytics_job", lambda: job)
+        assert self.scheduler.run_due(self.at(8, 5), owner="a") == 1
+        assert self.slots == [self.at(8)]
+        runs = client.get("/api/v1/analytics/jobs").json()["runs"]
+        assert runs[0]["status"] == "failed" and "LeaseLost" in runs[0]["error"]
+        db = SessionLocal()
+        assert db.query(JobLease.owner).filter(JobLease.name == self.scheduler.JOB_NAME).scalar() == "other"
+        db.close()
+
+    def test_job_follows_analytics_version(self, monkeypatch):
+        from app.analytics import scheduler
+        from app.analytics.run_hourly_analytics import run_hourly_analytics
+        from app.analytics.run_hourly_analytics_v2 import run_hourly_analytics_v2
+        monkeypatch.undo()
+        monkeypatch.setattr(scheduler.settings, "ANALYTICS_VERSION", "1")
+        assert scheduler.analytics_job() is run_hourly_analytics
+        monkeypatch.setattr(scheduler.settings, "ANALYTICS_VERSION", "2")
+        assert scheduler.analytics_job() is run_hourly_analytics_v2
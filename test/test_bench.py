@@ -0,0 +1,74 @@
+import asyncio
+import json
+from datetime import datetime
+import httpx
+from app.main import app
+from bench.generate import api_readings, generate, readings
+from bench.load import Request, endpoint, generate_mix, parse_mix, read_log, run_load, summarize
+from app.etl.transform import read_reading_file
+
+class TestGenerator:
+    def test_same_seed_same_files(self, tmp_path):
+        first = [p.read_bytes() for p in generate(tmp_path / "a", 5, 500, seed=7)]
+        second = [p.read_bytes() for p in generate(tmp_path / "b", 5, 500, seed=7)]
+        other = [p.read_bytes() for p in generate(tmp_path / "c", 5, 500, seed=8)]
+        assert first == second
+        assert first[1] != other[1]
+
+    def test_rows_spread_over_patients_in_time_order(self):
+        rows = list(readings(3, 10))
+        assert len(rows) == 10
+        by_patient = {}
+        for row in rows:
+            by_patient.setdefault(row[0], []).append(datetime.fromisoformat(row[1]))
+        assert sorted(len(ts) for ts in by_patient.values()) == [3, 3, 4]
+        assert all(ts == sorted(ts) for ts in by_patient.values())
+
+    def test_files_load_through_the_etl_transform(self, tmp_path):
+        _, path = generate(tmp_path, 4, 200)
+        parsed = list(read_reading_file(path))
+        assert {typ for _, _, typ, _ in parsed} == {"glucose", "systolic", "diastolic", "weight"}
+        assert len(parsed) == sum(1 for _ in api_readings(4, 200))
+
+
+class TestLoadHarness:
+    def test_read_log_skips_non_http_lines(self, tmp_path):
+        log = tmp_path / "requests.jsonl"
+        log.write_text("\n".join([
+            json.dumps({"method": "get", "path": "/api/v1/patients?page=2"}),
+            json.dumps({"request_id": "user-001", "title": "Not a request", "body": "..."}),
+            "not json",
+            "",
+            json.dumps({"method": "POST", "path": "/api/v1/biometrics", "body": {"value": 1}}),
+        ]))
+        requests, skipped = read_log(log)
+        assert skipped == 2
+        assert requests == [
+            Request("GET", "/api/v1/patients?page=2"),
+            Request("POST", "/api/v1/biometrics", {"value": 1}),
+        ]
+
+    def test_endpoint_names_collapse_ids_and_queries(self):
+        assert endpoint(Request("DELETE", "/api/v1/biometrics/42")) == "DELETE /api/v1/biometrics/{id}"
+        assert endpoint(Request("GET", "/api/v1/patients/7/live-stats?x=1")) == "GET /api/v1/patients/{id}/live-stats"
+
+    def test_mix_follows_weights(self):
+        mix = generate_mix(parse_mix("history=3,post=1"), [1, 2, 3], seed=1)
+        names = [endpoint(next(mix)) for _ in range(400)]
+        assert set(names) == {"GET /api/v1/biometrics", "POST /api/v1/biometrics"}
+        assert 250 < names.count("GET /api/v1/biometrics") < 350
+
+    def test_run_in_process_reports_per_endpoint(self):
+        async def go():
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://app") as client:
+                requests = [Request("GET", "/healthz")] * 20 + [Request("GET", "/nope")] * 5
+                return await run_load(client, requests, concurrency=4)
+
+        samples, elapsed = asyncio.run(go())
+        report = summarize(samples, elapsed)
+        assert report["total"]["requests"] == 25
+        assert report["endpoints"]["GET /healthz"]["error_rate"] == 0
+        assert report["endpoints"]["GET /nope"]["error_rate"] == 1
+        assert report["endpoints"]["GET /nope"]["statuses"] == {"404": 5}
+        assert {"p50_ms", "p95_ms", "p99_ms", "throughput_rps"} <= set(report["total"])
@@ -1,7 +1,7 @@
 import pytest
 from fastapi.testclient import TestClient
 from app.main import app
-from app.db.session import engine
+from app.db.session import engine, SessionLocal
 from app.db.models import Base
 
 @pytest.fixture(scope="session", autouse=True)
@@ -11,6 +11,18 @@ def setup_database():
     Base.metadata.drop_all(bind=engine)
 
 client = TestClient(app)
+
+
+def apply_deferred_rollups():
+    """Recompute the hours single POSTs deferred, as the next analytics run does first."""
+    from app.analytics.rollups import apply_deferred
+    db = SessionLocal()
+    try:
+        apply_deferred(db, 1000)
+    finally:
+        db.close()
+
+
 class TestBiometricsAPI:
     def test_get_biometric_history_empty(self):
         response = client.get("/api/v1/biometrics?patient_id=1&page=1&size=10")
@@ -61,4 +73,506 @@ class TestBiometricsAPI:
         # Ensure it's deleted
         response = client.get("/api/v1/biometrics?patient_id=2")
         assert response.status_code == 200
-        assert response.json()["total"] == 0
\ No newline at end of file
+        assert response.json()["total"] == 0
+
+    def test_batch_upsert_json_array(self):
+        payload = [
+            {"patient_id": 3, "timestamp": "2024-06-01T08:00:00", "type": "glucose", "value": 90},
+            {"patient_id": 3, "timestamp": "2024-06-01T09:00:00", "type": "weight", "value": 70.5},
+            {"patient_id": 3, "timestamp": "2024-06-01T10:00:00", "type": "heart_rate", "value": 60},
+            {"patient_id": 3, "timestamp": "not-a-date", "type": "glucose", "value": 1},
+        ]
+        response = client.post("/api/v1/biometrics:batch", json=payload)
+        assert response.status_code == 200
+        data = response.json()
+        assert data["accepted"] == 2
+        assert data["rejected"] == 2
+        assert [item["status"] for item in data["items"]] == ["ok", "ok", "error", "error"]
+
+        # Re-sending a key updates the stored value instead of duplicating it
+        payload[0]["value"] = 95
+        response = client.post("/api/v1/biometrics:batch", json=payload[:1])
+        assert response.json()["accepted"] == 1
+
+        response = client.get("/api/v1/biometrics?patient_id=3&type=glucose")
+        data = response.json()
+        assert data["total"] == 1
+        assert data["items"][0]["value"] == 95
+
+    def test_batch_upsert_ndjson(self):
+        lines = "\n".join(
+            f'{{"patient_id": 4, "timestamp": "2024-06-01T{h:02d}:00:00", "type": "systolic", "value": {110 + h}}}'
+            for h in range(5)
+        )
+        response = client.post(
+            "/api/v1/biometrics:batch",
+            content=lines,
+            headers={"Content-Type": "application/x-ndjson"},
+        )
+        assert response.status_code == 200
+        assert response.json()["accepted"] == 5
+        assert client.get("/api/v1/biometrics?patient_id=4").json()["total"] == 5
+
+    def test_cursor_pagination_matches_pages(self):
+        payload = [
+            {"patient_id": 5, "timestamp": f"2024-06-0{d}T08:00:00", "type": t, "value": 100 + d}
+            for d in range(1, 5) for t in ("glucose", "weight")
+        ]
+        assert client.post("/api/v1/biometrics:batch", json=payload).json()["accepted"] == 8
+
+        paged = []
+        for page in (1, 2, 3):
+            paged += client.get(f"/api/v1/biometrics?patient_id=5&page={page}&size=3").json()["items"]
+
+        first = client.get("/api/v1/biometrics?patient_id=5&size=3").json()
+        assert first["total"] == 8
+        assert first["prev_cursor"] is None
+        walked, pages, data = list(first["items"]), [first], first
+        while data["next_cursor"]:
+            data = client.get(f"/api/v1/biometrics?patient_id=5&size=3&cursor={data['next_cursor']}").json()
+            assert data["page"] is None and data["total"] is None
+            walked += data["items"]
+            pages.append(data)
+        assert [i["id"] for i in walked] == [i["id"] for i in paged]
+        assert len(pages) == 3
+
+        # ...and back again
+        back = client.get(f"/api/v1/biometrics?patient_id=5&size=3&cursor={pages[-1]['prev_cursor']}").json()
+        assert back["items"] == pages[1]["items"]
+
+    def test_invalid_cursor(self):
+        response = client.get("/api/v1/biometrics?patient_id=5&cursor=garbage")
+        assert response.status_code == 400
+
+    def test_series_reads_rollups(self):
+        payload = [
+            {"patient_id": 8, "timestamp": f"2024-0{m}-{d:02d}T{h:02d}:30:00", "type": "glucose", "value": 100 + h}
+            for m in (1, 2) for d in (1, 2) for h in (6, 18)
+        ]
+        assert client.post("/api/v1/biometrics:batch", json=payload).json()["accepted"] == 8
+
+        daily = client.get("/api/v1/biometrics/series?patient_id=8&type=glucose&bucket=day").json()
+        assert daily["resolution"] == "day"
+        assert [(p["start"][:10], p["count"], p["avg"]) for p in daily["points"]] == [
+            ("2024-01-01", 2, 112), ("2024-01-02", 2, 112), ("2024-02-01", 2, 112), ("2024-02-02", 2, 112),
+        ]
+
+        monthly = client.get(
+            "/api/v1/biometrics/series?patient_id=8&type=glucose&bucket=1M&from=2024-02-01T00:00:00"
+        ).json()
+        assert monthly["resolution"] == "month"
+        assert [(p["count"], p["min"], p["max"]) for p in monthly["points"]] == [(4, 106, 118)]
+
+        six_hourly = client.get("/api/v1/biometrics/series?patient_id=8&type=glucose&bucket=12h&to=2024-01-02T00:00:00").json()
+        assert six_hourly["resolution"] == "hour"
+        assert [p["start"] for p in six_hourly["points"]] == ["2024-01-01T00:00:00", "2024-01-01T12:00:00"]
+
+        # updates and deletes are reflected exactly, not just added on top
+        update = {"patient_id": 8, "timestamp": "2024-01-01T06:30:00", "type": "glucose", "value": 50}
+        biometric_id = client.post("/api/v1/biometrics", json=update).json()["id"]
+        apply_deferred_rollups()
+        point = client.get("/api/v1/biometrics/series?patient_id=8&type=glucose&bucket=month").json()["points"][0]
+        assert (point["count"], point["min"]) == (4, 50)
+
+        client.delete(f"/api/v1/biometrics/{biometric_id}")
+        point = client.get("/api/v1/biometrics/series?patient_id=8&type=glucose&bucket=month").json()["points"][0]
+        assert (point["count"], point["min"]) == (3, 106)
+
+    def test_batch_updates_recompute_every_touched_bucket(self):
+        payload = [
+            {"patient_id": 62, "timestamp": f"2024-03-{d:02d}T{h:02d}:15:00", "type": "glucose", "value": 100}
+            for d in (1, 2) for h in (8, 20)
+        ]
+        client.post("/api/v1/biometrics:batch", json=payload)
+
+        # one batch rewrites readings in four hours over two days at once
+        client.post("/api/v1/biometrics:batch", json=[{**row, "value": 80 + i} for i, row in enumerate(payload)])
+        daily = client.get("/api/v1/biometrics/series?patient_id=62&type=glucose&bucket=day").json()["points"]
+        assert [(p["count"], p["min"], p["max"]) for p in daily] == [(2, 80, 81), (2, 82, 83)]
+        monthly = client.get("/api/v1/biometrics/series?patient_id=62&type=glucose&bucket=month").json()["points"]
+        assert [(p["count"], p["min"], p["max"]) for p in monthly] == [(4, 80, 83)]
+
+        # points are bucket-aligned: the day containing ``from`` is returned whole
+        aligned = client.get(
+            "/api/v1/biometrics/series?patient_id=62&type=glucose&bucket=day&from=2024-03-01T12:00:00"
+        ).json()["points"]
+        assert [(p["start"][:10], p["count"]) for p in aligned] == [("2024-03-01", 2), ("2024-03-02", 2)]
+
+    def test_series_rejects_bad_bucket(self):
+        response = client.get("/api/v1/biometrics/series?patient_id=8&type=glucose&bucket=3x")
+        assert response.status_code == 400
+
+    def test_fast_path_matches_response_model(self):
+        from app.db.session import SessionLocal
+        from app.db.models import Biometric
+        from app.schemas.pydantic_models import BiometricOut
+        client.post("/api/v1/biometrics", json={"patient_id": 9, "timestamp": "2024-09-01T07:15:30.250000", "type": "diastolic", "value": 79})
+
+        item = client.get("/api/v1/biometrics?patient_id=9").json()["items"][0]
+        db = SessionLocal()
+        expected = BiometricOut.model_validate(db.query(Biometric).filter_by(patient_id=9).one(), from_attributes=True).model_dump(mode="json")
+        db.close()
+        assert item == expected
+        assert list(item) == list(expected)
+
+    def test_field_projection(self):
+        data = client.get("/api/v1/biometrics?patient_id=5&fields=value,timestamp&size=3").json()
+        assert all(list(item) == ["value", "timestamp"] for item in data["items"])
+        assert data["next_cursor"]      # cursor still works without id in the projection
+        assert client.get("/api/v1/biometrics?patient_id=5&fields=nope").status_code == 400
+
+
+class TestWriteBehind:
+    @pytest.fixture
+    def write_behind(self, monkeypatch):
+        from app.core.config import settings
+        from app.db.session import SessionLocal
+        from app.etl import write_behind
+        buffer = write_behind.WriteBehindBuffer(SessionLocal, max_batch=50, max_delay_ms=50)
+        monkeypatch.setattr(write_behind, "_buffer", buffer)
+        monkeypatch.setattr(settings, "WRITE_BEHIND_ENABLED", True)
+        yield buffer
+        buffer.shutdown()
+
+    def _payload(self, patient_id, minute):
+        return {"patient_id": patient_id, "timestamp": f"2024-07-01T10:{minute:02d}:00", "type": "glucose", "value": minute}
+
+    def test_concurrent_posts_are_group_committed(self, write_behind):
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=10) as pool:
+            responses = list(pool.map(lambda m: client.post("/api/v1/biometrics", json=self._payload(6, m)), range(40)))
+
+        assert all(r.status_code == 200 for r in responses)
+        assert len({r.json()["id"] for r in responses}) == 40
+        assert client.get("/api/v1/biometrics?patient_id=6").json()["total"] == 40
+        stats = client.get("/api/v1/biometrics/ingest/stats").json()
+        assert stats["flushed_rows"] == 40
+        assert stats["flushes"] < 40
+
+    def test_enqueue_durability_drains_on_shutdown(self, write_behind, monkeypatch):
+        from app.core.config import settings
+        monkeypatch.setattr(settings, "WRITE_BEHIND_DURABILITY", "enqueue")
+        for minute in range(10):
+            response = client.post("/api/v1/biometrics", json=self._payload(7, minute))
+            assert response.status_code == 202
+
+        write_behind.shutdown()
+        assert client.get("/api/v1/biometrics?patient_id=7").json()["total"] == 10
+
+    def test_submit_after_shutdown_is_rejected(self, write_behind):
+        from app.etl.write_behind import BufferClosed
+        write_behind.shutdown()
+        with pytest.raises(BufferClosed):
+            write_behind.submit(self._payload(7, 59))
+
+        response = client.post("/api/v1/biometrics", json=self._payload(7, 59))
+        assert response.status_code == 503
+
+
+class TestExport:
+    @pytest.fixture(autouse=True)
+    def readings(self):
+        payload = [
+            {"patient_id": pid, "timestamp": f"2024-08-0{d}T09:00:00", "type": "weight", "value": 70 + d}
+            for pid in (20, 21, 22) for d in range(1, 6)
+        ]
+        client.post("/api/v1/biometrics:batch", json=payload)
+
+    def test_export_ndjson_filters(self):
+        import json
+        response = client.get("/api/v1/biometrics/export?patient_ids=20,22&from=2024-08-02T00:00:00&to=2024-08-05T00:00:00")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        rows = [json.loads(line) for line in response.text.splitlines()]
+        assert [(r["patient_id"], r["timestamp"][:10]) for r in rows] == [
+            (pid, f"2024-08-0{d}") for pid in (20, 22) for d in (2, 3, 4)
+        ]
+        assert rows[0]["type"] == "weight"
+
+    def test_export_csv(self, monkeypatch):
+        from app.core.config import settings
+        monkeypatch.setattr(settings, "EXPORT_BATCH_SIZE", 4)     # several partitions
+        response = client.get("/api/v1/biometrics/export?patient_ids=21&format=csv")
+        lines = response.text.splitlines()
+        assert lines[0] == "id,patient_id,timestamp,type,value"
+        assert len(lines) == 6
+
+    def test_export_parquet(self, monkeypatch):
+        pq = pytest.importorskip("pyarrow.parquet")
+        import io
+        from app.core.config import settings
+        monkeypatch.setattr(settings, "EXPORT_BATCH_SIZE", 4)
+        response = client.get("/api/v1/biometrics/export?patient_ids=20&patient_ids=21&format=parquet")
+        table = pq.read_table(io.BytesIO(response.content))
+        assert table.num_rows == 10
+        assert pq.ParquetFile(io.BytesIO(response.content)).num_row_groups == 3
+
+    def test_export_rejects_unknown_format(self):
+        assert client.get("/api/v1/biometrics/export?format=xml").status_code == 400
+
+
+class TestAsyncDatabase:
+    @pytest.fixture(autouse=True)
+    def async_db(self, monkeypatch):
+        pytest.importorskip("aiosqlite")
+        from app.core.config import settings
+        import asyncio
+        from app.db.session import dispose_async_engine
+        monkeypatch.setattr(settings, "ASYNC_DB_ENABLED", True)
+        yield client
+        asyncio.run(dispose_async_engine())
+
+    def test_async_url(self):
+        from app.db.session import async_url
+        assert str(async_url("sqlite:///./test.db")) == "sqlite+aiosqlite:///./test.db"
+        assert str(async_url("postgresql://u:p@db/pulse")).startswith("postgresql+asyncpg://")
+
+    def test_endpoints_on_async_session(self, async_db):
+        reading = {"patient_id": 30, "timestamp": "2024-09-01T08:15:00", "type": "glucose", "value": 101}
+        created = async_db.post("/api/v1/biometrics", json=reading)
+        assert created.status_code == 200
+        assert async_db.post("/api/v1/biometrics:batch", json=[{**reading, "timestamp": "2024-09-01T08:45:00", "value": 99}]).json()["accepted"] == 1
+
+        history = async_db.get("/api/v1/biometrics?patient_id=30").json()
+        assert history["total"] == 2
+        apply_deferred_rollups()
+        series = async_db.get("/api/v1/biometrics/series?patient_id=30&type=glucose&bucket=hour").json()
+        assert [(p["count"], p["min"], p["max"]) for p in series["points"]] == [(2, 99, 101)]
+
+        assert async_db.delete(f"/api/v1/biometrics/{created.json()['id']}").json()["ok"] is True
+        assert async_db.get("/api/v1/biometrics?patient_id=30").json()["total"] == 1
+        assert async_db.get("/api/v1/patients?size=1").status_code == 200
+        assert async_db.get("/api/v1/analytics?patient_id=30").json() == []
+
+        from app.db import session
+        assert session._async_engine is not None and session._async_engine.pool.checkedout() == 0
+
+    def test_export_streams_from_async_session(self, async_db, monkeypatch):
+        import asyncio
+        import json
+        from app.api.export import _merge_sorted
+        from app.core.config import settings
+        monkeypatch.setattr(settings, "EXPORT_BATCH_SIZE", 2)
+        payload = [
+            {"patient_id": 31, "timestamp": f"2024-09-0{d}T08:00:00", "type": "weight", "value": 70 + d} for d in range(1, 6)
+        ]
+        async_db.post("/api/v1/biometrics:batch", json=payload)
+
+        rows = [json.loads(line) for line in async_db.get("/api/v1/biometrics/export?patient_ids=31").text.splitlines()]
+        assert [r["value"] for r in rows] == [71, 72, 73, 74, 75]
+        assert len(async_db.get("/api/v1/analytics/export?patient_ids=31&format=csv").text.splitlines()) == 1
+
+        async def merged():
+            async def hot():
+                for row in (1, 3, 5):
+                    yield row
+            return [row async for row in _merge_sorted(hot(), iter((2, 3, 6)), key=lambda r: r)]
+        assert asyncio.run(merged()) == [1, 2, 3, 3, 5, 6]
+
+
+class TestArchive:
+    @pytest.fixture(autouse=True)
+    def archive_dir(self, tmp_path, monkeypatch):
+        from app.core.config import settings
+        monkeypatch.setattr(settings, "ARCHIVE_DIR", str(tmp_path))
+        return tmp_path
+
+    def history(self, pid):
+        items, cursor = [], None
+        while True:
+            body = client.get(f"/api/v1/biometrics?patient_id={pid}&size=3" + (f"&cursor={cursor}" if cursor else "")).json()
+            items += body["items"]
+            cursor = body["next_cursor"]
+            if not cursor:
+                return items
+
+    def test_partition_round_trip_and_pruning(self, archive_dir):
+        from datetime import datetime
+        from app.db import archive
+        from app.db.models import BiometricType
+        rows = [
+            archive.Reading(1, 7, datetime(2019, 1, 2, 3, 4, 5, 6), BiometricType.glucose, 99.5, None, None),
+            archive.Reading(2, 7, datetime(2019, 1, 1), BiometricType.weight, 70.0, -1.5, True),
+            archive.Reading(3, 8, datetime(2019, 1, 9), BiometricType.systolic, 120.0, 0.2, False),
+        ]
+        assert archive.write_partition(archive.partition_path(datetime(2019, 1, 1)), rows) == 3
+        assert list(archive.read_rows()) == [rows[1], rows[0], rows[2]]
+        assert list(archive.read_rows([8])) == [rows[2]]
+        assert list(archive.read_rows(start=datetime(2019, 1, 2), end=datetime(2019, 1, 3))) == [rows[0]]
+        assert list(archive.read_rows([7], types=["weight"])) == [rows[1]]
+        assert list(archive.read_rows(start=datetime(2019, 2, 1))) == []
+        assert archive.horizon() == datetime(2019, 2, 1)
+
+    def test_archived_readings_stay_readable(self, archive_dir):
+        from datetime import datetime
+        from app.db.archive import archive_before
+        from app.db.models import Biometric
+        from app.db.session import SessionLocal
+        payload = [
+            {"patient_id": 60, "timestamp": f"2019-0{m}-0{d}T0{h}:30:00", "type": "glucose", "value": 90 + 10 * m + d + h}
+            for m in (1, 2, 3) for d in (1, 2) for h in (1, 2)
+        ]
+        assert client.post("/api/v1/biometrics:batch", json=payload).json()["accepted"] == 12
+        before = self.history(60)
+        series = client.get("/api/v1/biometrics/series?patient_id=60&type=glucose&bucket=1M").json()["points"]
+        export = client.get("/api/v1/biometrics/export?patient_ids=60").text
+
+        summary = archive_before(datetime(2019, 3, 15))
+        assert summary["months"] == ["2019-01", "2019-02"] and summary["archived"] == 8
+        assert sorted(p.name for p in archive_dir.iterdir()) == ["2019-01.bin", "2019-02.bin"]
+        with SessionLocal() as session:
+            assert session.query(Biometric).filter(Biometric.patient_id == 60).count() == 4
+
+        assert self.history(60) == before
+        page = client.get("/api/v1/biometrics?patient_id=60&page=3&size=4").json()
+        assert page["total"] == 12 and page["items"] == before[8:]
+        assert client.get("/api/v1/biometrics?patient_id=60&type=weight").json()["total"] == 0
+        assert client.get("/api/v1/biometrics/export?patient_ids=60").text == export
+        ranged = client.get("/api/v1/biometrics/export?patient_ids=60&from=2019-02-02T00:00:00&to=2019-03-02T00:00:00")
+        assert len(ranged.text.splitlines()) == 4
+        assert client.get("/api/v1/biometrics/series?patient_id=60&type=glucose&bucket=1M").json()["points"] == series
+
+    def test_upsert_of_archived_reading(self, archive_dir):
+        from datetime import datetime
+        from app.db.archive import archive_before
+        reading = {"patient_id": 61, "timestamp": "2019-01-05T10:00:00", "type": "weight", "value": 80}
+        client.post("/api/v1/biometrics:batch", json=[reading, {**reading, "timestamp": "2019-01-05T10:20:00", "value": 82}])
+        archive_before(datetime(2019, 2, 1))
+
+        assert client.post("/api/v1/biometrics", json={**reading, "value": 90}).status_code == 200
+        items = self.history(61)
+        assert [i["value"] for i in items] == [82, 90]
+        apply_deferred_rollups()
+        hour = client.get("/api/v1/biometrics/series?patient_id=61&type=weight&bucket=hour").json()["points"]
+        assert [(p["count"], p["min"], p["max"]) for p in hour] == [(2, 82, 90)]
+
+        archive_before(datetime(2019, 2, 1))           # folds the hot row into the partition
+        assert [i["value"] for i in self.history(61)] == [82, 90]
+        assert client.post("/api/v1/biometrics:batch", json=[reading]).json()["accepted"] == 1
+        hour = client.get("/api/v1/biometrics/series?patient_id=61&type=weight&bucket=hour").json()["points"]
+        assert [(p["count"], p["min"], p["max"]) for p in hour] == [(2, 80, 82)]
+
+
+    def test_history_total_comes_from_the_partition_index(self, archive_dir, monkeypatch):
+        from datetime import datetime
+        from app.db import archive
+        payload = [
+            {"patient_id": 65, "timestamp": f"2019-0{m}-0{d}T08:00:00", "type": typ, "value": 70 + m + d}
+            for m in (1, 2) for d in (1, 2, 3) for typ in ("weight", "glucose")
+        ]
+        client.post("/api/v1/biometrics:batch", json=payload)
+        archive.archive_before(datetime(2019, 3, 1))
+
+        read = archive.Partition.read
+        monkeypatch.setattr(archive.Partition, "read", lambda *a, **k: pytest.fail("total decoded a block"))
+        with SessionLocal() as session:
+            assert archive.count_rows(session, 65) == 12
+            assert archive.count_rows(session, 65, ["weight"]) == 6
+            assert archive.count_rows(session, 66) == 0
+
+        monkeypatch.setattr(archive.Partition, "read", read)
+        client.post("/api/v1/biometrics", json={**payload[0], "value": 90})      # shadows an archived reading
+        client.post("/api/v1/biometrics", json={**payload[0], "timestamp": "2019-01-04T08:00:00"})     # new, hot
+        assert client.get("/api/v1/biometrics?patient_id=65").json()["total"] == 13
+        assert client.get("/api/v1/biometrics?patient_id=65&type=glucose").json()["total"] == 6
+
+    def test_history_page_reads_only_the_months_it_spans(self, archive_dir, monkeypatch):
+        from datetime import datetime
+        from app.db import archive
+        payload = [
+            {"patient_id": 63, "timestamp": f"2019-0{m}-0{d}T08:00:00", "type": "glucose", "value": 100 + 10 * m + d}
+            for m in (1, 2, 3) for d in (1, 2, 3)
+        ]
+        client.post("/api/v1/biometrics:batch", json=payload)
+        archive.archive_before(datetime(2019, 4, 1))
+
+        decoded = []
+        read = archive.Partition.read
+        monkeypatch.setattr(archive.Partition, "read", lambda p, *a, **k: decoded.append(p.month.month) or read(p, *a, **k))
+        first = client.get("/api/v1/biometrics?patient_id=63&size=2&include_total=false").json()
+        assert [i["value"] for i in first["items"]] == [133, 132] and decoded == [3]
+
+        decoded.clear()
+        second = client.get(f"/api/v1/biometrics?patient_id=63&size=2&cursor={first['next_cursor']}").json()
+        assert [i["value"] for i in second["items"]] == [131, 123] and decoded == [3, 2]
+
+    def test_reading_updated_while_archiving_stays_hot(self, archive_dir, monkeypatch):
+        from datetime import datetime
+        from app.db import archive
+        from app.db.models import Biometric
+        from app.db.session import SessionLocal
+        reading = {"patient_id": 64, "timestamp": "2019-01-07T09:00:00", "type": "weight", "value": 80}
+        client.post("/api/v1/biometrics:batch", json=[reading, {**reading, "timestamp": "2019-01-08T09:00:00", "value": 81}])
+
+        write_blocks = archive.write_blocks
+
+        def write_then_update(*args):
+            written = write_blocks(*args)
+            client.post("/api/v1/biometrics", json={**reading, "value": 85})     # lands between write and delete
+            return written
+
+        monkeypatch.setattr(archive, "write_blocks", write_then_update)
+        assert archive.archive_before(datetime(2019, 2, 1))["archived"] == 1
+        with SessionLocal() as session:
+            assert session.query(Biometric.value).filter(Biometric.patient_id == 64).all() == [(85,)]
+        assert [i["value"] for i in self.history(64)] == [81, 85]
+
+class TestSqliteProfile:
+    @pytest.fixture(autouse=True)
+    def profile(self):
+        from app.db.session import read_engine
+        if read_engine is engine:
+            pytest.skip("SQLite profile not active for this DATABASE_URL")
+
+    def test_pragmas(self):
+        from sqlalchemy import text
+        from sqlalchemy.exc import OperationalError
+        from app.db.session import read_engine
+        with engine.connect() as conn:
+            assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+            assert conn.execute(text("PRAGMA synchronous")).scalar() == 1          # NORMAL
+            assert conn.execute(text("PRAGMA temp_store")).scalar() == 2           # MEMORY
+        with read_engine.connect() as conn:
+            assert conn.execute(text("PRAGMA query_only")).scalar() == 1
+            with pytest.raises(OperationalError):
+                conn.execute(text("DELETE FROM biometrics"))
+
+    def test_reads_do_not_wait_for_the_writer(self):
+        import time
+        from datetime import datetime
+        from app.db.models import Biometric
+        from app.db.session import SessionLocal
+        writer = SessionLocal()
+        try:
+            writer.add(Biometric(patient_id=70, timestamp=datetime(2024, 11, 1), type="glucose", value=90))
+            writer.flush()                                  # holds the write lock, uncommitted
+            start = time.perf_counter()
+            response = client.get("/api/v1/biometrics?patient_id=70")
+            assert time.perf_counter() - start < 1
+            assert response.json()["total"] == 0
+            writer.commit()
+        finally:
+            writer.close()
+        assert client.get("/api/v1/biometrics?patient_id=70").json()["total"] == 1
+
+    def test_writers_are_served_in_arrival_order(self):
+        import threading
+        import time
+        from app.db.session import FifoLock
+        lock, order, threads = FifoLock(), [], []
+        lock.acquire()
+        for i in range(5):
+            def wait(i=i):
+                lock.acquire()
+                order.append(i)
+                lock.release()
+            threads.append(threading.Thread(target=wait))
+            threads[-1].start()
+            while lock.waiting < i + 1:
+                time.sleep(0.001)
+        lock.release()
+        for t in threads:
+            t.join()
+        assert order == [0, 1, 2, 3, 4]
+        assert lock.acquire(timeout=0)
+        assert not lock.acquire(timeout=0.01)
@@ -0,0 +1,142 @@
+import pytest
+from datetime import date
+from fastapi.testclient import TestClient
+from app.main import app
+from app.db.session import engine, SessionLocal
+from app.db.models import Base, Patient
+
+@pytest.fixture(scope="session", autouse=True)
+def setup_database():
+    Base.metadata.create_all(bind=engine)
+    yield
+    Base.metadata.drop_all(bind=engine)
+
+client = TestClient(app)
+
+
+def apply_deferred_rollups():
+    """Recompute the hours single POSTs deferred, as the next analytics run does first."""
+    from app.analytics.rollups import apply_deferred
+    db = SessionLocal()
+    try:
+        apply_deferred(db, 1000)
+    finally:
+        db.close()
+
+
+URL = "/api/v1/cohorts/stats?type=glucose&from=2024-11-05T00:00:00&to=2024-11-06T00:00:00"
+
+
+class TestCohortStats:
+    @pytest.fixture(autouse=True)
+    def population(self):
+        db = SessionLocal()
+        patients = {
+            email: db.query(Patient).filter_by(email=email).one_or_none()
+            or Patient(name=email, dob=dob, gender=gender, email=email)
+            for email, dob, gender in (
+                ("cohort-f54@example.com", date(1970, 6, 1), "female"),
+                ("cohort-f34@example.com", date(1990, 1, 1), "female"),
+                ("cohort-m56@example.com", date(1968, 3, 1), "male"),
+            )
+        }
+        db.add_all(patients.values())
+        db.commit()
+        self.ids = {email: p.id for email, p in patients.items()}
+        db.close()
+
+        readings = [
+            {"patient_id": self.ids[email], "timestamp": f"2024-11-05T0{hour}:00:00", "type": "glucose", "value": value}
+            for email, values in (
+                ("cohort-f54@example.com", (110, 130)),
+                ("cohort-f34@example.com", (90, 94)),
+                ("cohort-m56@example.com", (150, 170)),
+            )
+            for hour, value in enumerate(values)
+        ]
+        client.post("/api/v1/biometrics:batch", json=readings)
+
+    def test_filters_by_gender_and_age(self):
+        data = client.get(URL + "&gender=female&age_min=50&age_max=59").json()
+        assert data["groups"] == [{"count": 2, "min": 110, "max": 130, "avg": 120}]
+
+    def test_group_by_band_and_gender(self):
+        groups = client.get(URL + "&group_by=age_band,gender").json()["groups"]
+        assert [(g["age_band"], g["gender"], g["avg"]) for g in groups] == [
+            ("30-39", "female", 92), ("50-59", "female", 120), ("50-59", "male", 160),
+        ]
+
+    def test_updates_and_demographic_changes_are_reflected(self):
+        from app.analytics.cohorts import rebuild_patient_cohorts
+        pid = self.ids["cohort-f54@example.com"]
+        client.post("/api/v1/biometrics", json={"patient_id": pid, "timestamp": "2024-11-05T00:00:00", "type": "glucose", "value": 150})
+        apply_deferred_rollups()
+        assert client.get(URL + "&gender=female&age_min=50&age_max=59").json()["groups"][0]["avg"] == 140
+
+        db = SessionLocal()
+        db.get(Patient, pid).dob = date(1985, 6, 1)
+        rebuild_patient_cohorts(db, [pid])
+        db.commit()
+        db.close()
+        groups = client.get(URL + "&gender=female&group_by=age_band").json()["groups"]
+        assert [(g["age_band"], g["count"]) for g in groups] == [("30-39", 4)]
+
+    def test_age_range_selects_only_bands_inside_it(self):
+        db = SessionLocal()
+        patients = [
+            db.query(Patient).filter_by(email=email).one_or_none()
+            or Patient(name=email, dob=dob, gender="female", email=email)
+            for email, dob in (("cohort-f55@example.com", date(1969, 1, 1)), ("cohort-f62@example.com", date(1962, 1, 1)))
+        ]
+        db.add_all(patients)
+        db.commit()
+        ids = [p.id for p in patients]
+        db.close()
+        client.post("/api/v1/biometrics:batch", json=[
+            {"patient_id": pid, "timestamp": "2024-11-07T00:00:00", "type": "glucose", "value": value}
+            for pid, value in zip(ids, (100, 200))
+        ])
+        day = "/api/v1/cohorts/stats?type=glucose&from=2024-11-07T00:00:00&to=2024-11-08T00:00:00&gender=female"
+
+        assert client.get(day + "&age_min=50&age_max=60").json()["groups"] == [{"count": 1, "min": 100, "max": 100, "avg": 100}]
+        assert client.get(day + "&age_min=50&age_max=69").json()["groups"][0]["count"] == 2
+        assert client.get(day + "&age_min=55&age_max=69").json()["groups"][0]["avg"] == 200
+
+    def test_rejects_unknown_group(self):
+        assert client.get(URL + "&group_by=zip").status_code == 400
+
+
+class TestIncrementalCohortUpdates:
+    DAY = "/api/v1/cohorts/stats?type=weight&from=2024-12-05T00:00:00&to=2024-12-06T00:00:00&gender=male&group_by=age_band"
+
+    def test_changes_move_only_the_touched_cell(self):
+        db = SessionLocal()
+        patients = [
+            Patient(name=f"inc-{i}", dob=date(1980, 1, 1), gender="male", email=f"cohort-inc-{i}@example.com")
+            for i in range(3)
+        ]
+        db.add_all(patients)
+        db.commit()
+        ids = [p.id for p in patients]
+        db.close()
+        readings = [
+            {"patient_id": pid, "timestamp": f"2024-12-05T0{hour}:00:00", "type": "weight", "value": value}
+            for pid, values in zip(ids, ((70, 72), (80, 90), (60, 100)))
+            for hour, value in enumerate(values)
+        ]
+        client.post("/api/v1/biometrics:batch", json=readings)
+        cell = client.get(self.DAY).json()["groups"]
+        assert [(g["count"], g["min"], g["max"]) for g in cell] == [(6, 60, 100)]
+
+        # replacing the cell's minimum and maximum re-derives them from the other patients
+        client.post("/api/v1/biometrics:batch", json=[
+            {**readings[4], "value": 75}, {**readings[5], "value": 76},
+        ])
+        cell = client.get(self.DAY).json()["groups"]
+        assert [(g["count"], g["min"], g["max"], g["avg"]) for g in cell] == [(6, 70, 90, pytest.approx(463 / 6))]
+
+        history = client.get(f"/api/v1/biometrics?patient_id={ids[1]}&type=weight").json()["items"]
+        for item in history:
+            client.delete(f"/api/v1/biometrics/{item['id']}")
+        cell = client.get(self.DAY).json()["groups"]
+        assert [(g["count"], g["min"], g["max"]) for g in cell] == [(4, 70, 76)]
@@ -0,0 +1,132 @@
+import pytest
+from datetime import date
+from app.analytics.compute import run_etl
+from app.db.session import engine, SessionLocal
+from app.db.models import Base, Biometric, IngestedFile, Patient
+from app.etl import directory
+from app.etl.extract import iter_readings
+from app.etl.transform import normalize_reading
+
+@pytest.fixture(scope="session", autouse=True)
+def setup_database():
+    Base.metadata.create_all(bind=engine)
+    yield
+    Base.metadata.drop_all(bind=engine)
+
+@pytest.fixture
+def clean_tables():
+    yield
+    db = SessionLocal()
+    db.query(Biometric).delete()
+    db.query(IngestedFile).delete()
+    db.query(Patient).delete()
+    db.commit()
+    db.close()
+
+class TestStreamingEtl:
+    def test_run_etl_loads_every_reading_once(self, clean_tables):
+        expected = sum(len(normalize_reading(raw)) for raw in iter_readings())
+        db = SessionLocal()
+        before = db.query(Biometric).count()
+        db.close()
+
+        run_etl(chunk_size=4)
+        run_etl(chunk_size=4)  # second run must not duplicate anything
+
+        db = SessionLocal()
+        assert db.query(Biometric).count() - before == expected
+        assert db.query(Patient).count() > 0
+        db.close()
+
+    def test_exclusive_run_renews_its_lease_per_chunk(self, clean_tables, monkeypatch):
+        from app.analytics import compute
+        from app.core.config import settings
+        renewals = []
+        acquire = compute.acquire_lease
+        monkeypatch.setattr(compute, "acquire_lease", lambda *args: renewals.append(args[1]) or acquire(*args))
+        monkeypatch.setattr(settings, "ETL_CHUNK_SIZE", 4)
+
+        assert compute.run_etl_exclusive(owner="etl-test") is not None
+        # the initial acquisition, then one renewal after the patients and after each readings chunk
+        assert renewals.count("etl") >= 3
+
+
+@pytest.fixture
+def incoming(tmp_path, clean_tables):
+    db = SessionLocal()
+    db.add(Patient(name="Ingest Test", email="ingest@example.com", dob=date(1980, 1, 1), gender="female"))
+    db.commit()
+    db.close()
+    for day in (1, 2, 3):
+        (tmp_path / f"readings-{day}.csv").write_text(
+            "patient_email,timestamp,glucose_mg_dL,weight_kg\n"
+            f"ingest@example.com,2025-03-0{day}T08:00:00,100,70\n"
+            f"ingest@example.com,2025-03-0{day}T20:00:00,120,\n"
+            f"unknown@example.com,2025-03-0{day}T20:00:00,90,\n"
+        )
+    return tmp_path
+
+def _ingest_count():
+    db = SessionLocal()
+    count = db.query(Biometric).join(Patient).filter(Patient.email == "ingest@example.com").count()
+    db.close()
+    return count
+
+class TestDirectoryIngest:
+    def test_second_run_skips_ingested_files(self, incoming):
+        first = directory.ingest_directory(incoming, workers=2)
+        assert first["discovered"] == 3 and first["ingested"] == 3 and first["skipped"] == 0
+        assert first["inserted"] == 9
+        assert _ingest_count() == 9
+
+        second = directory.ingest_directory(incoming, workers=2)
+        assert second["skipped"] == 3 and second["ingested"] == 0
+        assert _ingest_count() == 9
+
+    def test_changed_file_is_ingested_again(self, incoming):
+        directory.ingest_directory(incoming, workers=1)
+        with open(incoming / "readings-1.csv", "a") as f:
+            f.write("ingest@example.com,2025-03-01T22:00:00,130,\n")
+
+        rerun = directory.ingest_directory(incoming, workers=1)
+        assert rerun["ingested"] == 1 and rerun["skipped"] == 2
+        assert rerun["inserted"] == 1
+        assert _ingest_count() == 10
+
+    def test_unchanged_files_are_not_hashed(self, incoming, monkeypatch):
+        import os
+        from concurrent.futures import ThreadPoolExecutor
+        directory.ingest_directory(incoming, workers=1)
+        hashed = []
+        fingerprint = directory.fingerprint
+        monkeypatch.setattr(directory, "fingerprint", lambda path: hashed.append(path) or fingerprint(path))
+
+        touched = incoming / "readings-2.csv"
+        os.utime(touched, ns=(touched.stat().st_atime_ns, touched.stat().st_mtime_ns + 10**9))
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            rerun = directory.ingest_directory(incoming, executor=executor)
+            assert rerun["skipped"] == 3 and hashed == [str(touched)]
+
+            # the new mtime was recorded, so the next run hashes nothing
+            directory.ingest_directory(incoming, executor=executor)
+        assert hashed == [str(touched)]
+
+    def test_resumes_after_crash(self, incoming, monkeypatch):
+        write_file = directory._write_file
+        calls = []
+
+        def crash_on_second(session, *args):
+            calls.append(args[0])
+            if len(calls) == 2:
+                raise RuntimeError("writer died")
+            return write_file(session, *args)
+
+        monkeypatch.setattr(directory, "_write_file", crash_on_second)
+        with pytest.raises(RuntimeError):
+            directory.ingest_directory(incoming, workers=1)
+        monkeypatch.undo()
+        assert _ingest_count() == 3
+
+        resumed = directory.ingest_directory(incoming, workers=1)
+        assert resumed["skipped"] == 1 and resumed["ingested"] == 2
+        assert _ingest_count() == 9
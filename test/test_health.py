@@ -0,0 +1,136 @@
+import pytest
+from datetime import datetime, timedelta
+from fastapi.testclient import TestClient
+from app.main import app
+from app.api import health
+from app.core import metrics
+from app.db.lease import ETL_JOB, acquire_lease, last_finished, release_lease
+from app.db.models import Base, JobLease
+from app.db.session import engine, read_engine, SessionLocal
+
+client = TestClient(app)
+
+@pytest.fixture(scope="session", autouse=True)
+def setup_database():
+    Base.metadata.create_all(bind=engine)
+    yield
+    Base.metadata.drop_all(bind=engine)
+
+@pytest.fixture
+def db():
+    session = SessionLocal()
+    session.query(JobLease).delete()
+    session.commit()
+    yield session
+    session.query(JobLease).delete()
+    session.commit()
+    session.close()
+
+class TestJobLease:
+    def test_only_one_owner_at_a_time(self, db):
+        assert acquire_lease(db, "job", "a", 60)
+        assert acquire_lease(db, "job", "a", 60)          # renewing is fine
+        assert not acquire_lease(db, "job", "b", 60)
+        release_lease(db, "job", "a")
+        assert acquire_lease(db, "job", "b", 60)
+
+    def test_expired_lease_can_be_taken_over(self, db):
+        assert acquire_lease(db, "job", "a", 60)
+        db.query(JobLease).update({"expires_at": datetime.utcnow() - timedelta(seconds=1)})
+        db.commit()
+        assert acquire_lease(db, "job", "b", 60)
+
+    def test_release_records_finish_only_for_owner(self, db):
+        acquire_lease(db, "job", "a", 60)
+        release_lease(db, "job", "b", finished=True)
+        assert last_finished(db, "job") is None
+        release_lease(db, "job", "a", finished=True)
+        assert last_finished(db, "job") is not None
+
+class TestHealthEndpoints:
+    def test_healthz(self):
+        response = client.get("/healthz")
+        assert response.status_code == 200
+        assert response.json() == {"status": "ok"}
+
+    def test_readyz_waits_for_etl(self, db, monkeypatch):
+        monkeypatch.setattr(health, "_ready", False)
+        assert client.get("/readyz").status_code == 503
+
+        acquire_lease(db, ETL_JOB, "worker", 60)
+        assert client.get("/readyz").status_code == 503    # still running
+        release_lease(db, ETL_JOB, "worker", finished=True)
+
+        response = client.get("/readyz")
+        assert response.status_code == 200
+        assert response.json()["status"] == "ready"
+
+
+class TestMetrics:
+    @pytest.fixture
+    def enabled(self, monkeypatch):
+        monkeypatch.setattr(metrics.settings, "METRICS_ENABLED", True)
+        metrics.clear()
+        metrics.install_sql_hooks(engine)
+        metrics.install_sql_hooks(read_engine)
+        yield
+        metrics.remove_sql_hooks(engine)
+        metrics.remove_sql_hooks(read_engine)
+        metrics.clear()
+
+    def test_disabled_records_nothing(self):
+        metrics.clear()
+        client.get("/api/v1/patients")
+        with metrics.span("etl", "patients"):
+            pass
+        assert "_count" not in client.get("/metrics").text
+
+    def test_request_latency_and_query_counts(self, enabled):
+        assert client.get("/api/v1/patients").status_code == 200
+        response = client.get("/metrics")
+        assert response.headers["content-type"].startswith("text/plain")
+        text = response.text
+        assert 'http_request_duration_seconds_count{method="GET",route="/api/v1/patients",status="200"} 1' in text
+        assert 'http_request_duration_seconds_bucket{method="GET",route="/api/v1/patients",status="200",le="+Inf"} 1' in text
+        assert 'db_queries_per_request_count{route="/api/v1/patients"} 1' in text
+        assert metrics.DB_QUERY_LATENCY.count("SELECT") >= 2     # page + total
+
+    def test_slow_query_logged_with_plan(self, enabled, monkeypatch, caplog):
+        monkeypatch.setattr(metrics.settings, "METRICS_SLOW_QUERY_MS", 0)
+        with caplog.at_level("WARNING", logger="app.core.metrics"):
+            client.get("/api/v1/patients")
+        assert metrics.DB_SLOW_QUERIES.value("SELECT") >= 1
+        assert any("Slow query" in r.message and "Plan:" in r.message and "SCAN" in r.message for r in caplog.records)
+
+    def test_failed_explain_leaves_the_transaction_usable(self, tmp_path):
+        import sqlite3
+        conn = sqlite3.connect(tmp_path / "explain.db", isolation_level=None)
+        conn.execute("CREATE TABLE t (x INTEGER)")
+        conn.execute("BEGIN")
+        cursor = conn.execute("INSERT INTO t VALUES (1)")
+        # the savepoint path taken for server databases, exercised on SQLite
+        plan = metrics._explain(cursor, "SELECT * FROM missing", (), "postgresql")
+        assert plan.startswith("(EXPLAIN failed")
+        assert conn.in_transaction
+        conn.execute("COMMIT")
+        assert conn.execute("SELECT x FROM t").fetchall() == [(1,)]
+        conn.close()
+
+    def test_repeated_statement_flagged_as_n_plus_one(self, enabled, monkeypatch):
+        monkeypatch.setattr(metrics.settings, "METRICS_N_PLUS_ONE_THRESHOLD", 3)
+        stats = metrics.RequestStats()
+        stats.statements.update({"SELECT * FROM patients WHERE id = ?": 3, "SELECT 1": 1})
+        metrics.MetricsMiddleware._check_n_plus_one("/x", stats)
+        stats.statements = metrics.Tally({"SELECT 1": 2})
+        metrics.MetricsMiddleware._check_n_plus_one("/y", stats)
+        assert metrics.DB_N_PLUS_ONE.value("/x") == 1 and metrics.DB_N_PLUS_ONE.value("/y") == 0
+
+    def test_job_spans(self, enabled):
+        with metrics.span("etl", "patients"):
+            pass
+        with pytest.raises(RuntimeError):
+            with metrics.span("etl", "readings"):
+                raise RuntimeError
+        text = client.get("/metrics").text
+        assert 'job_phase_duration_seconds_count{job="etl",phase="patients"} 1' in text
+        assert 'job_phase_duration_seconds_count{job="etl",phase="readings"} 1' in text
@@ -22,4 +22,98 @@ class TestBiometricType:
         assert "size" in data
         assert "total" in data
         assert "items" in data
-        assert isinstance(data["items"], list)
\ No newline at end of file
+        assert isinstance(data["items"], list)
+
+    def test_list_patients_cursor(self):
+        from datetime import date
+        from app.db.session import SessionLocal
+        from app.db.models import Patient
+        db = SessionLocal()
+        for i in range(5):
+            db.add(Patient(name=f"P{i}", dob=date(1990, 1, 1), gender="other", email=f"cursor{i}@example.com"))
+        db.commit()
+        db.close()
+
+        data = client.get("/api/v1/patients?size=2").json()
+        ids = [p["id"] for p in data["items"]]
+        while data["next_cursor"]:
+            data = client.get(f"/api/v1/patients?size=2&cursor={data['next_cursor']}").json()
+            ids += [p["id"] for p in data["items"]]
+        assert ids == sorted(ids)
+        assert len(ids) == client.get("/api/v1/patients?include_total=true&cursor=" + data["prev_cursor"]).json()["total"]
+
+
+    def test_list_patients_projection(self):
+        data = client.get("/api/v1/patients?size=2&fields=email,name").json()
+        assert data["items"]
+        assert all(list(p) == ["email", "name"] for p in data["items"])
+
+
+class TestLiveStats:
+    def test_running_stats_match_batch_statistics(self):
+        import statistics
+        from app.analytics.live import RunningStats
+        values = [98.0, 102.5, 101.0, 97.5, 110.0, 95.0, 100.0]
+        stats = RunningStats()
+        for value in values + [250.0]:
+            stats.add(value, alpha=0.1)
+        stats.remove(250.0)
+        assert stats.count == len(values)
+        assert stats.mean == pytest.approx(statistics.mean(values))
+        assert stats.std == pytest.approx(statistics.stdev(values))
+
+    def test_outlier_flagged_on_ingest(self):
+        readings = [
+            {"patient_id": 40, "timestamp": f"2024-10-01T{hour:02d}:00:00", "type": "glucose", "value": 100 + (hour % 5)}
+            for hour in range(20)
+        ]
+        client.post("/api/v1/biometrics:batch", json=readings)
+
+        spike = client.post("/api/v1/biometrics", json={**readings[0], "timestamp": "2024-10-01T21:00:00", "value": 300}).json()
+        assert spike["outlier"] is True and spike["zscore"] > 3
+        history = client.get("/api/v1/biometrics?patient_id=40&size=2").json()["items"]
+        assert [item["outlier"] for item in history] == [True, False]
+
+        stats = client.get("/api/v1/patients/40/live-stats").json()["stats"]
+        assert [(s["type"], s["count"], s["outliers"], s["last_outlier"]) for s in stats] == [("glucose", 21, 1, True)]
+
+        client.delete(f"/api/v1/biometrics/{spike['id']}")
+        glucose = client.get("/api/v1/patients/40/live-stats").json()["stats"][0]
+        assert glucose["count"] == 20 and glucose["mean"] == pytest.approx(102)
+
+    def test_single_post_defers_rollups_to_the_analytics_run(self):
+        from app.analytics.run_hourly_analytics import run_hourly_analytics
+        reading = {"patient_id": 41, "timestamp": "2024-10-02T08:10:00", "type": "weight", "value": 70}
+        client.post("/api/v1/biometrics", json=reading)
+        client.post("/api/v1/biometrics", json={**reading, "timestamp": "2024-10-02T08:40:00", "value": 72})
+        client.post("/api/v1/biometrics", json={**reading, "value": 71})        # update
+
+        assert client.get("/api/v1/patients/41/live-stats").json()["stats"][0]["count"] == 2
+        series = "/api/v1/biometrics/series?patient_id=41&type=weight&bucket=hour"
+        assert client.get(series).json()["points"] == []
+
+        run_hourly_analytics()
+        point = client.get(series).json()["points"][0]
+        assert (point["count"], point["min"], point["max"]) == (2, 71, 72)
+        assert client.get("/api/v1/analytics?patient_id=41&metric=weight_min").json()[0]["value"] == 71
+
+    def test_schema_upgrade_adds_columns_to_existing_table(self, tmp_path):
+        from sqlalchemy import create_engine, inspect, text
+        from app.db.schema import create_schema
+        old = create_engine(f"sqlite:///{tmp_path / 'baseline.db'}")
+        with old.begin() as conn:
+            # biometrics as created before live statistics existed
+            conn.execute(text(
+                "CREATE TABLE biometrics (id INTEGER PRIMARY KEY, patient_id INTEGER NOT NULL, "
+                "timestamp DATETIME NOT NULL, type VARCHAR(14) NOT NULL, value FLOAT NOT NULL, "
+                "CONSTRAINT u_patient_time_type UNIQUE (patient_id, timestamp, type))"
+            ))
+            conn.execute(text("INSERT INTO biometrics VALUES (1, 1, '2024-01-01 00:00:00', 'glucose', 99.0)"))
+
+        added = create_schema(old)
+        assert {"biometrics.zscore", "biometrics.outlier", "ix_biometrics_patient_ts_id"} <= set(added)
+        assert create_schema(old) == []
+        assert {"zscore", "outlier"} <= {c["name"] for c in inspect(old).get_columns("biometrics")}
+        with old.connect() as conn:
+            assert conn.execute(text("SELECT value, zscore, outlier FROM biometrics")).all() == [(99.0, None, None)]
+        old.dispose()
@@ -1,6 +1,8 @@
 import pytest
 from datetime import date, datetime
-from app.etl.transform import validate_patient, normalize_reading
+from app.etl.transform import (
+    RejectReport, compile_header, normalize_reading, transform_rows, validate_patient, validate_patients,
+)
 class TestTransform:
     def test_validate_patient_valid(self):
         raw = {
@@ -71,4 +73,59 @@ class TestTransform:
             "timestamp": "2024-06-01T12:00:00",
         }
         result = normalize_reading(raw.copy())
-        assert result == []
\ No newline at end of file
+        assert result == []
+
+    def test_normalize_reading_maps_prefixed_columns(self):
+        raw = {
+            "patient_email": "a@b.com",
+            "timestamp": "2024-06-01T12:00:00",
+            "glucose_mg_dL": "110",
+            "bp_systolic": "120",
+            "bp_diastolic": "80",
+            "weight_kg": "68.5",
+        }
+        result = normalize_reading(raw)
+        assert [(r["type"], r["value"]) for r in result] == [
+            ("glucose", 110.0), ("systolic", 120.0), ("diastolic", 80.0), ("weight", 68.5)
+        ]
+
+
+class TestCompiledTransform:
+    def test_compile_header_with_aliases(self):
+        plan = compile_header(["timestamp", "patient_email", "sugar", "notes", "bp_systolic"], {"sugar": "glucose"})
+        assert (plan.email, plan.timestamp) == (1, 0)
+        assert plan.columns == ((2, "sugar", "glucose"), (4, "bp_systolic", "systolic"))
+        assert plan.ignored == ("notes",)
+
+    def test_compile_header_requires_email_and_timestamp(self):
+        with pytest.raises(ValueError):
+            compile_header(["timestamp", "glucose"])
+
+    def test_transform_rows_collects_rejects(self):
+        plan = compile_header(["patient_email", "timestamp", "glucose", "weight"])
+        rejects = RejectReport()
+        rows = [
+            ["a@b.com", "2024-06-01T12:00:00", "100", ""],
+            ["a@b.com", "yesterday", "100", "70"],
+            ["", "2024-06-01T12:00:00", "100", "70"],
+            ["a@b.com", "2024-06-01T13:00:00", "high", "70"],
+            ["a@b.com", "2024-06-01T14:00:00", "nan"],
+        ]
+        result = list(transform_rows(plan, rows, rejects, "r.csv"))
+        assert result == [
+            ("a@b.com", datetime(2024, 6, 1, 12), "glucose", 100.0),
+            ("a@b.com", datetime(2024, 6, 1, 13), "weight", 70.0),
+        ]
+        assert rejects.count == 4
+        assert rejects.reasons == {"invalid timestamp": 1, "missing email": 1, "invalid glucose": 2}
+        assert rejects.samples[0][:3] == ("r.csv", 3, "invalid timestamp")
+
+    def test_validate_patients_reports_instead_of_raising(self):
+        rejects = RejectReport()
+        valid = validate_patients([
+            {"dob": "2000-01-01", "email": "ok@example.com", "gender": "Female"},
+            {"dob": "2000-01-01", "email": "broken", "gender": "male"},
+            {"dob": "someday", "email": "x@example.com", "gender": "male"},
+        ], rejects)
+        assert [p["email"] for p in valid] == ["ok@example.com"]
+        assert rejects.count == 2